@@ -1,36 +1,68 @@
 import logging
-import sqlite3
 import re
 import requests
 import nest_asyncio
 import random
 import os
-import traceback
+import time
+import secrets
+import hashlib
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-import aiohttp
 import asyncio
 import httpx
 import sys
 import uvicorn
 from datetime import datetime, timedelta
-import schedule
-import threading
-import time
 import openai
 from contextlib import contextmanager
+from http_clients import http_clients
+from voice_pipeline import VoiceQueueFull, voice_pipeline
+from update_queue import UpdateQueue, update_chat_id
+from dedup import UpdateDeduplicator
+from cache import AsyncCache, TTLCache
+from streaming import ProgressiveMessage, StreamError, has_html_markup, iter_sse_deltas
+from rate_limit import KeyedTokenBucket, TokenBucket
+from broadcast import Broadcaster
+from broadcast_jobs import BroadcastJobs
+from scheduler import AsyncScheduler, RunLease
+from state_store import UserStateStore
+from db import Database
+from aroma_index import AromaIndex
+from note_matcher import NoteMatcher
+from log_config import log_sampled, setup_logging
+import metrics
+from metrics import timed
+from tracing import Tracer, current_trace_id, set_attributes, span, traced
+from usage import UsageTracker, extract_usage
+from admission import AdmissionController, AdmissionTimeout
+from coalescer import MessageCoalescer
 
-print('=== [LOG] 1.py импортирован ===')
+# --- Логирование ---
+# LOG_FORMAT=json — структурированные события; при LOG_QUEUE=1 в консоль пишет отдельный поток
+setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'text'),
+    use_queue=os.getenv('LOG_QUEUE', '1') == '1',
+)
+logger = logging.getLogger(__name__)
+# Доля обновлений, полное тело которых пишется на INFO (остальные — только на DEBUG)
+UPDATE_BODY_SAMPLE_RATE = float(os.getenv('UPDATE_BODY_SAMPLE_RATE', '0.01'))
+
+logger.info('=== [LOG] 1.py импортирован ===')
 
 # Импортируем систему контекста
 try:
     from context import add_user_message, add_assistant_message, get_user_context, clear_user_context
+    # Запись в контекст (журнал и снимок на диске) — отдельный этап в метриках
+    add_user_message = timed("context")(traced("context")(add_user_message))
+    add_assistant_message = timed("context")(traced("context")(add_assistant_message))
     CONTEXT_ENABLED = True
-    print('=== [LOG] Система контекста загружена ===')
+    logger.info('=== [LOG] Система контекста загружена ===')
 except ImportError:
     CONTEXT_ENABLED = False
-    print('=== [LOG] Система контекста недоступна ===')
+    logger.warning('=== [LOG] Система контекста недоступна ===')
 
 nest_asyncio.apply()
 
@@ -41,29 +73,30 @@ WEBHOOK_PATH = "/webhook/ai-bear-123456"
 OPENAI_API = os.getenv('OPENAI_API_KEY')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-5')
 OPENAI_FALLBACK_MODEL = os.getenv('OPENAI_FALLBACK_MODEL', 'gpt-4o-mini')
+OPENAI_MAX_OUTPUT_TOKENS = int(os.getenv('OPENAI_MAX_OUTPUT_TOKENS', '8192'))
 
 # --- FastAPI app ---
-print('=== [LOG] FastAPI app создаётся ===')
+logger.info('=== [LOG] FastAPI app создаётся ===')
 app = FastAPI()
-print('=== [LOG] FastAPI app создан ===')
+logger.info('=== [LOG] FastAPI app создан ===')
 
 # Глобальный обработчик исключений
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Global exception handler: {exc}\n{traceback.format_exc()}")
+    logger.error("Global exception handler: %s", exc, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal server error"}
     )
 
-print(f'=== [LOG] WEBHOOK_PATH: {WEBHOOK_PATH} ===')
+logger.info('=== [LOG] WEBHOOK_PATH: %s ===', WEBHOOK_PATH)
 
 @app.on_event("startup")
 async def log_routes():
     logger.info("=== ROUTES REGISTERED ===")
     for route in app.routes:
-        logger.info(f"{route.path} [{','.join(route.methods or [])}]")
-    logger.info(f"WEBHOOK_PATH: {WEBHOOK_PATH}")
+        logger.info("%s [%s]", route.path, ','.join(route.methods or []))
+    logger.info("WEBHOOK_PATH: %s", WEBHOOK_PATH)
     logger.info("=========================")
 
 # --- DeepSeek и данные Bahur ---
@@ -78,7 +111,7 @@ def load_bahur_data():
     try:
         # Проверяем, существует ли папка
         if not os.path.exists(data_dir):
-            print(f"Папка {data_dir} не найдена!")
+            logger.error("Папка %s не найдена!", data_dir)
             return "Данные не найдены"
         
         # Читаем все .txt файлы из папки
@@ -89,60 +122,77 @@ def load_bahur_data():
                     with open(file_path, "r", encoding="utf-8") as f:
                         file_content = f.read()
                         combined_data += f"\n\n=== {filename} ===\n{file_content}\n"
-                        print(f"Загружен файл: {filename}")
+                        logger.info("Загружен файл: %s", filename)
                 except Exception as e:
-                    print(f"Ошибка при чтении файла {filename}: {e}")
+                    logger.error("Ошибка при чтении файла %s: %s", filename, e)
         
         if not combined_data:
-            print("Не найдено ни одного .txt файла в папке bahur_data/")
+            logger.error("Не найдено ни одного .txt файла в папке bahur_data/")
             return "Данные не найдены"
         
-        print(f"Загружено {len(combined_data)} символов данных")
+        logger.info("Загружено %d символов данных", len(combined_data))
         return combined_data
         
     except Exception as e:
-        print(f"Ошибка при загрузке данных: {e}")
+        logger.error("Ошибка при загрузке данных: %s", e)
         return "Ошибка загрузки данных"
 
-# --- Логирование ---
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 # --- DeepSeek и данные Bahur ---
 BAHUR_DATA = load_bahur_data()
 
-# --- Состояния пользователей для AI (in-memory, not persistent) ---
-user_states = {}
+# --- Поисковый индекс по bahur_data (строится один раз при запуске) ---
+from retrieval import build_index, normalize_question
 
-# --- Постоянное хранение состояний пользователей ---
-import json
+BAHUR_TOP_K = int(os.getenv('BAHUR_TOP_K', '5'))
+BAHUR_CONTEXT_CHARS = int(os.getenv('BAHUR_CONTEXT_CHARS', '3000'))
+BAHUR_INDEX = build_index("bahur_data")
 
-def load_user_states():
-    try:
-        with open("user_states.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+BAHUR_NOT_FOUND = "По этому вопросу в данных BAHUR ничего не найдено."
+
+def get_relevant_bahur_data(question):
+    """Возвращает только те блоки bahur_data, которые относятся к вопросу"""
+    if not len(BAHUR_INDEX):
+        return BAHUR_DATA[:BAHUR_CONTEXT_CHARS]
+    relevant = BAHUR_INDEX.build_context(question, top_k=BAHUR_TOP_K, max_chars=BAHUR_CONTEXT_CHARS)
+    return relevant or BAHUR_NOT_FOUND
+
+# --- Кэш ответов на частые вопросы (доставка, рассрочка, фабрики, адрес) ---
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '500'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '21600'))
+# Потоковая генерация ответа с постепенным редактированием сообщения в Telegram
+OPENAI_STREAMING = os.getenv('OPENAI_STREAMING', '1') == '1'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+def response_cache_key(question, bahur_context):
+    """Ключ кэша: модель, хэш найденных блоков bahur_data и нормализованный вопрос (None — не кэшировать).
+
+    Предыстория в ключ не входит: ответ на вопрос о доставке или рассрочке определяется данными BAHUR.
+    Вопросы, по которым в данных ничего не нашлось (болтовня, «расскажи подробнее»), не кэшируются —
+    их ответ зависит от переписки.
+    """
+    normalized = normalize_question(question)
+    if not normalized or RESPONSE_CACHE_SIZE <= 0 or bahur_context == BAHUR_NOT_FOUND:
+        return None
+    return (OPENAI_MODEL, hashlib.sha1(bahur_context.encode("utf-8")).hexdigest(), normalized)
 
-def save_user_states(states):
-    with open("user_states.json", "w", encoding="utf-8") as f:
-        json.dump(states, f, ensure_ascii=False, indent=2)
+# --- База пользователей: одно соединение и отдельный поток для запросов ---
+bot_db = Database('bot_users.db')
+
+# --- Состояния пользователей: в памяти, с фоновой записью в bot_users.db ---
+# Старый user_states.json переносится в базу при первом запуске
+user_states = UserStateStore(
+    bot_db,
+    ttl=float(os.getenv('USER_STATE_TTL', str(7 * 24 * 3600))),
+    flush_interval=float(os.getenv('USER_STATE_FLUSH_INTERVAL', '1.0')),
+)
 
 def set_user_state(user_id, state):
-    global user_states
-    if state:
-        user_states[user_id] = state
-    else:
-        user_states.pop(user_id, None)
-    save_user_states(user_states)
+    user_states.set(user_id, state)
 
 def get_user_state(user_id):
-    global user_states
     return user_states.get(user_id)
 
-# Загружаем состояния при запуске
-user_states = load_user_states()
-
 # --- Модели для FastAPI ---
 class MessageModel(BaseModel):
     user_id: int
@@ -162,21 +212,63 @@ def greet():
     "Привет! 🌟🐆 Я AI-Пантера — знаю всё о духах BAHUR! Спрашивай про любые ароматы, масла, доставку или цены — найду в каталоге и помогу с выбором! 💫"
     ])
 
-async def ask_chatgpt(question, user_id=None):
+def save_assistant_answer(user_id, assistant_response):
+    """Сохраняет ответ ассистента в контекст пользователя"""
+    if CONTEXT_ENABLED and user_id:
+        try:
+            add_assistant_message(user_id, assistant_response)
+            logger.info("Ответ ассистента сохранен в контекст для пользователя %s", user_id)
+        except Exception as e:
+            logger.error("Ошибка при сохранении ответа в контекст: %s", e)
+
+async def stream_openai(url, headers, data, use_responses_api, on_delta, usage=None):
+    """Потоковый запрос к OpenAI: передаёт в on_delta список уже пришедших кусков, возвращает (ответ, текст); usage — в словарь usage"""
+    parts = []
+    data = {**data, "stream": True}
+    if not use_responses_api:
+        # Без этого Chat Completions не присылает usage в потоке
+        data["stream_options"] = {"include_usage": True}
+    async with http_clients.stream("openai", "POST", url, headers=headers, json=data) as resp:
+        if resp.status_code != 200:
+            # Тело ошибки читаем целиком, чтобы дальше обработать его как обычный ответ
+            return httpx.Response(resp.status_code, content=await resp.aread()), None
+        async for delta in iter_sse_deltas(resp, use_responses_api, usage):
+            parts.append(delta)
+            try:
+                await on_delta(parts)
+            except Exception as e:
+                logger.error("OpenAI stream: ошибка при показе промежуточного ответа: %s", e)
+        return resp, "".join(parts)
+
+def record_openai_usage(model, usage, started, user_id=None, api=None, status="ok"):
+    """Учитывает токены, стоимость и задержку запроса к OpenAI (и добавляет их в текущую трассу).
+    В базу запись попадает фоновой записью, ответ пользователю её не ждёт."""
+    latency = time.perf_counter() - started
+    if usage:
+        set_attributes(**extract_usage(usage))
+    openai_usage.record(model, usage, latency, user_id=user_id, api=api, status=status)
+
+@timed("openai")
+@traced("openai")
+async def ask_chatgpt(question, user_id=None, on_delta=None):
+    """Ответ AI-Пантеры; с on_delta ответ запрашивается потоком и передаётся по мере генерации"""
+    # Модель и API текущего запроса к OpenAI — для учёта расхода в ветках с исключениями
+    request_started = None
+    request_model, request_api = OPENAI_MODEL, None
     try:
         # Выбор API в зависимости от модели
         model_lower = (OPENAI_MODEL or "").lower()
         use_responses_api = model_lower.startswith("gpt-5") or model_lower.startswith("gpt-4.1") or model_lower.startswith("gpt-4o")
 
         url = "https://api.openai.com/v1/responses" if use_responses_api else "https://api.openai.com/v1/chat/completions"
-        logger.info(f"OpenAI: using {'responses' if use_responses_api else 'chat/completions'} API with model={OPENAI_MODEL}")
+        logger.info("OpenAI: using %s API with model=%s", 'responses' if use_responses_api else 'chat/completions', OPENAI_MODEL)
         headers = {
             "Authorization": f"Bearer {OPENAI_API}",
             "Content-Type": "application/json"
         }
         
-        # Ограничиваем размер bahur_data для контекста
-        bahur_data_limited = BAHUR_DATA[:3000]
+        # Берём из bahur_data только блоки, релевантные вопросу
+        bahur_data_relevant = get_relevant_bahur_data(question)
         
         system_content = (
             "🚨 КРИТИЧЕСКИ ВАЖНО: ВСЕ данные о парфюмерии, фабриках, ароматах, ценах, качестве, доставке, заказах БЕРИ ТОЛЬКО из данных BAHUR! НЕ выдумывай НИЧЕГО! Если информации нет - говори 'не знаю'! 🚨\n"
@@ -201,11 +293,12 @@ async def ask_chatgpt(question, user_id=None):
             "14. Если информации нет в данных BAHUR - говори что не знаешь, НЕ выдумывай!\n"
             "15. Старайся, просто делится информацией, не присылать им никие ссылки лишние, просто по делу, вопрос, ответ, всё остальное у них есть\n"
             "16. При упоминании ароматов, предлагай перейти в раздел меню.\n"
-            f"\n\nДанные компании (ограниченные):\n{bahur_data_limited}"
+            f"\n\nДанные компании (релевантные вопросу):\n{bahur_data_relevant}"
         )
         
         # Подготавливаем сообщения для API
         messages = [{"role": "system", "content": system_content}]
+        context_messages = []
         
         # Добавляем контекст если доступен
         if CONTEXT_ENABLED and user_id:
@@ -225,16 +318,26 @@ async def ask_chatgpt(question, user_id=None):
                 # Добавляем текущий вопрос
                 messages.append({"role": "user", "content": question})
                 
-                logger.info(f"Используется контекст для пользователя {user_id}: {len(context_messages)} сообщений")
+                logger.info("Используется контекст для пользователя %s: %s сообщений", user_id, len(context_messages))
                 
             except Exception as e:
-                logger.error(f"Ошибка при работе с контекстом: {e}")
+                logger.error("Ошибка при работе с контекстом: %s", e)
                 # Если контекст недоступен, используем только текущий вопрос
                 messages.append({"role": "user", "content": question})
         else:
             # Без контекста
             messages.append({"role": "user", "content": question})
         
+        # Частый вопрос по данным BAHUR — отвечаем из кэша, не обращаясь к модели
+        cache_key = response_cache_key(question, bahur_data_relevant)
+        if cache_key is not None:
+            cached_response = response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.info("OpenAI: ответ из кэша для '%s' (hit rate %.0f%%)", cache_key[2], response_cache.hit_rate() * 100)
+                set_attributes(cache_hit=True)
+                save_assistant_answer(user_id, cached_response)
+                return cached_response
+        
         if use_responses_api:
             # Преобразуем messages в формат Responses API
             responses_input = []
@@ -254,7 +357,7 @@ async def ask_chatgpt(question, user_id=None):
             data = {
                 "model": OPENAI_MODEL,
                 "input": responses_input,
-                "max_output_tokens": 8192,
+                "max_output_tokens": OPENAI_MAX_OUTPUT_TOKENS,
                 "reasoning": {"effort": "low"}
             }
             if system_instructions:
@@ -267,172 +370,246 @@ async def ask_chatgpt(question, user_id=None):
                 "max_tokens": 4000
             }
         
-        timeout = aiohttp.ClientTimeout(total=30)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, headers=headers, json=data) as resp:
-                if resp.status != 200:
-                    # Фолбэк, если у ключа нет прав для Responses API
-                    try:
-                        error_text = await resp.text()
-                    except Exception:
-                        error_text = ""
-                    if use_responses_api and resp.status == 401 and "api.responses.write" in (error_text or ""):
-                        logger.warning("No permissions for Responses API (missing api.responses.write). Falling back to chat/completions with fallback model.")
-                        # Собираем фолбэк-запрос
-                        fb_url = "https://api.openai.com/v1/chat/completions"
-                        fb_data = {
-                            "model": OPENAI_FALLBACK_MODEL,
-                            "messages": messages,
-                            "temperature": 0.8,
-                            "max_tokens": 1000
-                        }
-                        logger.info(f"OpenAI: fallback to chat/completions with model={OPENAI_FALLBACK_MODEL}")
-                        async with session.post(fb_url, headers=headers, json=fb_data) as fb_resp:
-                            if fb_resp.status != 200:
-                                logger.error(f"OpenAI API fallback error: {fb_resp.status} - {await fb_resp.text()}")
-                                return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
-                            fb_result = await fb_resp.json()
-                            if "choices" not in fb_result or not fb_result["choices"]:
-                                logger.error(f"OpenAI API fallback unexpected response: {fb_result}")
-                                return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
-                            assistant_response = fb_result["choices"][0]["message"]["content"].strip()
-                    else:
-                        logger.error(f"OpenAI API error: {resp.status} - {error_text}")
-                        return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
-                else:
-                    result = await resp.json()
-                    if use_responses_api:
-                        assistant_response = None
-                        if isinstance(result, dict):
-                            assistant_response = (result.get("output_text") or "").strip()
-                            if not assistant_response:
-                                output = result.get("output") or []
-                                if output and isinstance(output, list):
-                                    for item in output:
-                                        if item and isinstance(item, dict):
-                                            contents = item.get("content") or []
-                                            for c in contents:
-                                                if isinstance(c, dict):
-                                                    text_val = c.get("text") or c.get("output_text")
-                                                    if text_val:
-                                                        assistant_response = str(text_val).strip()
-                                                        break
-                                            if assistant_response:
+        api_name = "responses" if use_responses_api else "chat/completions"
+        set_attributes(
+            model=OPENAI_MODEL,
+            api=api_name,
+            prompt_chars=sum(len(m.get("content") or "") for m in messages),
+            context_messages=len(context_messages),
+            streaming=on_delta is not None and OPENAI_STREAMING,
+        )
+        streamed_response = None
+        stream_usage = {}
+        request_api = api_name
+        request_started = time.perf_counter()
+        if on_delta is not None and OPENAI_STREAMING:
+            resp, streamed_response = await stream_openai(url, headers, data, use_responses_api, on_delta, stream_usage)
+        else:
+            resp = await http_clients.post("openai", url, headers=headers, json=data)
+        if resp.status_code != 200:
+            record_openai_usage(OPENAI_MODEL, None, request_started, user_id, api_name, status=f"http_{resp.status_code}")
+            # Фолбэк, если у ключа нет прав для Responses API
+            try:
+                error_text = resp.text
+            except Exception:
+                error_text = ""
+            if use_responses_api and resp.status_code == 401 and "api.responses.write" in (error_text or ""):
+                logger.warning("No permissions for Responses API (missing api.responses.write). Falling back to chat/completions with fallback model.")
+                # Собираем фолбэк-запрос
+                fb_url = "https://api.openai.com/v1/chat/completions"
+                fb_data = {
+                    "model": OPENAI_FALLBACK_MODEL,
+                    "messages": messages,
+                    "temperature": 0.8,
+                    "max_tokens": 1000
+                }
+                logger.info("OpenAI: fallback to chat/completions with model=%s", OPENAI_FALLBACK_MODEL)
+                request_model, request_api = OPENAI_FALLBACK_MODEL, "chat/completions"
+                request_started = time.perf_counter()
+                fb_resp = await http_clients.post("openai", fb_url, headers=headers, json=fb_data)
+                if fb_resp.status_code != 200:
+                    metrics.count_error("openai", f"http_{fb_resp.status_code}")
+                    record_openai_usage(request_model, None, request_started, user_id, request_api,
+                                        status=f"http_{fb_resp.status_code}")
+                    logger.error("OpenAI API fallback error: %s - %s", fb_resp.status_code, fb_resp.text)
+                    return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+                fb_result = fb_resp.json()
+                record_openai_usage(request_model, fb_result.get("usage"), request_started, user_id, request_api)
+                if "choices" not in fb_result or not fb_result["choices"]:
+                    logger.error("OpenAI API fallback unexpected response: %s", fb_result)
+                    return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+                assistant_response = fb_result["choices"][0]["message"]["content"].strip()
+            else:
+                metrics.count_error("openai", f"http_{resp.status_code}")
+                logger.error("OpenAI API error: %s - %s", resp.status_code, error_text)
+                return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+        elif streamed_response is not None:
+            record_openai_usage(OPENAI_MODEL, stream_usage, request_started, user_id, api_name)
+            assistant_response = streamed_response.strip()
+            if not assistant_response:
+                logger.error("OpenAI stream finished without text")
+                return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+        else:
+            result = resp.json()
+            record_openai_usage(OPENAI_MODEL, result.get("usage") if isinstance(result, dict) else None,
+                                request_started, user_id, api_name)
+            if use_responses_api:
+                assistant_response = None
+                if isinstance(result, dict):
+                    assistant_response = (result.get("output_text") or "").strip()
+                    if not assistant_response:
+                        output = result.get("output") or []
+                        if output and isinstance(output, list):
+                            for item in output:
+                                if item and isinstance(item, dict):
+                                    contents = item.get("content") or []
+                                    for c in contents:
+                                        if isinstance(c, dict):
+                                            text_val = c.get("text") or c.get("output_text")
+                                            if text_val:
+                                                assistant_response = str(text_val).strip()
                                                 break
-                        if not assistant_response:
-                            logger.error(f"OpenAI Responses API unexpected response: {result}")
-                            return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
-                    else:
-                        if "choices" not in result or not result["choices"]:
-                            logger.error(f"OpenAI API unexpected response: {result}")
-                            return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
-                        assistant_response = result["choices"][0]["message"]["content"].strip()
-                
-                # Сохраняем ответ ассистента в контекст
-                if CONTEXT_ENABLED and user_id:
-                    try:
-                        add_assistant_message(user_id, assistant_response)
-                        logger.info(f"Ответ ассистента сохранен в контекст для пользователя {user_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при сохранении ответа в контекст: {e}")
-                
-                return assistant_response
-                
-    except asyncio.TimeoutError:
+                                    if assistant_response:
+                                        break
+                if not assistant_response:
+                    logger.error("OpenAI Responses API unexpected response: %s", result)
+                    return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+            else:
+                if "choices" not in result or not result["choices"]:
+                    logger.error("OpenAI API unexpected response: %s", result)
+                    return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+                assistant_response = result["choices"][0]["message"]["content"].strip()
+        
+        if cache_key is not None:
+            response_cache.set(cache_key, assistant_response)
+        save_assistant_answer(user_id, assistant_response)
+        return assistant_response
+        
+    except StreamError as e:
+        metrics.count_error("openai", e)
+        logger.error("OpenAI stream error: %s", e)
+        if request_started is not None:
+            record_openai_usage(request_model, None, request_started, user_id, request_api, status="stream_error")
+        return "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+    except httpx.TimeoutException as e:
+        metrics.count_error("openai", e)
         logger.error("OpenAI API timeout")
+        if request_started is not None:
+            record_openai_usage(request_model, None, request_started, user_id, request_api, status="timeout")
         return "Извините, запрос занял слишком много времени. Попробуйте еще раз."
-    except aiohttp.ClientError as e:
-        logger.error(f"OpenAI API client error: {e}")
+    except httpx.RequestError as e:
+        metrics.count_error("openai", e)
+        logger.error("OpenAI API client error: %s", e)
+        if request_started is not None:
+            record_openai_usage(request_model, None, request_started, user_id, request_api, status="request_error")
         return "Извините, произошла ошибка сети. Попробуйте еще раз."
     except Exception as e:
-        logger.error(f"OpenAI API unexpected error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("openai", e)
+        logger.error("OpenAI API unexpected error: %s", e, exc_info=True)
         return "Извините, произошла неожиданная ошибка. Попробуйте еще раз."
 
+@timed("search_note")
+@traced("search_note")
 async def search_note_api(note):
+    """Поиск аромата по ноте: API (через кэш); если API недоступен — поиск с опечатками по локальному каталогу"""
+    key = normalize_search_key(note)
+    if AROMA_INDEX_LOCAL_FIRST:
+        local = aroma_index.search(key, fuzzy=False)
+        if local:
+            return local
+    result = await note_search_cache.get(key)
+    if result.get("status") == "success":
+        aroma_index.learn(key, result)
+    elif result.get("status") == "error":
+        local = aroma_index.search(key)
+        if local:
+            logger.info("Search API unavailable, answered '%s' from local aroma index", key)
+            return local
+    return result
+
+async def fetch_note_api(note):
     try:
-        url = f"https://api.alexander-dev.ru/bahur/search/?text={note}"
-        timeout = aiohttp.ClientTimeout(total=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    logger.error(f"Search API error: {resp.status} - {await resp.text()}")
-                    return {"status": "error", "message": "Ошибка API"}
-                
-                result = await resp.json()
-                return result
+        url = "https://api.alexander-dev.ru/bahur/search/"
+        resp = await http_clients.get("search", url, params={"text": note})
+        if resp.status_code != 200:
+            metrics.count_error("search_note", f"http_{resp.status_code}")
+            logger.error("Search API error: %s - %s", resp.status_code, resp.text)
+            return {"status": "error", "message": "Ошибка API"}
+        
+        result = resp.json()
+        return result
                 
-    except asyncio.TimeoutError:
+    except httpx.TimeoutException as e:
+        metrics.count_error("search_note", e)
         logger.error("Search API timeout")
         return {"status": "error", "message": "Таймаут запроса"}
-    except aiohttp.ClientError as e:
-        logger.error(f"Search API client error: {e}")
+    except httpx.RequestError as e:
+        metrics.count_error("search_note", e)
+        logger.error("Search API client error: %s", e)
         return {"status": "error", "message": "Ошибка сети"}
     except Exception as e:
-        logger.error(f"Search API unexpected error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("search_note", e)
+        logger.error("Search API unexpected error: %s", e, exc_info=True)
         return {"status": "error", "message": "Неожиданная ошибка"}
 
 # --- Telegram sendMessage ---
 async def telegram_send_message(chat_id, text, reply_markup=None, parse_mode="HTML"):
+    return await telegram_send_message_id(chat_id, text, reply_markup, parse_mode) is not None
+
+@timed("telegram.sendMessage")
+@traced("telegram.sendMessage")
+async def telegram_send_message_id(chat_id, text, reply_markup=None, parse_mode="HTML"):
+    """Отправляет сообщение и возвращает его message_id (None при ошибке)"""
     try:
         url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
         payload = {
             "chat_id": chat_id,
-            "text": text,
-            "parse_mode": parse_mode
+            "text": text
         }
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
         if reply_markup:
             payload["reply_markup"] = reply_markup
         
-        timeout = httpx.Timeout(30.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.post(url, json=payload)
-            if resp.status_code != 200:
-                logger.error(f"Telegram API error: {resp.status_code} - {resp.text}")
-                return False
-            return True
+        resp = await http_clients.post("telegram", url, endpoint="sendMessage", json=payload)
+        if resp.status_code != 200:
+            metrics.count_error("telegram.sendMessage", f"http_{resp.status_code}")
+            logger.error("Telegram API error: %s - %s", resp.status_code, resp.text)
+            return None
+        return resp.json().get("result", {}).get("message_id")
             
-    except httpx.TimeoutException:
+    except httpx.TimeoutException as e:
+        metrics.count_error("telegram.sendMessage", e)
         logger.error("Telegram API timeout")
-        return False
+        return None
     except httpx.RequestError as e:
-        logger.error(f"Telegram API request error: {e}")
-        return False
+        metrics.count_error("telegram.sendMessage", e)
+        logger.error("Telegram API request error: %s", e)
+        return None
     except Exception as e:
-        logger.error(f"Telegram API unexpected error: {e}\n{traceback.format_exc()}")
-        return False
+        metrics.count_error("telegram.sendMessage", e)
+        logger.error("Telegram API unexpected error: %s", e, exc_info=True)
+        return None
 
 # --- Telegram editMessage ---
+@timed("telegram.editMessageText")
+@traced("telegram.editMessageText")
 async def telegram_edit_message(chat_id, message_id, text, reply_markup=None, parse_mode="HTML"):
     try:
         url = f"https://api.telegram.org/bot{TOKEN}/editMessageText"
         payload = {
             "chat_id": chat_id,
             "message_id": message_id,
-            "text": text,
-            "parse_mode": parse_mode
+            "text": text
         }
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
         if reply_markup:
             payload["reply_markup"] = reply_markup
         
-        timeout = httpx.Timeout(30.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.post(url, json=payload)
-            if resp.status_code != 200:
-                logger.error(f"Telegram editMessage API error: {resp.status_code} - {resp.text}")
-                return False
-            return True
+        resp = await http_clients.post("telegram", url, endpoint="editMessageText", json=payload)
+        if resp.status_code != 200:
+            metrics.count_error("telegram.editMessageText", f"http_{resp.status_code}")
+            logger.error("Telegram editMessage API error: %s - %s", resp.status_code, resp.text)
+            return False
+        return True
             
-    except httpx.TimeoutException:
+    except httpx.TimeoutException as e:
+        metrics.count_error("telegram.editMessageText", e)
         logger.error("Telegram editMessage API timeout")
         return False
     except httpx.RequestError as e:
-        logger.error(f"Telegram editMessage API request error: {e}")
+        metrics.count_error("telegram.editMessageText", e)
+        logger.error("Telegram editMessage API request error: %s", e)
         return False
     except Exception as e:
-        logger.error(f"Telegram editMessage API unexpected error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("telegram.editMessageText", e)
+        logger.error("Telegram editMessage API unexpected error: %s", e, exc_info=True)
         return False
 
 # --- Telegram answerCallbackQuery ---
+@timed("telegram.answerCallbackQuery")
+@traced("telegram.answerCallbackQuery")
 async def telegram_answer_callback_query(callback_query_id, text=None, show_alert=False):
     try:
         url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
@@ -444,138 +621,179 @@ async def telegram_answer_callback_query(callback_query_id, text=None, show_aler
         if show_alert:
             payload["show_alert"] = show_alert
         
-        timeout = httpx.Timeout(10.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.post(url, json=payload)
-            if resp.status_code != 200:
-                logger.error(f"Telegram answerCallbackQuery API error: {resp.status_code} - {resp.text}")
-                return False
-            return True
+        resp = await http_clients.post("telegram", url, endpoint="answerCallbackQuery", json=payload)
+        if resp.status_code != 200:
+            metrics.count_error("telegram.answerCallbackQuery", f"http_{resp.status_code}")
+            logger.error("Telegram answerCallbackQuery API error: %s - %s", resp.status_code, resp.text)
+            return False
+        return True
             
-    except httpx.TimeoutException:
+    except httpx.TimeoutException as e:
+        metrics.count_error("telegram.answerCallbackQuery", e)
         logger.error("Telegram answerCallbackQuery API timeout")
         return False
     except httpx.RequestError as e:
-        logger.error(f"Telegram answerCallbackQuery API request error: {e}")
+        metrics.count_error("telegram.answerCallbackQuery", e)
+        logger.error("Telegram answerCallbackQuery API request error: %s", e)
         return False
     except Exception as e:
-        logger.error(f"Telegram answerCallbackQuery API unexpected error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("telegram.answerCallbackQuery", e)
+        logger.error("Telegram answerCallbackQuery API unexpected error: %s", e, exc_info=True)
         return False
 
 # --- Поиск по ID аромата ---
+@timed("search_id")
+@traced("search_id")
 async def search_by_id_api(aroma_id):
+    """Поиск аромата по ID: локальный каталог, затем API (через кэш)"""
+    local = aroma_index.get(aroma_id)
+    if local:
+        return local
+    result = await id_search_cache.get(normalize_search_key(aroma_id))
+    aroma_index.learn(None, result)
+    return result
+
+async def fetch_by_id_api(aroma_id):
     try:
-        url = f"https://api.alexander-dev.ru/bahur/search/?id={aroma_id}"
-        timeout = aiohttp.ClientTimeout(total=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    logger.error(f"Search by ID API error: {resp.status} - {await resp.text()}")
-                    return {"status": "error", "message": "Ошибка API"}
-                
-                result = await resp.json()
-                return result
+        url = "https://api.alexander-dev.ru/bahur/search/"
+        resp = await http_clients.get("search", url, params={"id": aroma_id})
+        if resp.status_code != 200:
+            metrics.count_error("search_id", f"http_{resp.status_code}")
+            logger.error("Search by ID API error: %s - %s", resp.status_code, resp.text)
+            return {"status": "error", "message": "Ошибка API"}
+        
+        result = resp.json()
+        return result
                 
-    except asyncio.TimeoutError:
+    except httpx.TimeoutException as e:
+        metrics.count_error("search_id", e)
         logger.error("Search by ID API timeout")
         return {"status": "error", "message": "Таймаут запроса"}
-    except aiohttp.ClientError as e:
-        logger.error(f"Search by ID API client error: {e}")
+    except httpx.RequestError as e:
+        metrics.count_error("search_id", e)
+        logger.error("Search by ID API client error: %s", e)
         return {"status": "error", "message": "Ошибка сети"}
     except Exception as e:
-        logger.error(f"Search by ID API unexpected error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("search_id", e)
+        logger.error("Search by ID API unexpected error: %s", e, exc_info=True)
         return {"status": "error", "message": "Неожиданная ошибка"}
 
+# --- Кэш поискового API: популярные ноты и только что показанные ароматы не запрашиваются повторно ---
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '2000'))
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '3600'))
+# Сколько ещё можно отдавать устаревший результат, пока в фоне идёт обновление
+SEARCH_CACHE_STALE_TTL = float(os.getenv('SEARCH_CACHE_STALE_TTL', '86400'))
+
+def normalize_search_key(value):
+    """Ключ кэша: нижний регистр, одиночные пробелы, без знаков препинания по краям"""
+    return " ".join(str(value).lower().split()).strip(" .,!?;:'\"«»")
+
+def is_cacheable_search_result(result):
+    # Ошибки сети и API не кэшируем
+    return isinstance(result, dict) and result.get("status") != "error"
+
+# --- Локальный каталог ароматов: снапшот + всё, что вернул поисковый API ---
+AROMA_INDEX_FILE = os.getenv('AROMA_INDEX_FILE', 'aroma_index.json')
+# 1 — известные ноты отдаются из каталога без обращения к API. Включать только с полным снапшотом,
+# выгруженным извне: выученные из ответов API ноты так навсегда застынут на первых найденных ароматах.
+# По умолчанию каталог — запасной вариант, когда API недоступен
+AROMA_INDEX_LOCAL_FIRST = os.getenv('AROMA_INDEX_LOCAL_FIRST', '0') == '1'
+AROMA_INDEX_REFRESH_CRON = os.getenv('AROMA_INDEX_REFRESH_CRON', '*/10 * * * *')
+aroma_index = AromaIndex(AROMA_INDEX_FILE)
+
+async def refresh_aroma_index():
+    """Перечитывает снапшот, если его обновили извне, и дописывает в него выученные ароматы"""
+    if await asyncio.to_thread(aroma_index.reload_if_changed):
+        logger.info("Aroma index reloaded from snapshot")
+    await asyncio.to_thread(aroma_index.save)
+
+note_search_cache = AsyncCache(
+    fetch_note_api, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+    stale_ttl=SEARCH_CACHE_STALE_TTL, cacheable=is_cacheable_search_result,
+)
+id_search_cache = AsyncCache(
+    fetch_by_id_api, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+    stale_ttl=SEARCH_CACHE_STALE_TTL, cacheable=is_cacheable_search_result,
+)
+
 # --- Обработка голосовых сообщений ---
-async def recognize_voice_content(file_content):
-    """Распознаёт речь из байтового содержимого ogg-файла. Возвращает текст или строку-ошибку."""
+# Более длинные сообщения не скачиваются и не распознаются
+VOICE_MAX_DURATION = int(os.getenv('VOICE_MAX_DURATION', '3600'))
+VOICE_TOO_LONG_REPLY = f"Голосовое сообщение слишком длинное. Максимальная продолжительность: {VOICE_MAX_DURATION // 60} мин."
+
+@timed("voice")
+@traced("voice")
+async def recognize_voice_content(file_content, duration=0):
+    """Распознаёт речь из байтового содержимого ogg-файла в пуле воркеров. Возвращает текст или строку-ошибку."""
     try:
-        import speech_recognition as sr
-        from pydub import AudioSegment
-        import tempfile
-        recognizer = sr.Recognizer()
-        with tempfile.NamedTemporaryFile(suffix='.ogg') as temp_ogg, tempfile.NamedTemporaryFile(suffix='.wav') as temp_wav:
-            temp_ogg.write(file_content)
-            temp_ogg.flush()
-            try:
-                audio = AudioSegment.from_file(temp_ogg.name)
-                audio.export(temp_wav.name, format='wav')
-                temp_wav.flush()
-            except Exception as audio_error:
-                logger.error(f"Audio conversion error: {audio_error}")
-                return "Ошибка при обработке аудио файла. Попробуйте еще раз или напишите текст."
-            try:
-                with sr.AudioFile(temp_wav.name) as source:
-                    audio_data = recognizer.record(source)
-                text_content = recognizer.recognize_google(audio_data, language='ru-RU')
-                logger.info(f"Voice recognized: '{text_content}'")
-                return text_content
-            except sr.UnknownValueError:
-                logger.error("Speech recognition could not understand audio")
-                return "Не удалось разобрать речь. Попробуйте говорить четче или напишите текст."
-            except sr.RequestError as e:
-                logger.error(f"Speech recognition service error: {e}")
-                return "Ошибка сервиса распознавания речи. Попробуйте еще раз или напишите текст."
+        return await voice_pipeline.recognize(file_content, duration)
+    except VoiceQueueFull as e:
+        metrics.count_error("voice", e)
+        logger.warning("Voice queue is full: %s jobs waiting", voice_pipeline.get_stats()['queue_depth'])
+        return "Распознавание речи сейчас недоступно: слишком много голосовых сообщений. Попробуйте чуть позже или напишите текст."
+    except asyncio.TimeoutError as e:
+        metrics.count_error("voice", e)
+        logger.error("Speech recognition timeout")
+        return "Ошибка: распознавание заняло слишком много времени. Попробуйте еще раз или напишите текст."
     except Exception as e:
-        logger.error(f"Speech recognition error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("voice", e)
+        logger.error("Speech recognition error: %s", e, exc_info=True)
         return "Ошибка при обработке голосового сообщения."
 
-async def process_voice_message(voice, chat_id):
+async def process_voice_message(voice, chat_id, user_id=None):
     try:
         # Получаем информацию о файле
         file_id = voice["file_id"]
         file_unique_id = voice["file_unique_id"]
         duration = voice.get("duration", 0)
         
+        # Слишком длинные сообщения отклоняем до скачивания и распознавания
+        if duration > VOICE_MAX_DURATION:
+            await telegram_send_message(chat_id, VOICE_TOO_LONG_REPLY)
+            return {"ok": True}
+        
         # Получаем файл
         file_url = f"https://api.telegram.org/bot{TOKEN}/getFile?file_id={file_id}"
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(file_url)
-            if resp.status_code != 200:
-                logger.error(f"Failed to get file info: {resp.status_code}")
-                return None
-            
-            file_info = resp.json()
-            if not file_info.get("ok"):
-                logger.error(f"File info error: {file_info}")
+        resp = await http_clients.get("telegram", file_url, endpoint="getFile")
+        if resp.status_code != 200:
+            metrics.count_error("voice", f"http_{resp.status_code}")
+            logger.error("Failed to get file info: %s", resp.status_code)
+            return None
+        
+        file_info = resp.json()
+        if not file_info.get("ok"):
+            logger.error("File info error: %s", file_info)
+            return None
+        
+        file_path = file_info["result"]["file_path"]
+        file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
+        
+        # Скачиваем файл
+        async with http_clients.stream("telegram", "GET", file_url, endpoint="file_download") as response:
+            if response.status_code != 200:
+                metrics.count_error("voice", f"http_{response.status_code}")
+                logger.error("Failed to download file: %s", response.status_code)
                 return None
             
-            file_path = file_info["result"]["file_path"]
-            file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-            
-            # Скачиваем файл
-            async with client.stream("GET", file_url) as response:
-                if response.status_code != 200:
-                    logger.error(f"Failed to download file: {response.status_code}")
-                    return None
-                
-                # Читаем содержимое файла
-                file_content = await response.aread()
-                
-                # Распознаем речь с использованием tempfile
-                text_content = await recognize_voice_content(file_content)
-                # Если результат не ошибка, отправляем в дипсик
-                if text_content and not any(err in text_content for err in ["Ошибка", "Не удалось", "недоступно"]):
-                    # Проверяем лимит продолжительности голосового сообщения (3600 секунд = 1 час)
-                    if duration > 3600:
-                        await telegram_send_message(chat_id, "Голосовое сообщение слишком длинное. Максимальная продолжительность: 1 час.")
-                        return {"ok": True}
-                    
-                    ai_answer = await ask_chatgpt(text_content)
-                    ai_answer = ai_answer.replace('*', '')
-                    buttons = extract_links_from_text(ai_answer)
-                    ai_answer_clean = remove_html_links(ai_answer)
-                    success = await telegram_send_message(chat_id, ai_answer_clean, buttons if buttons else None)
-                    if success:
-                        logger.info(f"[TG] Sent AI answer to voice message for {chat_id}")
-                    else:
-                        logger.error(f"[TG] Failed to send AI answer to voice message for {chat_id}")
-                else:
-                    await telegram_send_message(chat_id, text_content)
-                return {"ok": True}
-                
+            # Читаем содержимое файла
+            file_content = await response.aread()
+        
+        # Распознаем речь
+        text_content = await recognize_voice_content(file_content, duration)
+        # Если результат не ошибка, отправляем в дипсик
+        if text_content and not any(err in text_content for err in ["Ошибка", "Не удалось", "недоступно"]):
+            success = await send_ai_answer(chat_id, text_content, user_id)
+            if success:
+                logger.info("[TG] Sent AI answer to voice message for %s", chat_id)
+            else:
+                logger.error("[TG] Failed to send AI answer to voice message for %s", chat_id)
+        else:
+            await telegram_send_message(chat_id, text_content)
+        return {"ok": True}
+        
     except Exception as e:
-        logger.error(f"Voice processing error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("voice", e)
+        logger.error("Voice processing error: %s", e, exc_info=True)
         return "Ошибка при обработке голосового сообщения."
 
 # --- Альтернативная обработка голосовых сообщений (без aifc) ---
@@ -590,42 +808,46 @@ async def process_voice_message_alternative(voice, chat_id):
         # Если голосовое сообщение слишком короткое
         if duration < 1:
             return "Голосовое сообщение слишком короткое. Попробуйте записать более длинное сообщение."
+        if duration > VOICE_MAX_DURATION:
+            return VOICE_TOO_LONG_REPLY
         
         # Получаем файл
         file_url = f"https://api.telegram.org/bot{TOKEN}/getFile?file_id={file_id}"
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(file_url)
-            if resp.status_code != 200:
-                logger.error(f"Failed to get file info: {resp.status_code}")
-                return None
-            
-            file_info = resp.json()
-            if not file_info.get("ok"):
-                logger.error(f"File info error: {file_info}")
+        resp = await http_clients.get("telegram", file_url, endpoint="getFile")
+        if resp.status_code != 200:
+            metrics.count_error("voice", f"http_{resp.status_code}")
+            logger.error("Failed to get file info: %s", resp.status_code)
+            return None
+        
+        file_info = resp.json()
+        if not file_info.get("ok"):
+            logger.error("File info error: %s", file_info)
+            return None
+        
+        file_path = file_info["result"]["file_path"]
+        file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
+        
+        # Скачиваем файл
+        async with http_clients.stream("telegram", "GET", file_url, endpoint="file_download") as response:
+            if response.status_code != 200:
+                metrics.count_error("voice", f"http_{response.status_code}")
+                logger.error("Failed to download file: %s", response.status_code)
                 return None
             
-            file_path = file_info["result"]["file_path"]
-            file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-            
-            # Скачиваем файл
-            async with client.stream("GET", file_url) as response:
-                if response.status_code != 200:
-                    logger.error(f"Failed to download file: {response.status_code}")
-                    return None
-                
-                # Читаем содержимое файла
-                file_content = await response.aread()
-                
-                # Пытаемся распознать речь без aifc
-                text_content = await recognize_voice_content(file_content)
-                if text_content and not any(err in text_content for err in ["Ошибка", "Не удалось", "недоступно"]):
-                    ai_answer = await ask_chatgpt(text_content)
-                    return ai_answer
-                else:
-                    return text_content
-                
+            # Читаем содержимое файла
+            file_content = await response.aread()
+        
+        # Пытаемся распознать речь без aifc
+        text_content = await recognize_voice_content(file_content, duration)
+        if text_content and not any(err in text_content for err in ["Ошибка", "Не удалось", "недоступно"]):
+            ai_answer = await ask_chatgpt(text_content)
+            return ai_answer
+        else:
+            return text_content
+        
     except Exception as e:
-        logger.error(f"Alternative voice processing error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("voice", e)
+        logger.error("Alternative voice processing error: %s", e, exc_info=True)
         return "Ошибка при обработке голосового сообщения."
 
 # --- Упрощенная обработка голосовых сообщений (без распознавания) ---
@@ -642,25 +864,28 @@ async def process_voice_message_simple(voice, chat_id):
         
         # Получаем файл
         file_url = f"https://api.telegram.org/bot{TOKEN}/getFile?file_id={file_id}"
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(file_url)
-            if resp.status_code != 200:
-                logger.error(f"Failed to get file info: {resp.status_code}")
-                return None
-            
-            file_info = resp.json()
-            if not file_info.get("ok"):
-                logger.error(f"File info error: {file_info}")
-                return None
+        resp = await http_clients.get("telegram", file_url, endpoint="getFile")
+        if resp.status_code != 200:
+            metrics.count_error("voice", f"http_{resp.status_code}")
+            logger.error("Failed to get file info: %s", resp.status_code)
+            return None
+        
+        file_info = resp.json()
+        if not file_info.get("ok"):
+            logger.error("File info error: %s", file_info)
+            return None
+        
+        # Просто возвращаем информацию о голосовом сообщении
+        return f"Получено голосовое сообщение длительностью {duration} секунд. Для распознавания речи напишите ваш вопрос текстом."
             
-            # Просто возвращаем информацию о голосовом сообщении
-            return f"Получено голосовое сообщение длительностью {duration} секунд. Для распознавания речи напишите ваш вопрос текстом."
-                
     except Exception as e:
-        logger.error(f"Simple voice processing error: {e}\n{traceback.format_exc()}")
+        metrics.count_error("voice", e)
+        logger.error("Simple voice processing error: %s", e, exc_info=True)
         return "Ошибка при обработке голосового сообщения."
 
 # --- Функция "печатает" ---
+@timed("telegram.sendChatAction")
+@traced("telegram.sendChatAction")
 async def send_typing_action(chat_id):
     try:
         url = f"https://api.telegram.org/bot{TOKEN}/sendChatAction"
@@ -668,52 +893,25 @@ async def send_typing_action(chat_id):
             "chat_id": chat_id,
             "action": "typing"
         }
-        timeout = httpx.Timeout(5.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.post(url, json=payload)
-            if resp.status_code != 200:
-                logger.error(f"Failed to send typing action: {resp.status_code} - {resp.text}")
+        resp = await http_clients.post("telegram", url, endpoint="sendChatAction", json=payload)
+        if resp.status_code != 200:
+            metrics.count_error("telegram.sendChatAction", f"http_{resp.status_code}")
+            logger.error("Failed to send typing action: %s - %s", resp.status_code, resp.text)
     except Exception as e:
-        logger.error(f"Failed to send typing action: {e}")
+        metrics.count_error("telegram.sendChatAction", e)
+        logger.error("Failed to send typing action: %s", e)
 
 # --- Умное распознавание нот ---
+# Словарь нот из notes.txt и ноты из локального каталога ароматов
+note_matcher = NoteMatcher.from_file(os.getenv('NOTES_FILE', 'notes.txt'), extra=aroma_index.notes)
+
+def match_note(text):
+    """Возвращает ноту, упомянутую в тексте, или None"""
+    return note_matcher.match(text)
+
 def is_likely_note(text):
     """Определяет, похож ли текст на название ноты"""
-    if not text:
-        return False
-    
-    # Список популярных нот
-    common_notes = [
-        'ваниль', 'лаванда', 'роза', 'жасмин', 'сандал', 'мускус', 'амбра', 'пачули',
-        'бергамот', 'лимон', 'апельсин', 'мандарин', 'грейпфрут', 'лайм',
-        'клубника', 'малина', 'черника', 'вишня', 'персик', 'абрикос', 'яблоко',
-        'груша', 'ананас', 'манго', 'банан', 'кокос', 'карамель', 'шоколад',
-        'кофе', 'чай', 'мята', 'базилик', 'розмарин', 'тимьян', 'орегано',
-        'корица', 'кардамон', 'имбирь', 'куркума', 'перец', 'гвоздика',
-        'кедр', 'сосна', 'ель', 'дуб', 'береза', 'иланг-иланг', 'нероли',
-        'ирис', 'фиалка', 'ландыш', 'сирень', 'жасмин', 'гардения',
-        'морская соль', 'морской бриз', 'дождь', 'снег', 'земля', 'мох',
-        'дым', 'кожа', 'табак', 'виски', 'коньяк', 'ром', 'вино',
-        'мед', 'сливки', 'молоко', 'йогурт', 'сыр', 'масло'
-    ]
-    
-    text_lower = text.lower().strip()
-    
-    # Проверяем точное совпадение
-    if text_lower in common_notes:
-        return True
-    
-    # Проверяем частичное совпадение
-    for note in common_notes:
-        if note in text_lower or text_lower in note:
-            return True
-    
-    # Проверяем по длине и характеру (короткие слова часто бывают нотами)
-    if len(text_lower) <= 15 and not any(char.isdigit() for char in text_lower):
-        # Если текст короткий и не содержит цифр, возможно это нота
-        return True
-    
-    return False
+    return note_matcher.is_likely_note(text)
 
 # --- Обработка ссылок в тексте ---
 import re
@@ -742,14 +940,102 @@ def remove_html_links(text):
     link_pattern = r"<a\s+href=['\"][^'\"]+['\"][^>]*>([^<]+)</a>"
     return re.sub(link_pattern, r"\1", text)
 
+# --- Допуск вопросов к AI: лимит на пользователя и на одновременные запросы к OpenAI ---
+AI_USER_RATE_PER_MINUTE = float(os.getenv('AI_USER_RATE_PER_MINUTE', '4'))
+AI_USER_BURST = float(os.getenv('AI_USER_BURST', '3'))
+# coalesce — дождаться лимита и ответить на накопившиеся сообщения одним ответом; reply — сразу короткий отказ
+AI_ADMISSION_POLICY = os.getenv('AI_ADMISSION_POLICY', 'coalesce')
+AI_RATE_LIMIT_REPLY = "🐆 Не так быстро! Я ещё обдумываю прошлые вопросы — спроси через минутку."
+AI_BUSY_REPLY = "🐆 Сейчас очень много вопросов, попробуй ещё раз через минуту."
+
+ai_admission = AdmissionController(
+    KeyedTokenBucket(rate=AI_USER_RATE_PER_MINUTE / 60, capacity=AI_USER_BURST),
+    max_concurrent=int(os.getenv('AI_MAX_CONCURRENT', '8')),
+    queue_timeout=float(os.getenv('AI_QUEUE_TIMEOUT', '20')),
+    max_wait=float(os.getenv('AI_COALESCE_MAX_WAIT', '15')),
+)
+
+# Вопрос, присланный несколькими сообщениями подряд, собирается в один ход диалога:
+# после сообщения ждём COALESCE_WINDOW секунд тишины в чате (не дольше COALESCE_MAX_WAIT); 0 — не ждать
+message_coalescer = MessageCoalescer(
+    window=float(os.getenv('COALESCE_WINDOW', '1.0')),
+    max_wait=float(os.getenv('COALESCE_MAX_WAIT', '4.0')),
+)
+
+def take_queued_ai_questions(chat_id, user_id):
+    """Забирает из очереди чата следующие подряд текстовые вопросы к AI от того же пользователя"""
+    if user_id is None or get_user_state(user_id) not in (None, 'awaiting_ai_question'):
+        return []
+
+    def is_ai_question(update):
+        message = update.get("message") or {}
+        text = (message.get("text") or "").strip()
+        return (message.get("from", {}).get("id") == user_id and bool(text)
+                and not text.startswith("/") and not message.get("voice"))
+
+    taken = update_queue.take_queued(chat_id, is_ai_question)
+    # Трассы забранных обновлений ждут воркера, который до них уже не дойдёт: завершаем их здесь
+    merged_into = current_trace_id()
+    for update in taken:
+        trace = tracer.claim(update.get("update_id"))
+        if trace is not None:
+            trace.attributes.update(type="message", merged_into=merged_into)
+            tracer.finish(trace)
+    if taken:
+        set_attributes(merged_update_ids=[update.get("update_id") for update in taken])
+    return [update["message"]["text"].strip() for update in taken]
+
+async def send_ai_answer(chat_id, question, user_id=None):
+    """Отвечает AI-Пантерой, если пользователь не превысил лимит вопросов и есть свободный слот OpenAI"""
+    key = user_id if user_id is not None else chat_id
+    if user_id is not None and message_coalescer.window > 0:
+        await message_coalescer.settle(chat_id)
+        queued = take_queued_ai_questions(chat_id, user_id)
+        if queued:
+            message_coalescer.record(len(queued))
+            logger.info("[TG] Merged %d consecutive messages from %s into one question", len(queued), key)
+            question = "\n".join([question, *queued])
+    if not ai_admission.admit(key):
+        if AI_ADMISSION_POLICY == 'coalesce' and await ai_admission.wait_admit(key):
+            # Пока ждали лимит, пользователь мог дописать ещё — отвечаем на всё одним запросом
+            queued = take_queued_ai_questions(chat_id, user_id)
+            if queued:
+                logger.info("[TG] Coalesced %d queued questions for %s", len(queued), key)
+                question = "\n".join([question, *queued])
+        else:
+            logger.info("[TG] AI rate limit for %s", key)
+            return await telegram_send_message(chat_id, AI_RATE_LIMIT_REPLY, parse_mode=None)
+    try:
+        async with ai_admission.slot():
+            return await stream_ai_answer(chat_id, question, user_id)
+    except AdmissionTimeout as e:
+        logger.warning("[TG] %s, chat %s", e, chat_id)
+        return await telegram_send_message(chat_id, AI_BUSY_REPLY, parse_mode=None)
+
+async def stream_ai_answer(chat_id, question, user_id=None):
+    """Отвечает AI-Пантерой: показывает ответ по мере генерации, в конце — HTML и кнопки-ссылки"""
+    progress = ProgressiveMessage(
+        send=lambda text: telegram_send_message_id(chat_id, text, parse_mode=None),
+        edit=lambda message_id, text: telegram_edit_message(chat_id, message_id, text, parse_mode=None),
+        interval=STREAM_EDIT_INTERVAL,
+    )
+    ai_answer = await ask_chatgpt(question, user_id, on_delta=progress.update)
+    ai_answer = ai_answer.replace('*', '')
+    buttons = extract_links_from_text(ai_answer)
+    ai_answer_clean = remove_html_links(ai_answer)
+    if progress.message_id is None:
+        return await telegram_send_message(chat_id, ai_answer_clean, buttons if buttons else None)
+    logger.info("[TG] Streamed answer to %s: %s edits", chat_id, progress.edits)
+    # Превью показано простым текстом: без правки в HTML теги и сущности (&amp;) остались бы на экране как есть
+    if ai_answer_clean.strip() == progress.shown_text and not buttons and not has_html_markup(ai_answer_clean):
+        return True
+    return await telegram_edit_message(chat_id, progress.message_id, ai_answer_clean, buttons if buttons else None)
+
 # --- Инициализация базы данных для еженедельных сообщений ---
 def init_database():
     """Инициализация базы данных для хранения пользователей и еженедельных сообщений"""
-    conn = sqlite3.connect('bot_users.db')
-    cursor = conn.cursor()
-    
     # Создаем таблицу пользователей если не существует
-    cursor.execute('''
+    bot_db.run_sync(lambda conn: conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
             chat_id INTEGER,
@@ -760,52 +1046,59 @@ def init_database():
             last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             weekly_message_sent TIMESTAMP
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    '''))
 
-def add_user_to_db(user_id, chat_id, first_name=None, last_name=None, username=None):
+@timed("db")
+@traced("db")
+async def add_user_to_db(user_id, chat_id, first_name=None, last_name=None, username=None):
     """Добавляет пользователя в базу данных"""
-    conn = sqlite3.connect('bot_users.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    await bot_db.execute('''
         INSERT OR REPLACE INTO users 
         (user_id, chat_id, first_name, last_name, username, last_activity)
         VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
     ''', (user_id, chat_id, first_name, last_name, username))
-    
-    conn.commit()
-    conn.close()
 
-def get_all_active_users():
-    """Получает всех активных пользователей для еженедельной рассылки"""
-    conn = sqlite3.connect('bot_users.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT user_id, chat_id FROM users 
-        WHERE is_active = 1
-    ''')
-    
-    users = cursor.fetchall()
-    conn.close()
-    return users
-
-def update_weekly_message_sent(user_id):
-    """Обновляет время отправки еженедельного сообщения"""
-    conn = sqlite3.connect('bot_users.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+@timed("db")
+@traced("db")
+async def update_weekly_message_sent(user_ids):
+    """Обновляет время отправки еженедельного сообщения для пачки пользователей одной транзакцией"""
+    await bot_db.executemany('''
         UPDATE users 
         SET weekly_message_sent = CURRENT_TIMESTAMP
         WHERE user_id = ?
-    ''', (user_id,))
-    
-    conn.commit()
-    conn.close()
+    ''', [(user_id,) for user_id in user_ids])
+
+@timed("db")
+@traced("db")
+async def deactivate_users(user_ids):
+    """Отключает рассылку пользователям, которые заблокировали бота"""
+    await bot_db.executemany('''
+        UPDATE users 
+        SET is_active = 0
+        WHERE user_id = ?
+    ''', [(user_id,) for user_id in user_ids])
+    logger.info("Deactivated %s users who blocked the bot", len(user_ids))
+
+# --- Рассылка: лимиты Telegram — около 30 сообщений в секунду всего и 1 в секунду в один чат ---
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '500'))
+
+async def telegram_send_broadcast_message(chat_id, text):
+    """sendMessage для рассылки: возвращает ответ целиком, чтобы обработать 429 и 403"""
+    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
+    payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+    return await http_clients.post("telegram", url, endpoint="sendMessage", json=payload)
+
+broadcaster = Broadcaster(
+    send=telegram_send_broadcast_message,
+    global_limiter=TokenBucket(rate=BROADCAST_RATE),
+    per_chat_limiter=KeyedTokenBucket(rate=1.0, capacity=1.0),
+    concurrency=BROADCAST_CONCURRENCY,
+    batch_size=BROADCAST_BATCH_SIZE,
+    on_sent=update_weekly_message_sent,
+    on_blocked=deactivate_users,
+)
 
 async def send_weekly_message():
     """Отправляет еженедельное сообщение всем активным пользователям"""
@@ -820,133 +1113,148 @@ async def send_weekly_message():
     ]
     
     message = random.choice(weekly_messages)
-    users = get_all_active_users()
     
-    successful_sends = 0
-    failed_sends = 0
-    
-    for user_id, chat_id in users:
-        try:
-            success = await telegram_send_message(chat_id, message)
-            if success:
-                update_weekly_message_sent(user_id)
-                successful_sends += 1
-                logger.info(f"Weekly message sent to user {user_id}")
-                # Небольшая задержка между отправками
-                await asyncio.sleep(0.1)
-            else:
-                failed_sends += 1
-                logger.error(f"Failed to send weekly message to user {user_id}")
-        except Exception as e:
-            failed_sends += 1
-            logger.error(f"Error sending weekly message to user {user_id}: {e}")
-    
-    logger.info(f"Weekly message broadcast completed. Success: {successful_sends}, Failed: {failed_sends}")
+    # Рассылка идёт как сохраняемое задание и после перезапуска продолжится с места остановки
+    job_id = await broadcast_jobs.create(message)
+    await broadcast_jobs.wait(job_id)
+    job = await broadcast_jobs.get(job_id)
+    logger.info("Weekly message broadcast completed. Success: %s, Blocked: %s, Failed: %s", job['sent'], job['blocked'], job['failed'])
+
+# --- Планировщик: по умолчанию каждый понедельник в 7:00 (время сервера) ---
+WEEKLY_MESSAGE_CRON = os.getenv('WEEKLY_MESSAGE_CRON', '0 7 * * 1')
+WEEKLY_MESSAGE_JITTER = float(os.getenv('WEEKLY_MESSAGE_JITTER', '60'))
 
 def schedule_weekly_messages():
-    """Планирует еженедельные сообщения каждый понедельник в 7:00"""
-    schedule.every().monday.at("07:00").do(lambda: asyncio.create_task(send_weekly_message()))
-    
-    def run_scheduler():
-        while True:
-            schedule.run_pending()
-            time.sleep(60)  # Проверяем каждую минуту
-    
-    # Запускаем планировщик в отдельном потоке
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
-    logger.info("Weekly message scheduler started - messages will be sent every Monday at 7:00 AM")
+    """Планирует еженедельные сообщения; запуск выполняет только один воркер"""
+    scheduler.add("weekly_message", WEEKLY_MESSAGE_CRON, send_weekly_message, jitter=WEEKLY_MESSAGE_JITTER)
+    scheduler.add("aroma_index_refresh", AROMA_INDEX_REFRESH_CRON, refresh_aroma_index, exclusive=False)
+    scheduler.add("openai_usage_prune", USAGE_PRUNE_CRON, openai_usage.prune)
+    scheduler.start()
+    logger.info("Weekly message scheduler started - schedule '%s'", WEEKLY_MESSAGE_CRON)
+
+# Расход токенов OpenAI (таблица openai_usage в bot_users.db); старые записи удаляются раз в сутки
+openai_usage = UsageTracker(bot_db, retention_days=float(os.getenv('USAGE_RETENTION_DAYS', '30')))
+USAGE_PRUNE_CRON = os.getenv('USAGE_PRUNE_CRON', '30 3 * * *')
 
 # Инициализируем базу данных при запуске
 init_database()
+openai_usage.init_table()
+
+# Задания рассылки (таблица broadcast_jobs в bot_users.db)
+broadcast_jobs = BroadcastJobs(broadcaster, bot_db, page_size=BROADCAST_BATCH_SIZE)
+broadcast_jobs.init_table()
+
+# Планировщик на event loop приложения; захват запуска — в bot_users.db
+run_lease = RunLease(bot_db)
+run_lease.init_table()
+scheduler = AsyncScheduler(lease=run_lease)
+
+# Трассы обновлений: медленные (дольше TRACE_SLOW_THRESHOLD секунд) доступны в /admin/traces
+tracer = Tracer(
+    slow_threshold=float(os.getenv('TRACE_SLOW_THRESHOLD', '2.0')),
+    capacity=int(os.getenv('TRACE_BUFFER_SIZE', '200')),
+)
 
 # --- Telegram webhook endpoint ---
-print('=== [LOG] Объявляю эндпоинт webhook... ===')
+logger.info('=== [LOG] Объявляю эндпоинт webhook... ===')
 @app.post("/webhook/ai-bear-123456")
 async def telegram_webhook(update: dict, request: Request):
-    logger.info(f"=== WEBHOOK CALLED ===")
-    logger.info(f"Request from: {request.client.host}")
-    logger.info(f"Update type: {list(update.keys()) if update else 'None'}")
+    update_id = update.get('update_id') if update else None
+    logger.debug("Webhook from %s, update keys: %s", request.client.host, list(update.keys()) if update else None)
+    # Трасса обновления начинается здесь и продолжается в воркере очереди (process_update)
+    trace = tracer.start("update", update_id=update_id)
     
-    try:
-        result = await telegram_webhook_impl(update, request)
-        logger.info(f"=== WEBHOOK COMPLETED SUCCESSFULLY ===")
-        return result
-    except Exception as e:
-        logger.error(f"=== WEBHOOK FAILED: {e} ===")
-        logger.error(traceback.format_exc())
-        return {"ok": False, "error": str(e)}
+    with tracer.activate(trace, finish=False), span("webhook"):
+        # Повторная доставка уже принятого обновления — ничего не делаем
+        if update_dedup.is_duplicate(update):
+            logger.info("Webhook duplicate update_id=%s", update_id, extra={"event": "webhook_duplicate", "update_id": update_id})
+            trace.attributes["duplicate"] = True
+            tracer.finish(trace)
+            return {"ok": True}
+        
+        # Сразу подтверждаем получение, обработка идёт в фоновых воркерах
+        tracer.park(update_id, trace)
+        if not update_queue.enqueue(update):
+            logger.error("Webhook rejected update_id=%s: update queue is full (%d)", update_id, update_queue.depth(),
+                         extra={"event": "webhook_rejected", "update_id": update_id, "trace_id": trace.trace_id})
+            update_dedup.forget(update)
+            tracer.claim(update_id)
+            trace.attributes["rejected"] = True
+            tracer.finish(trace)
+            # Не 200 — Telegram повторит доставку позже
+            return JSONResponse(status_code=503, content={"ok": False, "error": "Update queue is full"})
+        if "message" in update:
+            message_coalescer.touch(update_chat_id(update))
+        depth = update_queue.depth()
+        logger.info("Webhook queued update_id=%s (depth %d)", update_id, depth,
+                    extra={"event": "webhook_queued", "update_id": update_id, "queue_depth": depth, "trace_id": trace.trace_id})
+        return {"ok": True}
 
 # --- Переносим вашу логику webhook сюда ---
-async def telegram_webhook_impl(update: dict, request: Request):
-    print(f'[WEBHOOK] Called: {request.url} from {request.client.host}')
-    print(f'[WEBHOOK] Body: {update}')
-    logger.info(f"[WEBHOOK] Called: {request.url} from {request.client.host}")
-    logger.info(f"[WEBHOOK] Body: {update}")
+async def telegram_webhook_impl(update: dict, request: Request = None):
+    if request is not None:
+        logger.debug("[WEBHOOK] Called: %s from %s", request.url, request.client.host)
+    # Полное тело обновления — только на DEBUG и в небольшой доле запросов на INFO
+    log_sampled(logger, UPDATE_BODY_SAMPLE_RATE, "[WEBHOOK] Body: %s", update)
     try:
         if "message" in update:
-            print('[WEBHOOK] message detected')
             message = update["message"]
             chat_id = message["chat"]["id"]
             user_id = message["from"]["id"]
             text = message.get("text", "").strip()
             voice = message.get("voice")
             state = get_user_state(user_id)
-            logger.info(f"[TG] user_id: {user_id}, text: {text}, state: {state}")
+            logger.info("[TG] user_id: %s, text: %s, state: %s", user_id, text, state)
             
             try:
                 # Обработка голосовых сообщений
                 if voice:
-                    logger.info(f"[TG] Voice message received from {user_id}")
+                    logger.info("[TG] Voice message received from %s", user_id)
                     await send_typing_action(chat_id)
                     file_id = voice["file_id"]
                     file_unique_id = voice["file_unique_id"]
                     duration = voice.get("duration", 0)
+                    # Слишком длинные сообщения отклоняем до скачивания и распознавания
+                    if duration > VOICE_MAX_DURATION:
+                        await telegram_send_message(chat_id, VOICE_TOO_LONG_REPLY)
+                        return {"ok": True}
                     file_url = f"https://api.telegram.org/bot{TOKEN}/getFile?file_id={file_id}"
-                    async with httpx.AsyncClient() as client:
-                        resp = await client.get(file_url)
-                        if resp.status_code != 200:
-                            logger.error(f"Failed to get file info: {resp.status_code}")
-                            await telegram_send_message(chat_id, "Ошибка при получении голосового файла.")
-                            return {"ok": True}
-                        file_info = resp.json()
-                        if not file_info.get("ok"):
-                            logger.error(f"File info error: {file_info}")
-                            await telegram_send_message(chat_id, "Ошибка при получении голосового файла.")
+                    resp = await http_clients.get("telegram", file_url, endpoint="getFile")
+                    if resp.status_code != 200:
+                        metrics.count_error("voice", f"http_{resp.status_code}")
+                        logger.error("Failed to get file info: %s", resp.status_code)
+                        await telegram_send_message(chat_id, "Ошибка при получении голосового файла.")
+                        return {"ok": True}
+                    file_info = resp.json()
+                    if not file_info.get("ok"):
+                        logger.error("File info error: %s", file_info)
+                        await telegram_send_message(chat_id, "Ошибка при получении голосового файла.")
+                        return {"ok": True}
+                    file_path = file_info["result"]["file_path"]
+                    file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
+                    async with http_clients.stream("telegram", "GET", file_url, endpoint="file_download") as response:
+                        if response.status_code != 200:
+                            metrics.count_error("voice", f"http_{response.status_code}")
+                            logger.error("Failed to download file: %s", response.status_code)
+                            await telegram_send_message(chat_id, "Ошибка при скачивании голосового файла.")
                             return {"ok": True}
-                        file_path = file_info["result"]["file_path"]
-                        file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-                        async with client.stream("GET", file_url) as response:
-                            if response.status_code != 200:
-                                logger.error(f"Failed to download file: {response.status_code}")
-                                await telegram_send_message(chat_id, "Ошибка при скачивании голосового файла.")
-                                return {"ok": True}
-                            file_content = await response.aread()
-                            text_content = await recognize_voice_content(file_content)
-                            logger.info(f"[TG] Voice recognized text: {text_content}")
-                            if text_content and not any(err in text_content for err in ["Ошибка", "Не удалось", "недоступно"]):
-                                # Проверяем лимит продолжительности голосового сообщения (3600 секунд = 1 час)
-                                if duration > 3600:
-                                    await telegram_send_message(chat_id, "Голосовое сообщение слишком длинное. Максимальная продолжительность: 1 час.")
-                                    return {"ok": True}
-                                
-                                ai_answer = await ask_chatgpt(text_content)
-                                ai_answer = ai_answer.replace('*', '')
-                                buttons = extract_links_from_text(ai_answer)
-                                ai_answer_clean = remove_html_links(ai_answer)
-                                success = await telegram_send_message(chat_id, ai_answer_clean, buttons if buttons else None)
-                                if success:
-                                    logger.info(f"[TG] Sent AI answer to voice message for {chat_id}")
-                                else:
-                                    logger.error(f"[TG] Failed to send AI answer to voice message for {chat_id}")
-                            else:
-                                await telegram_send_message(chat_id, text_content)
+                        file_content = await response.aread()
+                    text_content = await recognize_voice_content(file_content, duration)
+                    logger.debug("[TG] Voice recognized text: %r", text_content)
+                    if text_content and not any(err in text_content for err in ["Ошибка", "Не удалось", "недоступно"]):
+                        success = await send_ai_answer(chat_id, text_content, user_id)
+                        if success:
+                            logger.info("[TG] Sent AI answer to voice message for %s", chat_id)
+                        else:
+                            logger.error("[TG] Failed to send AI answer to voice message for %s", chat_id)
+                    else:
+                        await telegram_send_message(chat_id, text_content)
                     return {"ok": True}
                 
                 if text == "/start":
                     # Добавляем пользователя в базу данных
                     user_info = message.get("from", {})
-                    add_user_to_db(
+                    await add_user_to_db(
                         user_id, 
                         chat_id, 
                         user_info.get("first_name"), 
@@ -978,9 +1286,9 @@ async def telegram_webhook_impl(update: dict, request: Request):
                     }
                     success = await telegram_send_message(chat_id, welcome, main_menu)
                     if success:
-                        logger.info(f"[TG] Sent welcome to {chat_id}")
+                        logger.info("[TG] Sent welcome to %s", chat_id)
                     else:
-                        logger.error(f"[TG] Failed to send welcome to {chat_id}")
+                        logger.error("[TG] Failed to send welcome to %s", chat_id)
                     set_user_state(user_id, 'awaiting_ai_question')  # По умолчанию включаем режим AI
                     return {"ok": True}
                 elif text == "/menu":
@@ -1009,31 +1317,25 @@ async def telegram_webhook_impl(update: dict, request: Request):
                     }
                     success = await telegram_send_message(chat_id, welcome, main_menu)
                     if success:
-                        logger.info(f"[TG] Sent menu to {chat_id}")
+                        logger.info("[TG] Sent menu to %s", chat_id)
                     else:
-                        logger.error(f"[TG] Failed to send menu to {chat_id}")
+                        logger.error("[TG] Failed to send menu to %s", chat_id)
                     set_user_state(user_id, 'awaiting_ai_question')  # По умолчанию режим AI
                     return {"ok": True}
                 if state == 'awaiting_ai_question':
-                    logger.info(f"[TG] Processing AI question for user {user_id}")
+                    logger.info("[TG] Processing AI question for user %s", user_id)
                     # Отправляем индикатор "печатает"
                     await send_typing_action(chat_id)
-                    ai_answer = await ask_chatgpt(text, user_id)
-                    ai_answer = ai_answer.replace('*', '')
-                    
-                    # Извлекаем ссылки из ответа и создаем кнопки
-                    buttons = extract_links_from_text(ai_answer)
-                    ai_answer_clean = remove_html_links(ai_answer)
-                    
-                    success = await telegram_send_message(chat_id, ai_answer_clean, buttons if buttons else None)
+                    # Ответ показывается по мере генерации, ссылки превращаются в кнопки в конце
+                    success = await send_ai_answer(chat_id, text, user_id)
                     if success:
-                        logger.info(f"[TG] Sent ai_answer to {chat_id}")
+                        logger.info("[TG] Sent ai_answer to %s", chat_id)
                     else:
-                        logger.error(f"[TG] Failed to send ai_answer to {chat_id}")
+                        logger.error("[TG] Failed to send ai_answer to %s", chat_id)
                     # НЕ сбрасываем состояние - остаемся в режиме AI
                     return {"ok": True}
                 if state == 'awaiting_note_search':
-                    logger.info(f"[TG] Processing note search for user {user_id}")
+                    logger.info("[TG] Processing note search for user %s", user_id)
                     # Отправляем индикатор "печатает"
                     await send_typing_action(chat_id)
                     result = await search_note_api(text)
@@ -1050,33 +1352,30 @@ async def telegram_webhook_impl(update: dict, request: Request):
                         }
                         success = await telegram_send_message(chat_id, msg, reply_markup)
                         if success:
-                            logger.info(f"[TG] Sent note result to {chat_id}")
+                            logger.info("[TG] Sent note result to %s", chat_id)
                         else:
-                            logger.error(f"[TG] Failed to send note result to {chat_id}")
+                            logger.error("[TG] Failed to send note result to %s", chat_id)
                     else:
                         success = await telegram_send_message(chat_id, "Ничего не найдено по этой ноте 😢")
                         if success:
-                            logger.info(f"[TG] Sent not found to {chat_id}")
+                            logger.info("[TG] Sent not found to %s", chat_id)
                         else:
-                            logger.error(f"[TG] Failed to send not found to {chat_id}")
+                            logger.error("[TG] Failed to send not found to %s", chat_id)
                     set_user_state(user_id, 'awaiting_ai_question')  # Возвращаемся в режим AI по умолчанию
                     return {"ok": True}
                 # По умолчанию: всегда отвечаем как AI-Пантера
-                logger.info(f"[TG] Default to AI mode for user {user_id}")
+                logger.info("[TG] Default to AI mode for user %s", user_id)
                 await send_typing_action(chat_id)
-                ai_answer = await ask_chatgpt(text, user_id)
-                ai_answer = ai_answer.replace('*', '')
-                buttons = extract_links_from_text(ai_answer)
-                ai_answer_clean = remove_html_links(ai_answer)
-                success = await telegram_send_message(chat_id, ai_answer_clean, buttons if buttons else None)
+                success = await send_ai_answer(chat_id, text, user_id)
                 if success:
-                    logger.info(f"[TG] Sent default AI answer to {chat_id}")
+                    logger.info("[TG] Sent default AI answer to %s", chat_id)
                 else:
-                    logger.error(f"[TG] Failed to send default AI answer to {chat_id}")
+                    logger.error("[TG] Failed to send default AI answer to %s", chat_id)
                 set_user_state(user_id, 'awaiting_ai_question')  # Фиксируем режим AI как стандартный
                 return {"ok": True}
             except Exception as e:
-                logger.error(f"[TG] Exception in message processing: {e}\n{traceback.format_exc()}")
+                logger.error("[TG] Exception in message processing: %s", e, exc_info=True)
+                metrics.count_error("update", e)
                 try:
                     await telegram_send_message(chat_id, "Произошла ошибка при обработке сообщения. Попробуйте еще раз.")
                 except:
@@ -1084,23 +1383,22 @@ async def telegram_webhook_impl(update: dict, request: Request):
                 return {"ok": False, "error": str(e)}
                 
         elif "callback_query" in update:
-            print('[WEBHOOK] callback_query detected')
             callback = update["callback_query"]
             data = callback["data"]
             chat_id = callback["message"]["chat"]["id"]
             user_id = callback["from"]["id"]
             message_id = callback["message"]["message_id"]
             callback_id = callback["id"]
-            logger.info(f"[TG] Callback: {data} from {user_id}")
+            logger.info("[TG] Callback: %s from %s", data, user_id)
             
             try:
                 if data == "instruction":
                     set_user_state(user_id, 'awaiting_note_search')
                     success = await telegram_edit_message(chat_id, message_id, '🍉 Напиши любую ноту (например, апельсин, клубника) — я найду ароматы с этой нотой!')
                     if success:
-                        logger.info(f"[TG] Set state awaiting_note_search for {user_id}")
+                        logger.info("[TG] Set state awaiting_note_search for %s", user_id)
                     else:
-                        logger.error(f"[TG] Failed to edit instruction message for {chat_id}")
+                        logger.error("[TG] Failed to edit instruction message for %s", chat_id)
                     await telegram_answer_callback_query(callback_id)
                     return {"ok": True}
                 elif data == "ai":
@@ -1113,9 +1411,9 @@ async def telegram_webhook_impl(update: dict, request: Request):
                     
                     success = await telegram_edit_message(chat_id, message_id, ai_greeting_clean, buttons if buttons else None)
                     if success:
-                        logger.info(f"[TG] Set state awaiting_ai_question for {user_id}")
+                        logger.info("[TG] Set state awaiting_ai_question for %s", user_id)
                     else:
-                        logger.error(f"[TG] Failed to edit ai greeting for {chat_id}")
+                        logger.error("[TG] Failed to edit ai greeting for %s", chat_id)
                     await telegram_answer_callback_query(callback_id)
                     return {"ok": True}
                 elif data.startswith("repeatapi_"):
@@ -1134,56 +1432,100 @@ async def telegram_webhook_impl(update: dict, request: Request):
                         }
                         success = await telegram_edit_message(chat_id, message_id, msg, reply_markup)
                         if success:
-                            logger.info(f"[TG] Edited repeatapi result for {chat_id}")
+                            logger.info("[TG] Edited repeatapi result for %s", chat_id)
                         else:
-                            logger.error(f"[TG] Failed to edit repeatapi result for {chat_id}")
+                            logger.error("[TG] Failed to edit repeatapi result for %s", chat_id)
                     else:
                         success = await telegram_edit_message(chat_id, message_id, "Ничего не найдено по этой ноте 😢")
                         if success:
-                            logger.info(f"[TG] Edited repeatapi not found for {chat_id}")
+                            logger.info("[TG] Edited repeatapi not found for %s", chat_id)
                         else:
-                            logger.error(f"[TG] Failed to edit repeatapi not found for {chat_id}")
+                            logger.error("[TG] Failed to edit repeatapi not found for %s", chat_id)
                     await telegram_answer_callback_query(callback_id)
                     return {"ok": True}
                 else:
                     success = await telegram_send_message(chat_id, "Callback обработан.")
                     if success:
-                        logger.info(f"[TG] Sent generic callback to {chat_id}")
+                        logger.info("[TG] Sent generic callback to %s", chat_id)
                     else:
-                        logger.error(f"[TG] Failed to send generic callback to {chat_id}")
+                        logger.error("[TG] Failed to send generic callback to %s", chat_id)
                     return {"ok": True}
             except Exception as e:
-                logger.error(f"[TG] Exception in callback processing: {e}\n{traceback.format_exc()}")
+                logger.error("[TG] Exception in callback processing: %s", e, exc_info=True)
+                metrics.count_error("update", e)
                 try:
                     await telegram_send_message(chat_id, "Произошла ошибка при обработке callback. Попробуйте еще раз.")
                 except:
                     logger.error("Failed to send error message to user")
                 return {"ok": False, "error": str(e)}
         else:
-            print('[WEBHOOK] unknown update type')
             logger.warning("[TG] Unknown update type")
             return {"ok": False}
     except Exception as e:
-        print(f'[WEBHOOK] Exception: {e}')
-        logger.error(f"[TG] Exception in webhook: {e}\n{traceback.format_exc()}")
+        logger.error("[TG] Exception in webhook: %s", e, exc_info=True)
+        metrics.count_error("update", e)
         # Не пытаемся отправлять сообщение пользователю здесь, так как у нас нет chat_id
         return {"ok": False, "error": str(e)}
-print('=== [LOG] Эндпоинт webhook объявлен ===')
+logger.info('=== [LOG] Эндпоинт webhook объявлен ===')
+
+# --- Очередь обработки обновлений ---
+async def process_update(update: dict):
+    """Обрабатывает обновление из очереди (вызывается воркерами UpdateQueue)"""
+    update_type = "message" if "message" in update else "callback_query" if "callback_query" in update else "other"
+    started = time.perf_counter()
+    trace = tracer.claim(update.get('update_id')) or tracer.start("update", update_id=update.get('update_id'))
+    trace.attributes.update(type=update_type, queued_ms=round(trace.duration * 1000, 1))
+    try:
+        with tracer.activate(trace):
+            result = await telegram_webhook_impl(update)
+    finally:
+        metrics.update_duration.observe(time.perf_counter() - started, update_type)
+    if isinstance(result, dict) and not result.get("ok", True):
+        logger.error("Update %s processed with error: %s", update.get('update_id'), result.get('error'))
+    return result
+
+update_queue = UpdateQueue(
+    process_update,
+    workers=int(os.getenv('UPDATE_WORKERS', '8')),
+    maxsize=int(os.getenv('UPDATE_QUEUE_SIZE', '1000')),
+)
+UPDATE_DRAIN_TIMEOUT = float(os.getenv('UPDATE_DRAIN_TIMEOUT', '25'))
+
+# --- Защита от повторной доставки обновлений (по update_id) ---
+update_dedup = UpdateDeduplicator(
+    ttl=float(os.getenv('DEDUP_TTL', '3600')),
+    maxsize=int(os.getenv('DEDUP_MAXSIZE', '100000')),
+    db=bot_db if os.getenv('DEDUP_PERSIST', '1') == '1' else None,
+    flush_interval=float(os.getenv('DEDUP_FLUSH_INTERVAL', '1.0')),
+)
 
 # --- Установка Telegram webhook ---
 async def set_telegram_webhook(base_url: str):
     url = f"https://api.telegram.org/bot{TOKEN}/setWebhook"
     webhook_url = f"{base_url}{WEBHOOK_PATH}"
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, data={"url": webhook_url})
-        logger.info(f"Set webhook response: {resp.text}")
-        return resp.json()
+    resp = await http_clients.post("telegram", url, endpoint="setWebhook", data={"url": webhook_url})
+    logger.info("Set webhook response: %s", resp.text)
+    return resp.json()
 
 # --- Эндпоинты FastAPI ---
 @app.on_event("startup")
 async def startup_event():
     logger.info("=== STARTUP EVENT ===")
     
+    # Общие HTTP-клиенты с пулами соединений
+    await http_clients.start()
+    
+    # Пул распознавания голосовых сообщений вне event loop
+    voice_pipeline.start()
+    
+    # Воркеры очереди обновлений Telegram и фоновая запись update_id
+    update_queue.start()
+    update_dedup.start()
+    openai_usage.start()
+    
+    # Продолжаем рассылки, прерванные перезапуском
+    await broadcast_jobs.resume_unfinished()
+    
     # Запускаем планировщик еженедельных сообщений
     schedule_weekly_messages()
     
@@ -1193,15 +1535,26 @@ async def startup_event():
         return
     try:
         result = await set_telegram_webhook(base_url)
-        logger.info(f"Webhook set result: {result}")
+        logger.info("Webhook set result: %s", result)
     except Exception as e:
-        logger.error(f"Failed to set webhook: {e}\n{traceback.format_exc()}")
+        logger.error("Failed to set webhook: %s", e, exc_info=True)
     logger.info("=== STARTUP EVENT COMPLETE ===")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("=== SHUTDOWN EVENT ===")
     logger.info("Application is shutting down gracefully...")
+    # Дорабатываем уже принятые обновления, пока HTTP-клиенты ещё открыты
+    await update_queue.stop(timeout=UPDATE_DRAIN_TIMEOUT)
+    await voice_pipeline.stop()
+    await scheduler.stop()
+    await broadcast_jobs.stop()
+    await http_clients.close()
+    await update_dedup.stop()
+    await openai_usage.stop()
+    user_states.close()
+    aroma_index.save()
+    bot_db.close()
     logger.info("=== SHUTDOWN EVENT COMPLETE ===")
 
 @app.get("/")
@@ -1209,16 +1562,159 @@ async def healthcheck():
     logger.info("Healthcheck requested")
     return PlainTextResponse("OK")
 
+@app.get("/stats/http")
+async def http_stats():
+    return JSONResponse(http_clients.get_stats())
+
+@app.get("/stats/updates")
+async def update_stats():
+    return JSONResponse(update_queue.get_stats())
+
+@app.get("/stats/responses")
+async def response_cache_stats():
+    return JSONResponse(response_cache.get_stats())
+
+@app.get("/stats/broadcast")
+async def broadcast_stats():
+    return JSONResponse(broadcaster.last_stats or {})
+
+@app.get("/stats/scheduler")
+async def scheduler_stats():
+    return JSONResponse(scheduler.get_stats())
+
+@app.get("/stats/states")
+async def user_state_stats():
+    return JSONResponse(user_states.get_stats())
+
+@app.get("/stats/search")
+async def search_cache_stats():
+    return JSONResponse({"note": note_search_cache.get_stats(), "id": id_search_cache.get_stats()})
+
+@app.get("/stats/aromas")
+async def aroma_index_stats():
+    return JSONResponse(aroma_index.get_stats())
+
+@app.get("/stats/dedup")
+async def dedup_stats():
+    return JSONResponse(update_dedup.get_stats())
+
+@app.get("/stats/admission")
+async def admission_stats():
+    return JSONResponse(ai_admission.get_stats())
+
+@app.get("/stats/coalescer")
+async def coalescer_stats():
+    return JSONResponse(message_coalescer.get_stats())
+
+@app.get("/stats/voice")
+async def voice_stats():
+    return JSONResponse(voice_pipeline.get_stats())
+
+# --- Метрики Prometheus: этапы обработки и статистика компонентов ---
+metrics.registry.collect("http", http_clients.get_stats, entity="pool")
+metrics.registry.collect("updates", update_queue.get_stats)
+metrics.registry.collect("responses_cache", response_cache.get_stats)
+metrics.registry.collect("search_cache", lambda: {"note": note_search_cache.get_stats(), "id": id_search_cache.get_stats()}, entity="cache")
+metrics.registry.collect("aromas", aroma_index.get_stats)
+metrics.registry.collect("states", user_states.get_stats)
+metrics.registry.collect("dedup", update_dedup.get_stats, label="type")
+metrics.registry.collect("voice", voice_pipeline.get_stats, label="stat")
+metrics.registry.collect("scheduler", scheduler.get_stats, entity="job")
+metrics.registry.collect("broadcast", lambda: broadcaster.last_stats or {})
+metrics.registry.collect("traces", tracer.get_stats)
+metrics.registry.collect("openai_usage", openai_usage.get_stats)
+metrics.registry.collect("ai_admission", ai_admission.get_stats)
+metrics.registry.collect("coalescer", message_coalescer.get_stats)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# --- Управление рассылками (доступ по заголовку X-Admin-Token) ---
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+class BroadcastModel(BaseModel):
+    text: str
+
+def check_admin_token(request: Request):
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/admin/broadcasts")
+async def list_broadcasts(request: Request):
+    check_admin_token(request)
+    return JSONResponse(await broadcast_jobs.list())
+
+@app.post("/admin/broadcasts")
+async def start_broadcast(body: BroadcastModel, request: Request):
+    check_admin_token(request)
+    job_id = await broadcast_jobs.create(body.text)
+    return JSONResponse(await broadcast_jobs.get(job_id))
+
+@app.get("/admin/broadcasts/{job_id}")
+async def get_broadcast(job_id: int, request: Request):
+    check_admin_token(request)
+    job = await broadcast_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return JSONResponse(job)
+
+@app.post("/admin/broadcasts/{job_id}/pause")
+async def pause_broadcast(job_id: int, request: Request):
+    check_admin_token(request)
+    if not await broadcast_jobs.pause(job_id):
+        raise HTTPException(status_code=409, detail="Broadcast is not running")
+    return JSONResponse(await broadcast_jobs.get(job_id))
+
+@app.post("/admin/broadcasts/{job_id}/resume")
+async def resume_broadcast(job_id: int, request: Request):
+    check_admin_token(request)
+    if not await broadcast_jobs.resume(job_id):
+        raise HTTPException(status_code=409, detail="Broadcast is not paused")
+    return JSONResponse(await broadcast_jobs.get(job_id))
+
+# --- Расход токенов OpenAI ---
+@app.get("/admin/usage")
+async def usage_report(request: Request, top_users: int = 20):
+    check_admin_token(request)
+    return JSONResponse({"stats": openai_usage.get_stats(), "windows": await openai_usage.report(top_users)})
+
+@app.get("/admin/usage/users/{user_id}")
+async def user_usage_report(user_id: int, request: Request):
+    check_admin_token(request)
+    return JSONResponse({"user_id": user_id, "windows": await openai_usage.user_report(user_id)})
+
+# --- Медленные трассы обновлений ---
+@app.get("/admin/traces")
+async def list_traces(request: Request, limit: int = 50, min_ms: float = 0.0):
+    check_admin_token(request)
+    return JSONResponse({"stats": tracer.get_stats(), "traces": tracer.get_traces(limit, min_ms)})
+
+@app.get("/admin/traces/{trace_id}")
+async def get_trace(trace_id: str, request: Request):
+    check_admin_token(request)
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return JSONResponse(trace)
+
 @app.post("/message")
 async def handle_message(msg: MessageModel):
     user_id = msg.user_id
     text = msg.text.strip()
     state = get_user_state(user_id)
-    logger.info(f"[SUPERLOG] user_id: {user_id}, text: {text}, state: {state}")
+    logger.info("[SUPERLOG] user_id: %s, text: %s, state: %s", user_id, text, state)
     try:
         if state == 'awaiting_ai_question':
             # Отправляем индикатор "печатает" (но здесь нет chat_id, поэтому пропускаем)
-            ai_answer = await ask_chatgpt(text, user_id)
+            if not ai_admission.admit(user_id):
+                return JSONResponse(status_code=429, content={"answer": AI_RATE_LIMIT_REPLY})
+            try:
+                async with ai_admission.slot():
+                    ai_answer = await ask_chatgpt(text, user_id)
+            except AdmissionTimeout:
+                return JSONResponse(status_code=503, content={"answer": AI_BUSY_REPLY})
             ai_answer = ai_answer.replace('*', '')
             return JSONResponse({"answer": ai_answer, "parse_mode": "HTML"})
         elif state == 'awaiting_note_search':
@@ -1236,17 +1732,17 @@ async def handle_message(msg: MessageModel):
         else:
             return JSONResponse({"info": "Нет активного режима для пользователя. Используйте /start или callback."})
     except Exception as e:
-        logger.error(f"[SUPERLOG] Exception in handle_message: {e}\n{traceback.format_exc()}")
+        logger.error("[SUPERLOG] Exception in handle_message: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/callback")
 async def handle_callback(cb: CallbackModel):
     user_id = cb.user_id
     data = cb.data
-    logger.info(f"[SUPERLOG] Callback data: {data}, user_id: {user_id}")
+    logger.info("[SUPERLOG] Callback data: %s, user_id: %s", data, user_id)
     try:
-        if data != 'ai' and user_id in user_states:
-            user_states.pop(user_id, None)
+        if data != 'ai':
+            set_user_state(user_id, None)
         if data == 'instruction':
             set_user_state(user_id, 'awaiting_note_search')
             return JSONResponse({"text": '🍉 Напиши любую ноту (например, апельсин, клубника) — я найду ароматы с этой нотой!'} )
@@ -1270,12 +1766,12 @@ async def handle_callback(cb: CallbackModel):
         else:
             return JSONResponse({"info": "Callback обработан."})
     except Exception as e:
-        logger.error(f"[SUPERLOG] Exception in handle_callback: {e}\n{traceback.format_exc()}")
+        logger.error("[SUPERLOG] Exception in handle_callback: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/start")
 async def cmd_start(msg: MessageModel):
-    logger.info(f"/start command from user {msg.user_id}")
+    logger.info("/start command from user %s", msg.user_id)
     text = (
         '<b>Здравствуйте!\n\n'
         'Я — ваш ароматный помощник от BAHUR.\n'
@@ -1296,5 +1792,5 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, signal_handler)
     
     port = int(os.environ.get("PORT", 8000))
-    print(f"[INFO] Starting uvicorn on 0.0.0.0:{port}")
+    logger.info("Starting uvicorn on 0.0.0.0:%s", port)
     uvicorn.run("1:app", host="0.0.0.0", port=port)
\ No newline at end of file
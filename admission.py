@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+from rate_limit import KeyedTokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionTimeout(Exception):
+    """Свободный слот для запроса к OpenAI не появился за queue_timeout секунд"""
+
+
+class AdmissionController:
+    """Допуск вопросов к OpenAI: token bucket на пользователя и общий лимит одновременных запросов.
+
+    admit()/wait_admit() ограничивают частоту вопросов одного пользователя, slot() — число запросов
+    к OpenAI, выполняющихся одновременно, чтобы один шумный чат не занимал все соединения.
+    """
+
+    def __init__(self, per_user: KeyedTokenBucket, max_concurrent: int = 8, queue_timeout: float = 20.0,
+                 max_wait: float = 15.0):
+        self.per_user = per_user
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.max_wait = max_wait
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "limited": 0, "delayed": 0, "timeouts": 0, "max_slot_wait_ms": 0.0}
+
+    def admit(self, key: Hashable) -> bool:
+        """Забирает токен пользователя; False — пользователь спрашивает чаще лимита"""
+        if self.per_user.try_acquire(key):
+            self.stats["admitted"] += 1
+            return True
+        self.stats["limited"] += 1
+        return False
+
+    async def wait_admit(self, key: Hashable) -> bool:
+        """Ждёт токен пользователя, если он появится не позже чем через max_wait секунд"""
+        if self.per_user.bucket(key).delay() > self.max_wait:
+            return False
+        await self.per_user.acquire(key)
+        self.stats["delayed"] += 1
+        return True
+
+    @asynccontextmanager
+    async def slot(self):
+        """Один из max_concurrent слотов для запроса к OpenAI; AdmissionTimeout, если ждать дольше queue_timeout"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise AdmissionTimeout(f"Нет свободного слота OpenAI за {self.queue_timeout} с")
+        finally:
+            self.waiting -= 1
+        waited_ms = (time.perf_counter() - started) * 1000
+        self.stats["max_slot_wait_ms"] = round(max(self.stats["max_slot_wait_ms"], waited_ms), 1)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def get_stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "tracked_users": len(self.per_user),
+            **self.stats,
+        }
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Поля аромата, которые отдаёт поисковый API и которые сохраняются в снапшоте
+AROMA_FIELDS = ("ID", "brand", "aroma", "description", "url")
+# Доля общих триграмм (мера Жаккара), при которой слово считается нотой с опечаткой
+MIN_SIMILARITY = 0.5
+
+
+def normalize_note(text: str) -> str:
+    """Нормализованная нота: нижний регистр, ё→е, одиночные пробелы"""
+    return " ".join(str(text).lower().replace('ё', 'е').split()).strip(" .,!?;:'\"«»")
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def best_trigram_match(term: str, trigram_index: Dict[str, Set[str]],
+                       min_similarity: float = MIN_SIMILARITY) -> Optional[str]:
+    """Ближайший к term термин из индекса триграмма → термины, или None, если сходство ниже min_similarity"""
+    grams = trigrams(term)
+    overlaps: Dict[str, int] = {}
+    for gram in grams:
+        for candidate in trigram_index.get(gram, ()):
+            overlaps[candidate] = overlaps.get(candidate, 0) + 1
+    best, best_score = None, min_similarity
+    for candidate, overlap in overlaps.items():
+        score = overlap / (len(grams) + len(trigrams(candidate)) - overlap)
+        if score >= best_score:
+            best, best_score = candidate, score
+    return best
+
+
+class AromaIndex:
+    """Локальный каталог ароматов: нота → ароматы, триграммы для поиска с опечатками и поиск по ID.
+
+    Каталог хранится в JSON-снапшоте ({"aromas": [{"ID", "brand", "aroma", "description", "url", "notes"}]}).
+    Снапшот можно выгрузить целиком извне, а можно наполнять ответами поискового API через learn().
+    Ещё не сохранённые выученные ароматы переживают перезагрузку снапшота, а save() сначала перечитывает
+    снапшот, изменённый извне, чтобы не затереть его содержимым памяти.
+    """
+
+    def __init__(self, snapshot_file: Optional[str] = "aroma_index.json", min_similarity: float = MIN_SIMILARITY,
+                 rng: Optional[random.Random] = None):
+        self.snapshot_file = snapshot_file
+        self.min_similarity = min_similarity
+        self.rng = rng or random.Random()
+        self.aromas: Dict[str, dict] = {}
+        self.notes: Dict[str, Set[str]] = {}
+        self.trigram_index: Dict[str, Set[str]] = {}
+        self.dirty = False
+        # Выученные после последнего save(): (запись аромата, нота)
+        self._learned: List[Tuple[dict, str]] = []
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "fuzzy_hits": 0, "misses": 0, "id_hits": 0, "id_misses": 0}
+        if snapshot_file:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.aromas)
+
+    def _add_note(self, note: str, aroma_id: str):
+        ids = self.notes.get(note)
+        if ids is None:
+            ids = self.notes[note] = set()
+            for gram in trigrams(note):
+                self.trigram_index.setdefault(gram, set()).add(note)
+        ids.add(aroma_id)
+
+    def _add_aroma(self, record: dict, notes: List[str]) -> str:
+        aroma_id = str(record["ID"])
+        stored = self.aromas.setdefault(aroma_id, {"notes": []})
+        stored.update({field: record[field] for field in AROMA_FIELDS if field in record})
+        for note in notes:
+            note = normalize_note(note)
+            if not note:
+                continue
+            if note not in stored["notes"]:
+                stored["notes"].append(note)
+            self._add_note(note, aroma_id)
+        return aroma_id
+
+    def load(self):
+        """Загружает снапшот (если файл есть)"""
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            mtime = os.path.getmtime(self.snapshot_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить каталог ароматов {self.snapshot_file}: {e}")
+            return
+        # Строим новый индекс отдельно и подменяем целиком, чтобы поиск не видел его наполовину собранным
+        fresh = AromaIndex(snapshot_file=None)
+        for record in data.get("aromas", []):
+            if record.get("ID") is not None:
+                fresh._add_aroma(record, record.get("notes", []))
+        with self._lock:
+            self.aromas, self.notes, self.trigram_index = fresh.aromas, fresh.notes, fresh.trigram_index
+            self._mtime = mtime
+            # Выученное, но ещё не сохранённое, добавляем поверх нового снапшота
+            for record, note in self._learned:
+                self._add_aroma(record, [note] if note else [])
+            self.dirty = bool(self._learned)
+        logger.info(f"Каталог ароматов загружен: {len(self.aromas)} ароматов, {len(self.notes)} нот")
+
+    def _changed_on_disk(self) -> bool:
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return False
+        return os.path.getmtime(self.snapshot_file) != self._mtime
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает снапшот, если его обновили извне"""
+        if not self._changed_on_disk():
+            return False
+        self.load()
+        return True
+
+    def save(self):
+        """Атомарно сохраняет каталог вместе с выученными нотами; снапшот, изменённый извне, сначала перечитывается"""
+        if not self.snapshot_file:
+            return
+        self.reload_if_changed()
+        with self._lock:
+            if not self.dirty:
+                return
+            data = {"aromas": [dict(record, notes=list(record["notes"])) for record in self.aromas.values()]}
+            self._learned = []
+            self.dirty = False
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.snapshot_file)
+        self._mtime = os.path.getmtime(self.snapshot_file)
+
+    def learn(self, note: Optional[str], result: dict):
+        """Запоминает аромат из успешного ответа API (и ноту, по которой он найден)"""
+        if not isinstance(result, dict) or result.get("status") != "success" or result.get("ID") is None:
+            return
+        aroma_id = str(result["ID"])
+        note = normalize_note(note) if note else ""
+        with self._lock:
+            known = self.aromas.get(aroma_id)
+            if known is not None and (not note or note in known["notes"]):
+                return
+            self._add_aroma(result, [note] if note else [])
+            self._learned.append(({field: result[field] for field in AROMA_FIELDS if field in result}, note))
+            self.dirty = True
+
+    def _result(self, aroma_id: str) -> dict:
+        record = self.aromas[aroma_id]
+        return {"status": "success", **{field: record[field] for field in AROMA_FIELDS if field in record}}
+
+    def fuzzy_note(self, note: str) -> Optional[str]:
+        """Ближайшая известная нота по совпадению триграмм"""
+        return best_trigram_match(note, self.trigram_index, self.min_similarity)
+
+    def search(self, note: str, fuzzy: bool = True) -> Optional[dict]:
+        """Аромат с нотой note в формате ответа API; None, если ничего не найдено"""
+        note = normalize_note(note)
+        ids = self.notes.get(note)
+        if ids:
+            self.stats["exact_hits"] += 1
+        elif fuzzy and note:
+            match = self.fuzzy_note(note)
+            ids = self.notes.get(match) if match else None
+            if ids:
+                self.stats["fuzzy_hits"] += 1
+        if not ids:
+            self.stats["misses"] += 1
+            return None
+        return self._result(self.rng.choice(sorted(ids)))
+
+    def get(self, aroma_id) -> Optional[dict]:
+        """Аромат по ID в формате ответа API"""
+        aroma_id = str(aroma_id).strip()
+        if aroma_id in self.aromas:
+            self.stats["id_hits"] += 1
+            return self._result(aroma_id)
+        self.stats["id_misses"] += 1
+        return None
+
+    def get_stats(self) -> dict:
+        return {"aromas": len(self.aromas), "notes": len(self.notes), "dirty": self.dirty, **self.stats}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска по bahur_data: время построения индекса и задержка поиска
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from retrieval import build_index, load_blocks
+
+QUERIES = [
+    "Сколько стоит доставка?",
+    "Какая минимальная сумма заказа?",
+    "Как оформить рассрочку?",
+    "Откуда ваши масла, кто производитель?",
+    "Из чего состоит парфюмерная вода?",
+    "Какая фабрика лучше LUZI или EPS?",
+    "Можно обменять флаконы?",
+    "Есть сертификаты на продукцию?",
+    "Где вы находитесь?",
+    "Доставляете в Казахстан?",
+    "Какой минимальный объём для одного аромата?",
+    "Привет, как дела?",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_benchmark(rounds: int = 2000, top_k: int = 5, max_chars: int = 3000):
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bahur_data")
+
+    started = time.perf_counter()
+    blocks = load_blocks(data_dir)
+    index = build_index(data_dir)
+    build_ms = (time.perf_counter() - started) * 1000
+    kb_chars = sum(len(block["text"]) for block in blocks)
+
+    print(f"📚 База знаний: {len(blocks)} блоков, {kb_chars} символов, {len(index.postings)} терминов")
+    print(f"🏗  Построение индекса: {build_ms:.2f} мс")
+
+    latencies = []
+    context_sizes = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            t0 = time.perf_counter()
+            context = index.build_context(query, top_k=top_k, max_chars=max_chars)
+            latencies.append((time.perf_counter() - t0) * 1_000_000)
+            context_sizes.append(len(context))
+
+    print(f"🔎 Запросов: {len(latencies)} (top_k={top_k}, max_chars={max_chars})")
+    print(f"   среднее: {statistics.mean(latencies):.1f} мкс")
+    print(f"   p50:     {percentile(latencies, 50):.1f} мкс")
+    print(f"   p95:     {percentile(latencies, 95):.1f} мкс")
+    print(f"   p99:     {percentile(latencies, 99):.1f} мкс")
+    print(f"   max:     {max(latencies):.1f} мкс")
+    print(f"📝 Средний размер данных в промпте: {statistics.mean(context_sizes):.0f} символов "
+          f"(было 3000 из {kb_chars})")
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run_benchmark(rounds)
@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from rate_limit import KeyedTokenBucket, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after(response, default: float = 1.0) -> float:
+    """Сколько секунд Telegram просит подождать после ответа 429"""
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", default))
+    except Exception:
+        return default
+
+
+class _BroadcastRun:
+    """Состояние одного вызова run(): статистика, накопленные пачки и пауза после 429"""
+
+    def __init__(self):
+        self.stats = {"sent": 0, "blocked": 0, "failed": 0, "throttled": 0, "retries": 0}
+        self.sent: List[int] = []
+        self.blocked: List[int] = []
+        self.resume_at = 0.0
+
+
+class Broadcaster:
+    """Рассылка одного сообщения многим пользователям: параллельно и в пределах лимитов Telegram.
+
+    send(chat_id, text) должен возвращать ответ Bot API (status_code, json()).
+    Успешные отправки и заблокировавшие бота пользователи передаются пачками в on_sent/on_blocked,
+    чтобы база обновлялась одной транзакцией на пачку, а не запросом на каждого пользователя.
+    Один Broadcaster может выполнять несколько рассылок одновременно: у каждого run() своя
+    статистика и пачки, общие только ограничители частоты.
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable], global_limiter: TokenBucket,
+                 per_chat_limiter: Optional[KeyedTokenBucket] = None, concurrency: int = 20,
+                 max_retries: int = 3, batch_size: int = 500,
+                 on_sent: Optional[Callable[[List[int]], Any]] = None,
+                 on_blocked: Optional[Callable[[List[int]], Any]] = None):
+        self.send = send
+        self.global_limiter = global_limiter
+        self.per_chat_limiter = per_chat_limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.on_sent = on_sent
+        self.on_blocked = on_blocked
+        self.last_stats: Optional[dict] = None
+
+    async def run(self, recipients: Iterable[Tuple[int, int]], text: str) -> dict:
+        """Отправляет text всем (user_id, chat_id) из recipients и возвращает статистику"""
+        run = _BroadcastRun()
+        stats = run.stats
+        started = time.perf_counter()
+        iterator = iter(recipients)
+
+        async def worker():
+            # Итератор общий: next() синхронный, поэтому воркеры не получат одного и того же пользователя
+            for user_id, chat_id in iterator:
+                await self._deliver(run, user_id, chat_id, text)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            await self._flush(run)
+            elapsed = time.perf_counter() - started
+            stats["elapsed_s"] = round(elapsed, 2)
+            stats["per_second"] = round(stats["sent"] / elapsed, 1) if elapsed > 0 else 0.0
+            self.last_stats = stats
+            logger.info(f"Broadcast finished: {stats}")
+        return stats
+
+    @staticmethod
+    async def _wait_for_resume(run: _BroadcastRun):
+        # После 429 Telegram требует паузы для всех отправок рассылки, а не только для одного чата
+        delay = run.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, run: _BroadcastRun, user_id: int, chat_id: int, text: str):
+        stats = run.stats
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                stats["retries"] += 1
+            await self._wait_for_resume(run)
+            if self.per_chat_limiter is not None:
+                await self.per_chat_limiter.acquire(chat_id)
+            await self.global_limiter.acquire()
+            try:
+                response = await self.send(chat_id, text)
+            except Exception as e:
+                logger.warning(f"Broadcast: ошибка отправки пользователю {user_id}: {e}")
+                await asyncio.sleep(min(30, 2 ** attempt))
+                continue
+
+            status = response.status_code
+            if status == 200:
+                stats["sent"] += 1
+                run.sent.append(user_id)
+                if len(run.sent) >= self.batch_size:
+                    await self._flush(run)
+                return
+            if status == 429:
+                stats["throttled"] += 1
+                pause = retry_after(response)
+                run.resume_at = max(run.resume_at, time.monotonic() + pause)
+                logger.warning(f"Broadcast: Telegram просит подождать {pause} с")
+                continue
+            if status == 403:
+                # Пользователь заблокировал бота или удалил аккаунт — больше ему не пишем
+                stats["blocked"] += 1
+                run.blocked.append(user_id)
+                if len(run.blocked) >= self.batch_size:
+                    await self._flush(run)
+                return
+            if status >= 500:
+                await asyncio.sleep(min(30, 2 ** attempt))
+                continue
+            stats["failed"] += 1
+            logger.error(f"Broadcast: не удалось отправить пользователю {user_id}: {status} - {response.text}")
+            return
+        stats["failed"] += 1
+        logger.error(f"Broadcast: пользователь {user_id} пропущен после {self.max_retries} повторов")
+
+    async def _flush(self, run: _BroadcastRun):
+        """Передаёт накопленные пачки в on_sent/on_blocked (обычные или async функции)"""
+        sent, run.sent = run.sent, []
+        blocked, run.blocked = run.blocked, []
+        for callback, user_ids in ((self.on_sent, sent), (self.on_blocked, blocked)):
+            if callback is None or not user_ids:
+                continue
+            try:
+                result = callback(user_ids)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Broadcast: не удалось сохранить пачку из {len(user_ids)} пользователей: {e}")
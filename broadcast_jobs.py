@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Dict, List, Optional
+
+from broadcast import Broadcaster
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+_JOB_FIELDS = ("id", "text", "status", "cursor_user_id", "total", "sent", "blocked", "failed",
+               "created_at", "updated_at", "finished_at")
+
+
+class BroadcastJobs:
+    """Рассылки как задания в bot_users.db: курсор по users, контрольные точки и продолжение после перезапуска.
+
+    Пользователи обходятся страницами по возрастанию user_id; после каждой страницы курсор сохраняется,
+    поэтому после падения повторно получат сообщение не больше page_size пользователей.
+    Каждое задание выполняет один воркер: он атомарно захватывает задание (owner, heartbeat) и продлевает
+    захват на каждой странице; чужое задание можно забрать, только если heartbeat старше lease_ttl секунд.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, db: Database, page_size: int = 500,
+                 owner: Optional[str] = None, lease_ttl: float = 300.0):
+        self.broadcaster = broadcaster
+        self.db = db
+        self.page_size = page_size
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def init_table(self):
+        """Создаёт таблицу (вызывается при запуске, вне event loop)"""
+        def create(conn):
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    cursor_user_id INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    owner TEXT,
+                    heartbeat REAL
+                )
+            ''')
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(broadcast_jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE broadcast_jobs ADD COLUMN {column} {column_type}")
+
+        self.db.run_sync(create)
+
+    async def _set_status(self, job_id: int, status: str):
+        await self.db.execute(
+            "UPDATE broadcast_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP, "
+            "finished_at = CASE WHEN ? = 'done' THEN CURRENT_TIMESTAMP ELSE finished_at END WHERE id = ?",
+            (status, status, job_id)
+        )
+
+    async def _claim(self, job_id: int) -> bool:
+        """Захватывает или продлевает задание; False, если его держит другой живой воркер"""
+        now = time.time()
+        claimed = await self.db.execute(
+            "UPDATE broadcast_jobs SET owner = ?, heartbeat = ? WHERE id = ? AND status = 'running' "
+            "AND (owner IS NULL OR owner = ? OR heartbeat IS NULL OR heartbeat < ?)",
+            (self.owner, now, job_id, self.owner, now - self.lease_ttl)
+        )
+        return claimed == 1
+
+    async def get(self, job_id: int) -> Optional[dict]:
+        row = await self.db.fetchone(f"SELECT {', '.join(_JOB_FIELDS)} FROM broadcast_jobs WHERE id = ?", (job_id,))
+        if row is None:
+            return None
+        job = dict(zip(_JOB_FIELDS, row))
+        job["active"] = job_id in self._tasks
+        return job
+
+    async def list(self, limit: int = 20) -> List[dict]:
+        rows = await self.db.fetchall(
+            f"SELECT {', '.join(_JOB_FIELDS)} FROM broadcast_jobs ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [dict(zip(_JOB_FIELDS, row), active=row[0] in self._tasks) for row in rows]
+
+    async def create(self, text: str) -> int:
+        """Создаёт задание рассылки по всем активным пользователям и запускает его"""
+        def insert(conn):
+            total = conn.execute("SELECT COUNT(*) FROM users WHERE is_active = 1").fetchone()[0]
+            cursor = conn.execute(
+                "INSERT INTO broadcast_jobs (text, status, total, owner, heartbeat) VALUES (?, 'running', ?, ?, ?)",
+                (text, total, self.owner, time.time())
+            )
+            return cursor.lastrowid, total
+
+        job_id, total = await self.db.run(insert)
+        logger.info("Broadcast job %s created for %s users", job_id, total)
+        self._start(job_id)
+        return job_id
+
+    def _start(self, job_id: int):
+        if job_id not in self._tasks:
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def pause(self, job_id: int) -> bool:
+        """Останавливает рассылку после текущей страницы"""
+        job = await self.get(job_id)
+        if job is None or job["status"] != "running":
+            return False
+        await self._set_status(job_id, "paused")
+        return True
+
+    async def resume(self, job_id: int) -> bool:
+        resumed = await self.db.execute(
+            "UPDATE broadcast_jobs SET status = 'running', owner = ?, heartbeat = ?, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'paused'",
+            (self.owner, time.time(), job_id)
+        )
+        if not resumed:
+            return False
+        self._start(job_id)
+        return True
+
+    async def resume_unfinished(self) -> List[int]:
+        """Продолжает задания, прерванные перезапуском, которые удалось захватить этому воркеру"""
+        rows = await self.db.fetchall("SELECT id FROM broadcast_jobs WHERE status = 'running'")
+        job_ids = []
+        for (job_id,) in rows:
+            if job_id in self._tasks or not await self._claim(job_id):
+                continue
+            logger.info("Resuming broadcast job %s", job_id)
+            self._start(job_id)
+            job_ids.append(job_id)
+        return job_ids
+
+    async def wait(self, job_id: int):
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def stop(self):
+        """Прерывает активные рассылки; статус остаётся running, и они продолжатся после запуска.
+        Захват снимается, чтобы следующий воркер подхватил задания, не дожидаясь lease_ttl."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.db.execute("UPDATE broadcast_jobs SET owner = NULL WHERE owner = ? AND status = 'running'",
+                              (self.owner,))
+
+    async def _next_page(self, cursor_user_id: int) -> List[tuple]:
+        return await self.db.fetchall(
+            "SELECT user_id, chat_id FROM users WHERE is_active = 1 AND user_id > ? ORDER BY user_id LIMIT ?",
+            (cursor_user_id, self.page_size)
+        )
+
+    async def _checkpoint(self, job_id: int, cursor_user_id: int, stats: dict):
+        await self.db.execute(
+            "UPDATE broadcast_jobs SET cursor_user_id = ?, sent = sent + ?, blocked = blocked + ?, "
+            "failed = failed + ?, heartbeat = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND owner = ?",
+            (cursor_user_id, stats["sent"], stats["blocked"], stats["failed"], time.time(), job_id, self.owner)
+        )
+
+    async def _run(self, job_id: int):
+        try:
+            while True:
+                job = await self.get(job_id)
+                if job is None or job["status"] != "running":
+                    logger.info("Broadcast job %s stopped with status %s", job_id, job and job["status"])
+                    return
+                if not await self._claim(job_id):
+                    logger.warning("Broadcast job %s is owned by another worker, stopping", job_id)
+                    return
+                page = await self._next_page(job["cursor_user_id"])
+                if not page:
+                    await self._set_status(job_id, "done")
+                    logger.info("Broadcast job %s done: sent %s, blocked %s, failed %s",
+                                job_id, job["sent"], job["blocked"], job["failed"])
+                    return
+                stats = await self.broadcaster.run(page, job["text"])
+                await self._checkpoint(job_id, page[-1][0], stats)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Broadcast job %s failed: %s", job_id, e)
+            await self._set_status(job_id, "failed")
+        finally:
+            self._tasks.pop(job_id, None)
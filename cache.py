@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """LRU-кэш с ограничением размера и временем жизни записей"""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        if entry[0] <= self.clock():
+            del self._data[key]
+            self.expirations += 1
+            return False
+        return True
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение и отмечает запись как недавно использованную"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= self.clock():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохраняет значение; при переполнении вытесняет самые старые записи"""
+        self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, self._MISSING)
+        return default if entry is self._MISSING else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class AsyncCache:
+    """Кэш результатов асинхронной загрузки: TTL/LRU, один запрос на ключ и выдача устаревшего при обновлении.
+
+    Свежие записи (моложе ttl) отдаются сразу. Устаревшие (моложе ttl + stale_ttl) тоже отдаются сразу,
+    а в фоне запускается обновление. Одновременные промахи по одному ключу ждут один общий вызов loader.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Awaitable], maxsize: int = 1024, ttl: float = 300.0,
+                 stale_ttl: float = 0.0, cacheable: Callable[[Any], bool] = lambda value: value is not None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cacheable = cacheable
+        self.clock = clock
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl + stale_ttl, clock=clock)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "loads": 0, "refreshes": 0, "errors": 0}
+
+    async def get(self, key: Hashable) -> Any:
+        entry = self._cache.get(key)
+        if entry is not None:
+            loaded_at, value = entry
+            if self.clock() - loaded_at < self.ttl:
+                self.stats["hits"] += 1
+                return value
+            self.stats["stale_hits"] += 1
+            if key not in self._inflight:
+                self.stats["refreshes"] += 1
+                self._start_load(key)
+            return value
+        self.stats["misses"] += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = self._start_load(key)
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: Hashable) -> asyncio.Task:
+        task = asyncio.create_task(self._load(key))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish_load(key, done))
+        return task
+
+    def _finish_load(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # Ошибка фонового обновления уже залогирована; забираем её, чтобы asyncio не ругался
+        if not task.cancelled():
+            task.exception()
+
+    async def _load(self, key: Hashable) -> Any:
+        self.stats["loads"] += 1
+        try:
+            value = await self.loader(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"AsyncCache: ошибка загрузки {key!r}: {e}")
+            raise
+        if self.cacheable(value):
+            self._cache.set(key, (self.clock(), value))
+        else:
+            self.stats["errors"] += 1
+        return value
+
+    def invalidate(self, key: Hashable):
+        self._cache.pop(key)
+
+    def get_stats(self) -> dict:
+        requests = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"]
+        served = self.stats["hits"] + self.stats["stale_hits"]
+        return {
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "inflight": len(self._inflight),
+            **self.stats,
+            "hit_rate": round(served / requests, 4) if requests else 0.0,
+        }
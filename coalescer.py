@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCoalescer:
+    """Debounce сообщений по chat_id: вопрос, присланный несколькими сообщениями подряд, — один ход диалога.
+
+    touch(chat_id) отмечает приход сообщения (вызывается в webhook), settle(chat_id) в обработчике ждёт,
+    пока в чате не будет новых сообщений window секунд, но не дольше max_wait. После этого обработчик
+    забирает накопившиеся сообщения из очереди и делает один запрос к модели.
+    """
+
+    def __init__(self, window: float = 1.0, max_wait: float = 4.0, maxsize: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.max_wait = max_wait
+        self.maxsize = maxsize
+        self.clock = clock
+        self._last: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._events: Dict[Hashable, asyncio.Event] = {}
+        self.stats = {"settles": 0, "turns": 0, "merged_messages": 0, "total_wait": 0.0}
+
+    def touch(self, key: Hashable):
+        """Отмечает новое сообщение в чате key и будит ожидающий settle()"""
+        self._last[key] = self.clock()
+        self._last.move_to_end(key)
+        while len(self._last) > self.maxsize:
+            self._last.popitem(last=False)
+        event = self._events.get(key)
+        if event is not None:
+            event.set()
+
+    async def settle(self, key: Hashable) -> float:
+        """Ждёт паузы в сообщениях чата; возвращает, сколько секунд ждали"""
+        if self.window <= 0:
+            return 0.0
+        started = self.clock()
+        deadline = started + self.max_wait
+        event = self._events[key] = asyncio.Event()
+        try:
+            while True:
+                quiet_at = min(self._last.get(key, started) + self.window, deadline)
+                remaining = quiet_at - self.clock()
+                if remaining <= 0:
+                    break
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._events.get(key) is event:
+                del self._events[key]
+        waited = self.clock() - started
+        self.stats["settles"] += 1
+        self.stats["total_wait"] += waited
+        return waited
+
+    def record(self, merged: int):
+        """Учитывает ход диалога, в который действительно объединены merged (> 0) дополнительных сообщений"""
+        self.stats["turns"] += 1
+        self.stats["merged_messages"] += merged
+
+    def get_stats(self) -> dict:
+        settles = self.stats["settles"]
+        return {
+            "window": self.window,
+            "max_wait": self.max_wait,
+            "settles": settles,
+            "turns": self.stats["turns"],
+            "merged_messages": self.stats["merged_messages"],
+            "avg_wait_ms": round(self.stats["total_wait"] / settles * 1000, 1) if settles else 0.0,
+            "waiting": len(self._events),
+        }
@@ -1,40 +1,182 @@
+import atexit
 import json
+import logging
 import os
+import sqlite3
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ContextJournal:
+    """Журнал изменений контекста: одна запись на сообщение, запись на диск пачками"""
+    
+    def __init__(self, journal_file: str, flush_size: int = 100):
+        self.journal_file = journal_file
+        self.flush_size = flush_size
+        self.pending: List[str] = []
+        self.records_since_compaction = 0
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+    
+    def append(self, record: dict) -> bool:
+        """Добавляет запись в буфер; возвращает True, если пора сбросить буфер на диск"""
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.pending.append(line)
+            return len(self.pending) >= self.flush_size
+    
+    def flush(self):
+        """Дописывает накопленные записи в конец файла журнала"""
+        with self._io_lock:
+            with self._lock:
+                lines, self.pending = self.pending, []
+            if not lines:
+                return
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.records_since_compaction += len(lines)
+    
+    def replay(self) -> Iterator[dict]:
+        """Читает записи журнала по порядку (оборванная последняя строка пропускается)"""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Пропущена повреждённая запись журнала контекста (строка %s)", line_number)
+    
+    def truncate(self):
+        """Очищает файл журнала после записи снапшота (вызывается под _io_lock)"""
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+        self.records_since_compaction = 0
+
 
 class ConversationContext:
     """Класс для управления контекстом разговора с пользователями"""
     
-    def __init__(self, max_messages: int = 10, context_file: str = "conversation_context.json"):
+    def __init__(self, max_messages: int = 10, context_file: str = "conversation_context.json",
+                 journal_file: Optional[str] = None, flush_interval: float = 1.0,
+                 flush_size: int = 100, compact_every: int = 1000):
         self.max_messages = max_messages
         self.context_file = context_file
         self.conversations: Dict[int, List[dict]] = {}
+        # Снапшот (context_file) + журнал изменений после него
+        self.journal = ContextJournal(journal_file or os.path.splitext(context_file)[0] + ".journal", flush_size)
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._flush_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
         self.load_context()
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="context-flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
     
     def load_context(self):
-        """Загружает контекст из файла"""
+        """Загружает снапшот контекста и применяет к нему записи журнала"""
         try:
             if os.path.exists(self.context_file):
                 with open(self.context_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     # Конвертируем строковые ключи обратно в int
                     self.conversations = {int(k): v for k, v in data.items()}
-                print(f"Загружен контекст для {len(self.conversations)} пользователей")
+                logger.info("Загружен контекст для %s пользователей", len(self.conversations))
             else:
-                print("Файл контекста не найден, создаем новый")
+                logger.info("Файл контекста не найден, создаем новый")
         except Exception as e:
-            print(f"Ошибка при загрузке контекста: {e}")
+            logger.error("Ошибка при загрузке контекста: %s", e)
             self.conversations = {}
+        
+        try:
+            replayed = 0
+            for record in self.journal.replay():
+                self._apply(record)
+                replayed += 1
+            if replayed:
+                self.journal.records_since_compaction = replayed
+                logger.info("Из журнала восстановлено %s изменений контекста", replayed)
+        except Exception as e:
+            logger.error("Ошибка при чтении журнала контекста: %s", e)
+    
+    def _apply(self, record: dict):
+        """Применяет запись журнала к контексту в памяти"""
+        op = record.get("op")
+        user_id = int(record["user_id"])
+        if op == "add":
+            messages = self.conversations.setdefault(user_id, [])
+            messages.append(record["message"])
+            if len(messages) > self.max_messages:
+                self.conversations[user_id] = messages[-self.max_messages:]
+        elif op == "clear":
+            self.conversations.pop(user_id, None)
+    
+    def _record(self, record: dict):
+        """Пишет запись в буфер журнала (вызывается под _lock)"""
+        if self.journal.append(record) and self._flusher is not None:
+            self._flush_requested.set()
+    
+    def _maybe_flush(self):
+        """Без фонового потока сбрасывает полный буфер сразу (вызывается вне _lock)"""
+        if self._flusher is None and len(self.journal.pending) >= self.journal.flush_size:
+            self.journal.flush()
+    
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+                if self.journal.records_since_compaction >= self.compact_every:
+                    self.save_context()
+            except Exception as e:
+                logger.error("Ошибка при записи журнала контекста: %s", e)
+    
+    def flush(self):
+        """Сбрасывает накопленные записи журнала на диск"""
+        self.journal.flush()
     
     def save_context(self):
-        """Сохраняет контекст в файл"""
+        """Сохраняет снапшот контекста в файл и очищает журнал (компактизация)"""
         try:
-            with open(self.context_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversations, f, ensure_ascii=False, indent=2)
-            print(f"Контекст сохранен для {len(self.conversations)} пользователей")
+            with self.journal._io_lock:
+                with self._lock:
+                    # Всё, что попало в память до копии, должно оказаться в снапшоте,
+                    # а записи после копии остаются в буфере и попадут в новый журнал
+                    snapshot = {user_id: list(messages) for user_id, messages in self.conversations.items()}
+                    with self.journal._lock:
+                        self.journal.pending.clear()
+                tmp_file = self.context_file + ".tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.context_file)
+                self.journal.truncate()
+            logger.info("Контекст сохранен для %s пользователей", len(snapshot))
         except Exception as e:
-            print(f"Ошибка при сохранении контекста: {e}")
+            logger.error("Ошибка при сохранении контекста: %s", e)
+    
+    def close(self):
+        """Останавливает фоновую запись и сохраняет снапшот"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._flush_requested.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.save_context()
     
     def add_message(self, user_id: int, role: str, content: str, timestamp: Optional[datetime] = None):
         """Добавляет сообщение в контекст пользователя"""
@@ -47,20 +189,14 @@ class ConversationContext:
             "timestamp": timestamp.isoformat()
         }
         
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
-        
-        # Добавляем новое сообщение
-        self.conversations[user_id].append(message)
+        with self._lock:
+            # Добавляем новое сообщение (с ограничением количества) и пишем его в журнал
+            record = {"op": "add", "user_id": user_id, "message": message}
+            self._apply(record)
+            self._record(record)
+        self._maybe_flush()
         
-        # Ограничиваем количество сообщений
-        if len(self.conversations[user_id]) > self.max_messages:
-            self.conversations[user_id] = self.conversations[user_id][-self.max_messages:]
-        
-        # Сохраняем контекст
-        self.save_context()
-        
-        print(f"Добавлено сообщение для пользователя {user_id}, всего сообщений: {len(self.conversations[user_id])}")
+        logger.debug("Добавлено сообщение для пользователя %s, всего сообщений: %s", user_id, len(self.conversations[user_id]))
     
     def get_context(self, user_id: int) -> List[dict]:
         """Возвращает контекст пользователя"""
@@ -80,10 +216,14 @@ class ConversationContext:
     
     def clear_context(self, user_id: int):
         """Очищает контекст пользователя"""
-        if user_id in self.conversations:
-            del self.conversations[user_id]
-            self.save_context()
-            print(f"Контекст пользователя {user_id} очищен")
+        with self._lock:
+            if user_id not in self.conversations:
+                return
+            record = {"op": "clear", "user_id": user_id}
+            self._apply(record)
+            self._record(record)
+        self._maybe_flush()
+        logger.info("Контекст пользователя %s очищен", user_id)
     
     def get_user_stats(self, user_id: int) -> dict:
         """Возвращает статистику пользователя"""
@@ -103,18 +243,21 @@ class ConversationContext:
         cutoff_date = datetime.now() - timedelta(days=days)
         users_to_remove = []
         
-        for user_id, messages in self.conversations.items():
-            if messages:
-                last_message_time = datetime.fromisoformat(messages[-1]["timestamp"])
-                if last_message_time < cutoff_date:
-                    users_to_remove.append(user_id)
-        
-        for user_id in users_to_remove:
-            del self.conversations[user_id]
+        with self._lock:
+            for user_id, messages in self.conversations.items():
+                if messages:
+                    last_message_time = datetime.fromisoformat(messages[-1]["timestamp"])
+                    if last_message_time < cutoff_date:
+                        users_to_remove.append(user_id)
+            
+            for user_id in users_to_remove:
+                record = {"op": "clear", "user_id": user_id}
+                self._apply(record)
+                self._record(record)
+        self._maybe_flush()
         
         if users_to_remove:
-            self.save_context()
-            print(f"Удалены контексты {len(users_to_remove)} неактивных пользователей")
+            logger.info("Удалены контексты %s неактивных пользователей", len(users_to_remove))
     
     def get_all_users(self) -> List[int]:
         """Возвращает список всех пользователей с контекстом"""
@@ -131,8 +274,229 @@ class ConversationContext:
             "average_messages_per_user": total_messages / total_users if total_users > 0 else 0
         }
 
+class SQLiteConversationContext:
+    """Контекст разговоров в SQLite: сообщения по ключу (user_id, seq), без загрузки всего в память.
+
+    Соединение своё, а не общий Database: интерфейс контекста синхронный и вызывается прямо из обработчика,
+    и через общий поток базы каждое сообщение ждало бы в очереди за чужими запросами.
+    """
+    
+    def __init__(self, max_messages: int = 10, db_path: str = "bot_users.db"):
+        self.max_messages = max_messages
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.load_context()
+    
+    def load_context(self):
+        """Создаёт таблицы контекста (данные остаются на диске)"""
+        with self._lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS context_messages (
+                    user_id INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    PRIMARY KEY (user_id, seq)
+                ) WITHOUT ROWID
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS context_users (
+                    user_id INTEGER PRIMARY KEY,
+                    last_seq INTEGER NOT NULL,
+                    last_message TEXT NOT NULL
+                )
+            ''')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_context_users_last_message ON context_users (last_message)"
+            )
+        logger.info("Контекст в SQLite: %s", self.db_path)
+    
+    def save_context(self):
+        """Каждое изменение уже записано в SQLite — сохранять отдельно нечего"""
+    
+    def flush(self):
+        """Совместимость с ConversationContext"""
+    
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self.conn.close()
+    
+    def add_message(self, user_id: int, role: str, content: str, timestamp: Optional[datetime] = None):
+        """Добавляет сообщение в контекст пользователя и обрезает старые одним запросом"""
+        if timestamp is None:
+            timestamp = datetime.now()
+        timestamp_str = timestamp.isoformat()
+        
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute(
+                    "SELECT last_seq FROM context_users WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                seq = (row[0] if row else 0) + 1
+                cursor.execute('''
+                    INSERT INTO context_users (user_id, last_seq, last_message) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET last_seq = excluded.last_seq, last_message = excluded.last_message
+                ''', (user_id, seq, timestamp_str))
+                cursor.execute('''
+                    INSERT INTO context_messages (user_id, seq, role, content, timestamp) VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, seq, role, content, timestamp_str))
+                # Ограничиваем количество сообщений: seq идут подряд, старые — ниже порога
+                cursor.execute(
+                    "DELETE FROM context_messages WHERE user_id = ? AND seq <= ?",
+                    (user_id, seq - self.max_messages)
+                )
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        
+        logger.debug("Добавлено сообщение для пользователя %s, всего сообщений: %s", user_id, min(seq, self.max_messages))
+    
+    def get_context(self, user_id: int) -> List[dict]:
+        """Возвращает контекст пользователя"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, content, timestamp FROM context_messages WHERE user_id = ? ORDER BY seq",
+                (user_id,)
+            ).fetchall()
+        return [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in rows]
+    
+    def get_context_for_ai(self, user_id: int) -> List[dict]:
+        """Возвращает контекст в формате для OpenAI API"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, content FROM context_messages WHERE user_id = ? ORDER BY seq",
+                (user_id,)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+    
+    def clear_context(self, user_id: int):
+        """Очищает контекст пользователя"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("DELETE FROM context_messages WHERE user_id = ?", (user_id,))
+                cursor.execute("DELETE FROM context_users WHERE user_id = ?", (user_id,))
+                deleted = cursor.rowcount
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        if deleted:
+            logger.info("Контекст пользователя %s очищен", user_id)
+    
+    def get_user_stats(self, user_id: int) -> dict:
+        """Возвращает статистику пользователя"""
+        with self._lock:
+            count, user_messages, assistant_messages = self.conn.execute('''
+                SELECT COUNT(*), SUM(role = 'user'), SUM(role = 'assistant')
+                FROM context_messages WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+            row = self.conn.execute(
+                "SELECT last_message FROM context_users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if not count:
+            return {"message_count": 0, "last_message": None}
+        
+        return {
+            "message_count": count,
+            "last_message": row[0] if row else None,
+            "user_messages": user_messages or 0,
+            "assistant_messages": assistant_messages or 0
+        }
+    
+    def cleanup_old_contexts(self, days: int = 30):
+        """Очищает старые контексты (старше указанного количества дней)"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute('''
+                    DELETE FROM context_messages WHERE user_id IN (
+                        SELECT user_id FROM context_users WHERE last_message < ?
+                    )
+                ''', (cutoff,))
+                cursor.execute("DELETE FROM context_users WHERE last_message < ?", (cutoff,))
+                removed = cursor.rowcount
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        if removed:
+            logger.info("Удалены контексты %s неактивных пользователей", removed)
+    
+    def get_all_users(self) -> List[int]:
+        """Возвращает список всех пользователей с контекстом"""
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT user_id FROM context_users")]
+    
+    def get_total_stats(self) -> dict:
+        """Возвращает общую статистику"""
+        with self._lock:
+            total_users = self.conn.execute("SELECT COUNT(*) FROM context_users").fetchone()[0]
+            total_messages = self.conn.execute("SELECT COUNT(*) FROM context_messages").fetchone()[0]
+        
+        return {
+            "total_users": total_users,
+            "total_messages": total_messages,
+            "average_messages_per_user": total_messages / total_users if total_users > 0 else 0
+        }
+    
+    def import_conversations(self, conversations: Dict[int, List[dict]]):
+        """Переносит контекст из JSON-хранилища (один раз при переключении бэкенда)"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, messages in conversations.items():
+                    messages = messages[-self.max_messages:]
+                    if not messages:
+                        continue
+                    cursor.executemany('''
+                        INSERT OR REPLACE INTO context_messages (user_id, seq, role, content, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', [(user_id, seq, m["role"], m["content"], m["timestamp"]) for seq, m in enumerate(messages, 1)])
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO context_users (user_id, last_seq, last_message) VALUES (?, ?, ?)
+                    ''', (user_id, len(messages), messages[-1]["timestamp"]))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        logger.info("В SQLite перенесён контекст %s пользователей", len(conversations))
+
+
+def create_conversation_context(max_messages: int = 10, backend: Optional[str] = None,
+                                context_file: str = "conversation_context.json",
+                                db_path: Optional[str] = None):
+    """Создаёт хранилище контекста: 'journal' (JSON + журнал) или 'sqlite' (CONTEXT_BACKEND)"""
+    backend = (backend or os.getenv('CONTEXT_BACKEND', 'journal')).lower()
+    if backend == 'sqlite':
+        store = SQLiteConversationContext(max_messages, db_path or os.getenv('CONTEXT_DB_PATH', 'bot_users.db'))
+        # При первом переключении переносим накопленный JSON-контекст и переименовываем файлы,
+        # чтобы после очистки базы старые разговоры не вернулись при следующем запуске
+        journal_file = os.path.splitext(context_file)[0] + ".journal"
+        legacy_files = [path for path in (context_file, journal_file) if os.path.exists(path)]
+        if legacy_files and not store.get_total_stats()["total_users"]:
+            legacy = ConversationContext(max_messages, context_file, flush_interval=0)
+            if legacy.conversations:
+                store.import_conversations(legacy.conversations)
+            for path in legacy_files:
+                os.replace(path, path + ".migrated")
+        return store
+    return ConversationContext(max_messages, context_file)
+
 # Создаем глобальный экземпляр контекста
-conversation_context = ConversationContext(max_messages=10)
+conversation_context = create_conversation_context(max_messages=10)
 
 # Функции для интеграции с основным ботом
 def add_user_message(user_id: int, content: str):
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """Доступ к SQLite через одно долгоживущее соединение в режиме WAL.
+
+    Все запросы выполняются в отдельном потоке, поэтому event loop не блокируется, а соединение
+    используется только одним потоком. Подготовленные запросы кэшируются самим sqlite3 на соединении.
+    """
+
+    def __init__(self, path: str = "bot_users.db", cached_statements: int = 256):
+        self.path = path
+        self.cached_statements = cached_statements
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self.queries = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL режиме NORMAL не теряет целостность, но не делает fsync на каждую транзакцию
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _call(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        # Выполняется в потоке базы
+        if self._conn is None:
+            self._conn = self._connect()
+        self.queries += 1
+        with self._conn:
+            return func(self._conn)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        return self._executor
+
+    async def run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет func(conn) в потоке базы одной транзакцией"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), self._call, func)
+
+    def run_sync(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """То же, что run, но блокирующее — для кода вне event loop (инициализация при запуске)"""
+        return self._get_executor().submit(self._call, func).result()
+
+    async def execute(self, sql: str, params: Iterable = ()) -> int:
+        return await self.run(lambda conn: conn.execute(sql, tuple(params)).rowcount)
+
+    async def executemany(self, sql: str, rows: Iterable[Iterable]) -> int:
+        """Выполняет запрос для многих строк одной транзакцией"""
+        rows = [tuple(row) for row in rows]
+        if not rows:
+            return 0
+        return await self.run(lambda conn: conn.executemany(sql, rows).rowcount)
+
+    async def fetchall(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        return await self.run(lambda conn: conn.execute(sql, tuple(params)).fetchall())
+
+    async def fetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        return await self.run(lambda conn: conn.execute(sql, tuple(params)).fetchone())
+
+    def close(self):
+        """Закрывает соединение и поток базы"""
+        if self._executor is None:
+            return
+
+        def close_connection():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        self._executor.submit(close_connection).result()
+        self._executor.shutdown(wait=True)
+        self._executor = None
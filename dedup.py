@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from cache import TTLCache
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Помнит недавно обработанные update_id и отбрасывает повторные доставки Telegram.
+
+    Проверка идёт только по памяти, поэтому webhook не ждёт диска. Новые update_id копятся
+    и раз в flush_interval секунд записываются в SQLite одной транзакцией в потоке базы.
+    После падения могут потеряться update_id последних flush_interval секунд.
+    """
+
+    def __init__(self, ttl: float = 3600.0, maxsize: int = 100000, db: Optional[Database] = None,
+                 flush_interval: float = 1.0):
+        self.ttl = ttl
+        self.seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.db = db
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, float] = {}
+        self._forgotten: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._flushes = 0
+        self.hits = 0
+        self.misses = 0
+        self.hits_by_type = {}
+        self.writes = 0
+        if db is not None:
+            self._load()
+
+    def _load(self):
+        """Создаёт таблицу и поднимает update_id, увиденные в пределах TTL (при запуске, вне event loop)"""
+        now = time.time()
+
+        def load(conn):
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS processed_updates (
+                    update_id INTEGER PRIMARY KEY,
+                    seen_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("DELETE FROM processed_updates WHERE seen_at < ?", (now - self.ttl,))
+            return conn.execute("SELECT update_id, seen_at FROM processed_updates ORDER BY seen_at").fetchall()
+
+        rows = self.db.run_sync(load)
+        for update_id, seen_at in rows:
+            self.seen.set(update_id, True, ttl=self.ttl - (now - seen_at))
+        logger.info(f"Dedup: загружено {len(rows)} недавних update_id из {self.db.path}")
+
+    def is_duplicate(self, update: dict) -> bool:
+        """True, если обновление уже приходило; иначе запоминает его update_id"""
+        update_id = update.get("update_id")
+        if update_id is None:
+            return False
+        if update_id in self.seen:
+            self.hits += 1
+            update_type = next((key for key in update if key != "update_id"), "unknown")
+            self.hits_by_type[update_type] = self.hits_by_type.get(update_type, 0) + 1
+            return True
+        self.misses += 1
+        self.seen.set(update_id, True)
+        if self.db is not None:
+            self._pending[update_id] = time.time()
+            self._forgotten.discard(update_id)
+        return False
+
+    def forget(self, update: dict):
+        """Забывает update_id (например, если обновление не удалось принять в очередь)"""
+        update_id = update.get("update_id")
+        if update_id is None:
+            return
+        self.seen.pop(update_id)
+        if self.db is not None and self._pending.pop(update_id, None) is None:
+            self._forgotten.add(update_id)
+
+    async def flush(self):
+        """Записывает накопленные update_id одной транзакцией; время от времени чистит устаревшие"""
+        if self.db is None or not (self._pending or self._forgotten):
+            return
+        pending, self._pending = self._pending, {}
+        forgotten, self._forgotten = self._forgotten, set()
+        self._flushes += 1
+        sweep_before = time.time() - self.ttl if self._flushes % 1000 == 0 else None
+
+        def write(conn):
+            conn.executemany("INSERT OR REPLACE INTO processed_updates (update_id, seen_at) VALUES (?, ?)",
+                             pending.items())
+            conn.executemany("DELETE FROM processed_updates WHERE update_id = ?",
+                             [(update_id,) for update_id in forgotten])
+            if sweep_before is not None:
+                conn.execute("DELETE FROM processed_updates WHERE seen_at < ?", (sweep_before,))
+
+        try:
+            await self.db.run(write)
+            self.writes += len(pending)
+        except Exception as e:
+            logger.error(f"Dedup: не удалось сохранить {len(pending)} update_id: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Запускает фоновую запись на текущем event loop"""
+        if self.db is not None and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сохраняет то, что осталось"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self.seen),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hits_by_type": dict(self.hits_by_type),
+            "persistent": self.db is not None,
+            "pending_writes": len(self._pending),
+            "writes": self.writes,
+        }
@@ -0,0 +1,191 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Пулы соединений по хостам: Telegram, OpenAI и поисковый API
+DEFAULT_POOLS = {
+    "telegram": {"max_connections": 100, "max_keepalive": 20, "keepalive_expiry": 60.0},
+    "openai": {"max_connections": 20, "max_keepalive": 10, "keepalive_expiry": 60.0},
+    "search": {"max_connections": 20, "max_keepalive": 10, "keepalive_expiry": 30.0},
+}
+
+# Таймауты по эндпоинтам (секунды)
+DEFAULT_TIMEOUTS = {
+    "sendMessage": 30.0,
+    "editMessageText": 30.0,
+    "answerCallbackQuery": 10.0,
+    "sendChatAction": 5.0,
+    "getFile": 10.0,
+    "setWebhook": 10.0,
+    "file_download": 60.0,
+    "openai": 30.0,
+    "search": 10.0,
+}
+
+CONNECT_TIMEOUT = 5.0
+
+
+def _env_number(name: str, default, cast=float):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}={value!r}, используется {default}")
+        return default
+
+
+class HttpClientPool:
+    """Общие HTTP-клиенты с пулами соединений, живущие всё время работы приложения"""
+
+    def __init__(self, pools: Optional[Dict[str, dict]] = None, timeouts: Optional[Dict[str, float]] = None):
+        self.pools = {name: dict(config) for name, config in (pools or DEFAULT_POOLS).items()}
+        self.timeouts = dict(timeouts or DEFAULT_TIMEOUTS)
+        # Переопределение через переменные окружения: HTTP_TELEGRAM_MAX_CONNECTIONS, HTTP_TIMEOUT_SENDMESSAGE и т.п.
+        for name, config in self.pools.items():
+            prefix = f"HTTP_{name.upper()}_"
+            config["max_connections"] = _env_number(prefix + "MAX_CONNECTIONS", config["max_connections"], int)
+            config["max_keepalive"] = _env_number(prefix + "MAX_KEEPALIVE", config["max_keepalive"], int)
+            config["keepalive_expiry"] = _env_number(prefix + "KEEPALIVE_EXPIRY", config["keepalive_expiry"])
+        for endpoint, value in self.timeouts.items():
+            self.timeouts[endpoint] = _env_number(f"HTTP_TIMEOUT_{endpoint.upper()}", value)
+
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._pool_stats_warned = False
+        self._stats: Dict[str, dict] = {
+            name: {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0, "total_time": 0.0}
+            for name in self.pools
+        }
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        config = self.pools[name]
+        limits = httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive"],
+            keepalive_expiry=config["keepalive_expiry"],
+        )
+        return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0, connect=CONNECT_TIMEOUT))
+
+    async def start(self):
+        """Создаёт клиентов для всех пулов (вызывается в startup FastAPI)"""
+        for name in self.pools:
+            self.client(name)
+        logger.info(f"HTTP-клиенты созданы: {', '.join(self.pools)}")
+
+    async def close(self):
+        """Закрывает все соединения (вызывается в shutdown FastAPI)"""
+        clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии HTTP-клиента {name}: {e}")
+        logger.info("HTTP-клиенты закрыты")
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        """Возвращает клиента пула, создавая его при первом обращении"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    def timeout(self, endpoint: str) -> httpx.Timeout:
+        """Таймаут для эндпоинта"""
+        return httpx.Timeout(self.timeouts.get(endpoint, 30.0), connect=CONNECT_TIMEOUT)
+
+    def _begin(self, name: str) -> float:
+        stats = self._stats[name]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        return time.perf_counter()
+
+    def _end(self, name: str, started: float, failed: bool):
+        stats = self._stats[name]
+        stats["in_flight"] -= 1
+        stats["total_time"] += time.perf_counter() - started
+        if failed:
+            stats["errors"] += 1
+
+    async def request(self, name: str, method: str, url: str, endpoint: Optional[str] = None, **kwargs) -> httpx.Response:
+        """Выполняет запрос через пул name с таймаутом эндпоинта endpoint"""
+        kwargs.setdefault("timeout", self.timeout(endpoint or name))
+        started = self._begin(name)
+        failed = True
+        try:
+            with span(f"http.{endpoint or name}", pool=name, method=method) as current:
+                response = await self.client(name).request(method, url, **kwargs)
+                current.set("status", response.status_code)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self._end(name, started, failed)
+
+    async def post(self, name: str, url: str, endpoint: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request(name, "POST", url, endpoint, **kwargs)
+
+    async def get(self, name: str, url: str, endpoint: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request(name, "GET", url, endpoint, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, name: str, method: str, url: str, endpoint: Optional[str] = None, **kwargs):
+        """Потоковый запрос (скачивание файлов) через пул name"""
+        kwargs.setdefault("timeout", self.timeout(endpoint or name))
+        started = self._begin(name)
+        failed = True
+        try:
+            with span(f"http.{endpoint or name}", pool=name, method=method, stream=True) as current:
+                async with self.client(name).stream(method, url, **kwargs) as response:
+                    current.set("status", response.status_code)
+                    failed = response.status_code >= 500
+                    yield response
+        finally:
+            self._end(name, started, failed)
+
+    def _pool_connections(self, name: str) -> dict:
+        # Число соединений есть только во внутреннем состоянии пула httpcore (client._transport._pool).
+        # Если после обновления httpx его там нет — не показываем эти поля и один раз пишем предупреждение
+        client = self._clients.get(name)
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        try:
+            if connections is not None:
+                idle = sum(1 for connection in connections if connection.is_idle())
+                return {"open_connections": len(connections), "idle_connections": idle}
+        except Exception:
+            pass
+        if client is not None and not self._pool_stats_warned:
+            self._pool_stats_warned = True
+            logger.warning("Статистика соединений недоступна: внутренний API httpx %s изменился", httpx.__version__)
+        return {"open_connections": None, "idle_connections": None}
+
+    def get_stats(self) -> dict:
+        """Статистика использования пулов"""
+        result = {}
+        for name, config in self.pools.items():
+            stats = self._stats[name]
+            result[name] = {
+                "max_connections": config["max_connections"],
+                "max_keepalive": config["max_keepalive"],
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "in_flight": stats["in_flight"],
+                "max_in_flight": stats["max_in_flight"],
+                "avg_time_ms": round(stats["total_time"] / stats["requests"] * 1000, 2) if stats["requests"] else 0.0,
+                **self._pool_connections(name),
+            }
+        return result
+
+
+# Глобальный экземпляр, общий для всего приложения
+http_clients = HttpClientPool()
@@ -0,0 +1,112 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Стандартные поля LogRecord; всё остальное пришло через extra и попадает в JSON как есть
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                event[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event["exc"] = record.exc_text
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+# Типы аргументов, которые не меняются после вызова логгера: такие записи можно форматировать позже
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Стандартный prepare форматирует сообщение в вызывающем потоке. Здесь, если все аргументы
+    # неизменяемые, подстановку откладываем: её вместе с форматированием (JSON или текст) и записью
+    # в консоль делает поток QueueListener. Изменяемые аргументы (dict, list, объекты) подставляются
+    # сразу, иначе в лог попало бы их состояние на момент записи, а не вызова
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # Трассировка ссылается на кадры стека вызывающего потока — форматируем её сразу
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", use_queue: bool = True,
+                  stream=None) -> Optional[logging.handlers.QueueListener]:
+    """Настраивает корневой логгер.
+
+    fmt="json" — структурированные события, fmt="text" — прежний формат basicConfig.
+    use_queue=True — записи кладутся в очередь, а в консоль их пишет отдельный поток,
+    поэтому обработчики запросов не ждут синхронной записи в консоль.
+    """
+    global _listener
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    if use_queue:
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        root.addHandler(_QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(output)
+    return _listener
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток логирования"""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+def log_sampled(log: logging.Logger, rate: float, msg: str, *args, rng=random, **kwargs):
+    """Пишет запись на INFO с вероятностью rate, иначе на DEBUG.
+
+    Для тяжёлых сообщений (полное тело обновления): на DEBUG запись отбрасывается до форматирования.
+    """
+    level = logging.INFO if rate > 0 and rng.random() < rate else logging.DEBUG
+    if log.isEnabledFor(level):
+        log.log(level, msg, *args, **kwargs)
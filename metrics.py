@@ -0,0 +1,216 @@
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин (секунды): от быстрых обращений к кэшу и SQLite до долгих ответов OpenAI
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    kind = "counter"
+    # В формате 0.0.4 у счётчика сэмплы и строки HELP/TYPE называются с суффиксом _total
+    suffix = "_total"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, *labels):
+        key = tuple(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self.suffix}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами.
+
+    observe() — один bisect и пара сложений в словаре: на горячем пути нет блокировок и аллокаций
+    кроме первого наблюдения для новой комбинации меток (всё выполняется в потоке event loop).
+    """
+
+    kind = "histogram"
+    suffix = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки → [счётчики по корзинам..., +Inf], сумма
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *labels):
+        key = tuple(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def count(self, *labels) -> int:
+        return sum(self.counts.get(tuple(labels), ()))
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(self.sums[key], 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики приложения и экспорт в текстовом формате Prometheus.
+
+    Кроме собственных счётчиков и гистограмм экспортирует статистику существующих компонентов:
+    collect(prefix, func) вызывает func() при каждом запросе /metrics и выводит числовые значения
+    словаря как gauge: {"hits_by_type": {"message": 3}} с label="type" — <prefix>_hits_by_type{type="message"}.
+    Если статистика разбита по объектам ({"openai": {"requests": 5}}), объект задаётся entity="pool":
+    <prefix>_requests{pool="openai"}.
+    """
+
+    def __init__(self, namespace: str = "bot"):
+        self.namespace = namespace
+        self.metrics: Dict[str, object] = {}
+        self.collectors: List[Tuple[str, Callable[[], dict], str, Optional[str]]] = []
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(f"{self.namespace}_{name}", help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.namespace}_{name}", help, labelnames, buckets))
+
+    def collect(self, prefix: str, func: Callable[[], dict], label: str = "key", entity: Optional[str] = None):
+        self.collectors.append((f"{self.namespace}_{prefix}", func, label, entity))
+
+    def _collected(self) -> List[str]:
+        lines = []
+        for prefix, func, label, entity in self.collectors:
+            try:
+                stats = func()
+            except Exception as e:
+                logger.error(f"Не удалось собрать метрики {prefix}: {e}")
+                continue
+            gauges: Dict[str, List[Tuple[str, object]]] = {}
+            for key, value in stats.items():
+                if entity is not None:
+                    if isinstance(value, dict):
+                        for stat, stat_value in value.items():
+                            gauges.setdefault(f"{prefix}_{stat}", []).append((_labels((entity,), (key,)), stat_value))
+                elif isinstance(value, dict):
+                    for sub_key, sub_value in value.items():
+                        gauges.setdefault(f"{prefix}_{key}", []).append((_labels((label,), (sub_key,)), sub_value))
+                else:
+                    gauges.setdefault(f"{prefix}_{key}", []).append(("", value))
+            for name, values in gauges.items():
+                values = [(labels, value) for labels, value in values
+                          if isinstance(value, (int, float)) and value is not None]
+                if not values:
+                    continue
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(f"{name}{labels} {_number(float(value))}" for labels, value in values)
+        return lines
+
+    def render(self) -> str:
+        """Все метрики в формате Prometheus text exposition 0.0.4"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name}{metric.suffix} {metric.help}")
+            lines.append(f"# TYPE {metric.name}{metric.suffix} {metric.kind}")
+            lines.extend(metric.samples())
+        lines.extend(self._collected())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Длительность этапов обработки обновления (OpenAI, Telegram, распознавание, поиск, контекст, SQLite)
+stage_duration = registry.histogram("stage_duration_seconds", "Длительность этапа обработки", ("stage",))
+# Время обработки обновления целиком — от выборки из очереди до последнего ответа пользователю
+update_duration = registry.histogram("update_duration_seconds", "Длительность обработки обновления", ("type",))
+# Исключения по этапам и классам ошибок
+stage_errors = registry.counter("stage_errors", "Исключения по этапам", ("stage", "error"))
+
+
+def count_error(stage: str, error):
+    """Ошибка этапа: исключение (по имени класса) или строка, например «http_500»"""
+    stage_errors.inc(1, stage, error if isinstance(error, str) else type(error).__name__)
+
+
+def observe_stage(stage: str, seconds: float, error: Optional[BaseException] = None):
+    stage_duration.observe(seconds, stage)
+    if error is not None:
+        count_error(stage, error)
+
+
+def timed(stage: str):
+    """Декоратор: длительность вызова (обычной или async функции) в stage_duration_seconds{stage}"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    observe_stage(stage, time.perf_counter() - started, e)
+                    raise
+                observe_stage(stage, time.perf_counter() - started)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                observe_stage(stage, time.perf_counter() - started, e)
+                raise
+            observe_stage(stage, time.perf_counter() - started)
+            return result
+        return wrapper
+    return decorator
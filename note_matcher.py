@@ -0,0 +1,113 @@
+import logging
+import os
+import re
+from typing import Dict, Iterable, Optional, Set
+
+from aroma_index import MIN_SIMILARITY, best_trigram_match, trigrams
+
+logger = logging.getLogger(__name__)
+
+# Фрагменты нот короче этого не считаются совпадением («а» есть почти в каждой ноте)
+MIN_FRAGMENT = 3
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё→е, одиночные пробелы"""
+    return " ".join(text.lower().replace('ё', 'е').split())
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Регулярное выражение-бор: общие префиксы слов вынесены, поэтому проверка не зависит от размера словаря"""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: dict) -> str:
+        branches = []
+        optional = False
+        for char, child in sorted(node.items()):
+            if char == "":
+                optional = True
+                continue
+            branches.append(re.escape(char) + build(child))
+        if not branches:
+            return ""
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if optional else group
+
+    return build(trie)
+
+
+class NoteMatcher:
+    """Распознаёт ноты в сообщении: множество для точных совпадений и одно скомпилированное выражение для поиска в тексте"""
+
+    def __init__(self, notes: Iterable[str]):
+        # нормализованная форма → нота в исходном написании
+        self.notes: Dict[str, str] = {}
+        for note in notes:
+            key = normalize(note)
+            if key and key not in self.notes:
+                self.notes[key] = note.strip()
+        # Нота должна начинаться с начала слова: «ель» не находится в «карамель»
+        self._pattern = re.compile(r"(?<![а-яa-z])(?:" + _trie_pattern(self.notes) + ")") if self.notes else None
+        # Части нот («иланг» → «иланг-иланг»): короткий ввод может быть началом или куском ноты
+        self._fragments: Dict[str, str] = {}
+        for key in self.notes:
+            for start in range(len(key)):
+                for end in range(start + MIN_FRAGMENT, len(key) + 1):
+                    self._fragments.setdefault(key[start:end], key)
+        self._trigrams: Dict[str, Set[str]] = {}
+        for key in self.notes:
+            for gram in trigrams(key):
+                self._trigrams.setdefault(gram, set()).add(key)
+
+    def __len__(self) -> int:
+        return len(self.notes)
+
+    @classmethod
+    def from_file(cls, path: str, extra: Iterable[str] = ()) -> "NoteMatcher":
+        """Загружает словарь нот из файла (одна нота на строку, # — комментарий) и добавляет extra"""
+        notes = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                notes = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        else:
+            logger.error(f"Файл словаря нот {path} не найден")
+        matcher = cls(list(notes) + list(extra))
+        logger.info(f"Словарь нот загружен: {len(matcher)} нот")
+        return matcher
+
+    def match(self, text: str) -> Optional[str]:
+        """Нота, упомянутая в тексте (в исходном написании), или None"""
+        if not text:
+            return None
+        key = normalize(text)
+        if key in self.notes:
+            return self.notes[key]
+        if self._pattern is not None:
+            # Необязательные ветки бора жадные, поэтому находится самая длинная нота («дубовый мох», а не «дуб»)
+            found = self._pattern.search(key)
+            if found:
+                return self.notes[found.group()]
+        fragment_of = self._fragments.get(key)
+        return self.notes[fragment_of] if fragment_of else None
+
+    def fuzzy(self, text: str, min_similarity: float = MIN_SIMILARITY) -> Optional[str]:
+        """Нота, ближайшая к слову с опечаткой (по совпадению триграмм), или None"""
+        key = normalize(text)
+        if not key:
+            return None
+        best = best_trigram_match(key, self._trigrams, min_similarity)
+        return self.notes[best] if best else None
+
+    def is_likely_note(self, text: str) -> bool:
+        """Похож ли текст на название ноты: нота из словаря или одно слово, похожее на ноту с опечаткой"""
+        if self.match(text):
+            return True
+        key = normalize(text or "")
+        return bool(re.fullmatch(r"[а-яa-z-]{%d,20}" % MIN_FRAGMENT, key)) and self.fuzzy(key) is not None
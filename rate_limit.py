@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity накоплено"""
+
+    def __init__(self, rate: float, capacity: float = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забирает токены, если они есть; не ждёт"""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Через сколько секунд наберётся нужное количество токенов"""
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждёт, пока наберутся токены; ожидающие обслуживаются по очереди"""
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+
+class KeyedTokenBucket:
+    """Отдельный token bucket на каждый ключ (чат, пользователь); давно неиспользуемые забываются"""
+
+    def __init__(self, rate: float, capacity: float = None, maxsize: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity, self.clock)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key: Hashable, tokens: float = 1.0) -> bool:
+        return self.bucket(key).try_acquire(tokens)
+
+    async def acquire(self, key: Hashable, tokens: float = 1.0):
+        await self.bucket(key).acquire(tokens)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
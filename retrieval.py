@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import math
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Частые слова, которые не помогают находить нужный блок
+STOP_WORDS = {
+    'а', 'без', 'бы', 'в', 'вам', 'вас', 'ваш', 'ваша', 'ваше', 'ваши', 'во', 'вот', 'все', 'всё',
+    'вы', 'да', 'для', 'до', 'если', 'есть', 'же', 'за', 'и', 'из', 'или', 'им', 'их', 'к', 'как',
+    'какая', 'какие', 'какой', 'ко', 'когда', 'ли', 'либо', 'мне', 'мы', 'на', 'над', 'нам', 'нас',
+    'не', 'нет', 'ни', 'но', 'ну', 'о', 'об', 'он', 'она', 'они', 'оно', 'от', 'по', 'под', 'при',
+    'с', 'со', 'так', 'также', 'там', 'то', 'тут', 'у', 'уже', 'чем', 'что', 'чтобы', 'это', 'я',
+    'можно', 'можете', 'ещё', 'еще', 'подробнее', 'нажать',
+    'привет', 'здравствуйте', 'спасибо', 'пожалуйста', 'дела',
+}
+
+# Слова, которые можно отбросить в ключе кэша ответов: вежливость и частицы. Отрицания, предлоги
+# и вопросительные слова остаются — «с ванилью» и «без ванили» должны давать разные ключи
+CACHE_STOP_WORDS = {
+    'а', 'бы', 'вам', 'вас', 'вот', 'вы', 'же', 'ли', 'мне', 'ну', 'можно', 'можете', 'подскажите',
+    'привет', 'здравствуйте', 'спасибо', 'пожалуйста', 'ещё', 'еще', 'подробнее',
+}
+
+# Окончания для лёгкого стемминга русских слов (от длинных к коротким)
+_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'иям', 'иях', 'ием',
+    'ать', 'ять', 'ить', 'еть', 'ует', 'уют', 'ают', 'яют', 'ешь', 'ете', 'ите', 'ишь',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях',
+    'ов', 'ев', 'ую', 'юю', 'их', 'ых', 'ми', 'ть', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят',
+    'а', 'я', 'о', 'е', 'у', 'ю', 'ы', 'и', 'ь', 'й',
+], key=len, reverse=True)
+
+_TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+_MIN_STEM = 3
+
+
+def stem(word: str) -> str:
+    """Отрезает окончание русского слова, оставляя основу не короче трёх букв"""
+    for suffix in ('ся', 'сь'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            word = word[:-len(suffix)]
+            break
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на нормализованные токены (нижний регистр, без стоп-слов, основы слов)"""
+    text = text.lower().replace('ё', 'е')
+    return [stem(word) for word in _TOKEN_RE.findall(text) if word not in STOP_WORDS]
+
+
+def normalize_question(text: str) -> str:
+    """Ключ вопроса для кэша ответов: основы слов без пунктуации, регистра и вежливых слов"""
+    text = text.lower().replace('ё', 'е')
+    return " ".join(stem(word) for word in _TOKEN_RE.findall(text) if word not in CACHE_STOP_WORDS)
+
+
+def split_into_blocks(text: str, source: str) -> List[dict]:
+    """Разбивает файл bahur_data на блоки «— вопрос / ответ»"""
+    lines = [line.rstrip() for line in text.splitlines()]
+    section = ""
+    blocks: List[List[str]] = []
+    current: List[str] = []
+
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if not section and not blocks and not current:
+            # Первая строка файла — заголовок раздела («3. Доставка», «Навигация»)
+            section = stripped
+            continue
+        if stripped.startswith('—'):
+            if current:
+                blocks.append(current)
+            current = []
+            stripped = stripped.lstrip('—').strip()
+            if not stripped:
+                continue
+        current.append(stripped)
+    if current:
+        blocks.append(current)
+
+    result = []
+    for block_lines in blocks:
+        body = "\n".join(block_lines)
+        result.append({
+            "source": source,
+            "section": section,
+            "text": f"{section}\n— {body}" if section else f"— {body}",
+        })
+    if not result and section:
+        result.append({"source": source, "section": section, "text": section})
+    return result
+
+
+def load_blocks(data_dir: str = "bahur_data") -> List[dict]:
+    """Загружает все .txt файлы из папки и разбивает их на блоки"""
+    blocks: List[dict] = []
+    if not os.path.isdir(data_dir):
+        logger.error(f"Папка {data_dir} не найдена!")
+        return blocks
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith('.txt'):
+            continue
+        file_path = os.path.join(data_dir, filename)
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                blocks.extend(split_into_blocks(f.read(), filename))
+        except Exception as e:
+            logger.error(f"Ошибка при чтении файла {filename}: {e}")
+    return blocks
+
+
+class KnowledgeIndex:
+    """BM25-индекс по блокам вопрос/ответ из bahur_data"""
+
+    def __init__(self, blocks: List[dict], k1: float = 1.5, b: float = 0.75):
+        self.blocks = blocks
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.idf: Dict[str, float] = {}
+        # Версия базы знаний: меняется при любом изменении текста блоков
+        digest = hashlib.sha1()
+        for block in blocks:
+            digest.update(block["text"].encode("utf-8"))
+            digest.update(b"\0")
+        self.version = digest.hexdigest()[:12]
+
+        for doc_id, block in enumerate(blocks):
+            tokens = tokenize(block["text"])
+            self.doc_lengths.append(len(tokens))
+            frequencies: Dict[str, int] = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, tf in frequencies.items():
+                self.postings.setdefault(token, []).append((doc_id, tf))
+
+        total_docs = len(blocks)
+        self.avg_length = (sum(self.doc_lengths) / total_docs) if total_docs else 0.0
+        for token, docs in self.postings.items():
+            df = len(docs)
+            self.idf[token] = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, dict]]:
+        """Возвращает top_k блоков, наиболее релевантных запросу, вместе с их оценкой"""
+        scores: Dict[int, float] = {}
+        k1, b, avg_length = self.k1, self.b, self.avg_length or 1.0
+        for token in set(tokenize(query)):
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = self.idf[token]
+            for doc_id, tf in docs:
+                norm = k1 * (1 - b + b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(score, self.blocks[doc_id]) for doc_id, score in best]
+
+    def build_context(self, query: str, top_k: int = 5, max_chars: Optional[int] = 3000) -> str:
+        """Собирает текст релевантных блоков для системного промпта, не превышая max_chars"""
+        parts: List[str] = []
+        used = 0
+        for _, block in self.search(query, top_k):
+            text = block["text"]
+            if max_chars is not None and parts and used + len(text) > max_chars:
+                break
+            parts.append(text)
+            used += len(text) + 2
+        return "\n\n".join(parts)
+
+
+def build_index(data_dir: str = "bahur_data") -> KnowledgeIndex:
+    """Строит индекс по всем файлам bahur_data"""
+    index = KnowledgeIndex(load_blocks(data_dir))
+    logger.info(f"Индекс bahur_data построен: {len(index)} блоков, {len(index.postings)} терминов, версия {index.version}")
+    return index
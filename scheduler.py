@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+# Диапазоны полей cron: минута, час, день месяца, месяц, день недели (0 и 7 — воскресенье, как в cron)
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Даже если до запуска неделя, просыпаемся не реже раза в час — переживаем перевод часов
+MAX_SLEEP = 3600.0
+
+
+def _parse_field(field: str, low: int, high: int) -> set:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(value) for value in part.split("-", 1))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"поле cron {field!r} вне диапазона {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """Расписание в формате cron: «минута час день месяц день_недели», например «0 7 * * 1»"""
+
+    def __init__(self, spec: str):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron-выражение должно состоять из 5 полей: {spec!r}")
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, _CRON_FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        # Как в cron: если заданы и день месяца, и день недели — подходит любой из них
+        self._any_day = fields[2] != "*" and fields[4] != "*"
+        self._days_any = fields[2] == "*"
+        self._weekdays_any = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return day_ok or weekday_ok
+        return (self._days_any or day_ok) and (self._weekdays_any or weekday_ok)
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайшее время запуска строго после moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"cron-выражение {self.spec!r} никогда не срабатывает")
+
+
+class RunLease:
+    """Захват запуска в SQLite: каждый запуск задания выполняет только один процесс.
+
+    Для каждого времени запуска в таблицу пытаются вставить строку; кто вставил, тот и выполняет.
+    Работает для нескольких воркеров uvicorn с общей базой (реплики на разных машинах её не разделяют).
+    """
+
+    def __init__(self, db: Database, owner: Optional[str] = None):
+        self.db = db
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_table(self):
+        """Создаёт таблицу (вызывается при запуске, вне event loop)"""
+        self.db.run_sync(lambda conn: conn.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_runs (
+                job TEXT NOT NULL,
+                slot TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (job, slot)
+            )
+        '''))
+
+    async def claim(self, job: str, slot: datetime) -> bool:
+        claimed = await self.db.execute(
+            "INSERT OR IGNORE INTO scheduler_runs (job, slot, owner) VALUES (?, ?, ?)",
+            (job, slot.isoformat(timespec="minutes"), self.owner)
+        )
+        return claimed == 1
+
+
+class ScheduledJob:
+    def __init__(self, name: str, spec: CronSpec, func: Callable[[], Awaitable], jitter: float, exclusive: bool):
+        self.name = name
+        self.spec = spec
+        self.func = func
+        self.jitter = jitter
+        self.exclusive = exclusive
+        self.next_run: Optional[datetime] = None
+        self.last_run: Optional[datetime] = None
+        self.last_status: Optional[str] = None
+        self.runs = 0
+        self.skipped = 0
+
+
+class AsyncScheduler:
+    """Планировщик на event loop приложения: cron-расписания, случайная задержка и захват запуска"""
+
+    def __init__(self, lease: Optional[RunLease] = None, clock: Callable[[], datetime] = datetime.now):
+        self.lease = lease
+        self.clock = clock
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, name: str, spec: str, func: Callable[[], Awaitable], jitter: float = 0.0, exclusive: bool = True):
+        """Регистрирует задание: func вызывается по расписанию spec с задержкой до jitter секунд.
+
+        exclusive=False — задание выполняется в каждом процессе (например, обновление локальных данных).
+        """
+        self.jobs[name] = ScheduledJob(name, CronSpec(spec), func, jitter, exclusive)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._run(job)) for job in self.jobs.values()]
+        for job in self.jobs.values():
+            logger.info("Scheduler: задание %s по расписанию «%s»", job.name, job.spec.spec)
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _sleep_until(self, moment: datetime):
+        while True:
+            delay = (moment - self.clock()).total_seconds()
+            if delay <= 0:
+                return
+            await asyncio.sleep(min(delay, MAX_SLEEP))
+
+    async def _run(self, job: ScheduledJob):
+        while True:
+            slot = job.spec.next_after(self.clock())
+            job.next_run = slot
+            await self._sleep_until(slot + timedelta(seconds=random.uniform(0, job.jitter)))
+            if job.exclusive and self.lease is not None and not await self.lease.claim(job.name, slot):
+                job.skipped += 1
+                logger.info("Scheduler: %s за %s уже выполняет другой процесс", job.name, slot)
+                continue
+            job.last_run = self.clock()
+            job.runs += 1
+            try:
+                await job.func()
+                job.last_status = "ok"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.last_status = f"error: {e}"
+                logger.error("Scheduler: задание %s завершилось с ошибкой: %s", job.name, e, exc_info=True)
+
+    def get_stats(self) -> dict:
+        return {
+            job.name: {
+                "spec": job.spec.spec,
+                "next_run": job.next_run.isoformat() if job.next_run else None,
+                "last_run": job.last_run.isoformat() if job.last_run else None,
+                "last_status": job.last_status,
+                "runs": job.runs,
+                "skipped": job.skipped,
+            }
+            for job in self.jobs.values()
+        }
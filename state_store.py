@@ -0,0 +1,178 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class UserStateStore:
+    """Состояния пользователей (режим AI, поиск по нотам): чтение из памяти, запись в SQLite в фоне.
+
+    Изменённые ключи копятся и раз в flush_interval записываются одной транзакцией через общий Database.
+    Состояния, не менявшиеся дольше ttl секунд, забываются.
+    """
+
+    def __init__(self, db: Database, ttl: float = 7 * 24 * 3600,
+                 flush_interval: float = 1.0, legacy_file: Optional[str] = "user_states.json",
+                 clock=time.time):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._states: Dict[int, Tuple[str, float]] = {}
+        self._dirty: Set[int] = set()
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._last_sweep = clock()
+        self.writes = 0
+        self.expired = 0
+
+        self.db.run_sync(lambda conn: conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_states (
+                user_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        '''))
+        if legacy_file:
+            self._migrate_legacy(legacy_file)
+        self._load()
+
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="state-flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def _key(user_id) -> int:
+        # JSON превращал числовые user_id в строки; в памяти и в базе ключ всегда int
+        return int(user_id)
+
+    def _migrate_legacy(self, legacy_file: str):
+        """Переносит user_states.json в SQLite (один раз, если таблица пуста)"""
+        if not os.path.exists(legacy_file):
+            return
+        if self.db.run_sync(lambda conn: conn.execute("SELECT 1 FROM user_states LIMIT 1").fetchone()):
+            return
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Не удалось прочитать %s: %s", legacy_file, e)
+            return
+        now = self.clock()
+        rows = [(self._key(user_id), state, now) for user_id, state in legacy.items() if state]
+        self.db.run_sync(lambda conn: conn.executemany("INSERT OR REPLACE INTO user_states VALUES (?, ?, ?)", rows))
+        os.replace(legacy_file, legacy_file + ".migrated")
+        logger.info("Состояния %s пользователей перенесены из %s в %s", len(rows), legacy_file, self.db.path)
+
+    def _load(self):
+        cutoff = self.clock() - self.ttl
+
+        def load(conn):
+            conn.execute("DELETE FROM user_states WHERE updated_at < ?", (cutoff,))
+            return conn.execute("SELECT user_id, state, updated_at FROM user_states").fetchall()
+
+        for user_id, state, updated_at in self.db.run_sync(load):
+            self._states[user_id] = (state, updated_at)
+        logger.info("Загружены состояния %s пользователей", len(self._states))
+
+    def get(self, user_id) -> Optional[str]:
+        key = self._key(user_id)
+        with self._lock:
+            entry = self._states.get(key)
+            if entry is None:
+                return None
+            if entry[1] < self.clock() - self.ttl:
+                del self._states[key]
+                self._dirty.add(key)
+                self.expired += 1
+                return None
+            return entry[0]
+
+    def set(self, user_id, state: Optional[str]):
+        """Меняет состояние; пустое состояние удаляет запись"""
+        key = self._key(user_id)
+        with self._lock:
+            if state:
+                self._states[key] = (state, self.clock())
+            elif self._states.pop(key, None) is None:
+                return
+            self._dirty.add(key)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def expire(self):
+        """Удаляет из памяти состояния старше ttl"""
+        cutoff = self.clock() - self.ttl
+        with self._lock:
+            stale = [key for key, (_, updated_at) in self._states.items() if updated_at < cutoff]
+            for key in stale:
+                del self._states[key]
+            self._dirty.update(stale)
+            self.expired += len(stale)
+        self._last_sweep = self.clock()
+
+    def flush(self):
+        """Записывает изменённые состояния в SQLite одной транзакцией (из фонового потока, не из event loop)"""
+        with self._io_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                changes = [(key, self._states.get(key)) for key in dirty]
+            if not changes:
+                return
+
+            def write(conn):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_states VALUES (?, ?, ?)",
+                    [(key, entry[0], entry[1]) for key, entry in changes if entry is not None]
+                )
+                conn.executemany(
+                    "DELETE FROM user_states WHERE user_id = ?",
+                    [(key,) for key, entry in changes if entry is None]
+                )
+
+            try:
+                self.db.run_sync(write)
+                self.writes += len(changes)
+            except Exception:
+                # Не потеряем изменения: запишем их при следующей попытке
+                with self._lock:
+                    self._dirty.update(key for key, _ in changes)
+                raise
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                if self.clock() - self._last_sweep >= 60:
+                    self.expire()
+                self.flush()
+            except Exception as e:
+                logger.error("Ошибка при записи состояний пользователей: %s", e)
+
+    def close(self):
+        """Останавливает фоновую запись и сохраняет оставшиеся изменения (соединение закрывает владелец Database)"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "states": len(self._states),
+            "dirty": len(self._dirty),
+            "writes": self.writes,
+            "expired": self.expired,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,129 @@
+import json
+import logging
+import re
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Telegram
+TELEGRAM_TEXT_LIMIT = 4096
+
+_LINK_RE = re.compile(r"<a\s+href=['\"][^'\"]+['\"][^>]*>([^<]+)</a>")
+_HTML_MARKUP_RE = re.compile(r"<[a-zA-Z/][^>]*>|&(?:[a-zA-Z]+|#\d+|#x[0-9a-fA-F]+);")
+
+
+class StreamError(Exception):
+    """OpenAI сообщил об ошибке посреди потока"""
+
+
+def _sse_event(line: str) -> Optional[dict]:
+    if not line.startswith("data:"):
+        return None
+    payload = line[5:].strip()
+    if not payload or payload == "[DONE]":
+        return None
+    try:
+        return json.loads(payload)
+    except ValueError:
+        logger.warning(f"OpenAI stream: не удалось разобрать событие {payload[:200]!r}")
+        return None
+
+
+def _event_delta(event: dict, use_responses_api: bool) -> Optional[str]:
+    if use_responses_api:
+        event_type = event.get("type")
+        if event_type == "response.output_text.delta":
+            return event.get("delta") or None
+        if event_type in ("error", "response.failed"):
+            raise StreamError(str(event.get("error") or event.get("response", {}).get("error") or event))
+        return None
+    if event.get("error"):
+        raise StreamError(str(event["error"]))
+    choices = event.get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content") or None
+
+
+def _event_usage(event: dict, use_responses_api: bool) -> Optional[dict]:
+    # Responses API присылает usage в response.completed, Chat Completions — в последнем чанке
+    # (если в запросе stream_options.include_usage)
+    if use_responses_api:
+        if event.get("type") == "response.completed":
+            return (event.get("response") or {}).get("usage")
+        return None
+    return event.get("usage")
+
+
+def parse_sse_delta(line: str, use_responses_api: bool) -> Optional[str]:
+    """Достаёт кусок текста из строки SSE (Responses или Chat Completions API); None — в строке нет текста"""
+    event = _sse_event(line)
+    return _event_delta(event, use_responses_api) if event is not None else None
+
+
+async def iter_sse_deltas(response, use_responses_api: bool, usage: Optional[dict] = None) -> AsyncIterator[str]:
+    """Куски текста из потокового ответа OpenAI по мере их прихода; блок usage (если есть) — в словарь usage"""
+    async for line in response.aiter_lines():
+        event = _sse_event(line)
+        if event is None:
+            continue
+        delta = _event_delta(event, use_responses_api)
+        if delta:
+            yield delta
+        elif usage is not None:
+            found = _event_usage(event, use_responses_api)
+            if found:
+                usage.update(found)
+
+
+def preview_text(text: str) -> str:
+    """Промежуточный текст для показа во время генерации: без ссылок, markdown и недописанных тегов"""
+    text = _LINK_RE.sub(r"\1", text.replace('*', ''))
+    tag_start = text.rfind('<')
+    if tag_start != -1 and '>' not in text[tag_start:]:
+        text = text[:tag_start]
+    return text.strip()[:TELEGRAM_TEXT_LIMIT]
+
+
+def has_html_markup(text: str) -> bool:
+    """True, если в тексте есть HTML-теги или сущности, которые без parse_mode='HTML' покажутся как есть"""
+    return _HTML_MARKUP_RE.search(text) is not None
+
+
+class ProgressiveMessage:
+    """Сообщение Telegram, которое дописывается по мере генерации ответа.
+
+    Первый кусок отправляется сразу, дальше сообщение редактируется не чаще, чем раз в interval секунд.
+    Текст собирается из кусков и чистится только тогда, когда его действительно пора показать.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[Optional[int]]],
+                 edit: Callable[[int, str], Awaitable[bool]],
+                 interval: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.send = send
+        self.edit = edit
+        self.interval = interval
+        self.clock = clock
+        self.message_id: Optional[int] = None
+        self.shown_text = ""
+        self.edits = 0
+        self._last_update = 0.0
+
+    async def update(self, parts: Sequence[str]):
+        """Показывает накопленный текст (строку или список кусков), если пришло время очередного обновления"""
+        if self.message_id is not None and self.clock() - self._last_update < self.interval:
+            return
+        text = preview_text("".join(parts))
+        if not text or text == self.shown_text:
+            return
+        if self.message_id is None:
+            self.message_id = await self.send(text)
+            if self.message_id is None:
+                return
+        elif await self.edit(self.message_id, text):
+            self.edits += 1
+        else:
+            return
+        self.shown_text = text
+        self._last_update = self.clock()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Тест допуска вопросов к OpenAI
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from admission import AdmissionController, AdmissionTimeout
+from rate_limit import KeyedTokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_per_user_limit():
+    """У каждого пользователя свой лимит; ожидание только если токен появится скоро"""
+    clock = FakeClock()
+    admission = AdmissionController(KeyedTokenBucket(rate=1 / 60, capacity=2, clock=clock), max_wait=15)
+    assert admission.admit(1) and admission.admit(1)
+    assert not admission.admit(1)
+    assert admission.admit(2)
+
+    async def wait():
+        return await admission.wait_admit(1)
+
+    assert asyncio.run(wait()) is False
+    clock.now = 50.0
+    assert admission.per_user.bucket(1).delay() <= 15
+    clock.now = 60.0
+    assert asyncio.run(wait()) is True
+    stats = admission.get_stats()
+    assert stats["admitted"] == 3 and stats["limited"] == 1 and stats["delayed"] == 1
+
+
+def test_global_concurrency_cap():
+    """Одновременно выполняется не больше max_concurrent запросов, лишние получают AdmissionTimeout"""
+    async def scenario():
+        admission = AdmissionController(KeyedTokenBucket(rate=100), max_concurrent=2, queue_timeout=0.05)
+        running, peak, results = 0, 0, []
+
+        async def call(n, duration):
+            nonlocal running, peak
+            try:
+                async with admission.slot():
+                    running += 1
+                    peak = max(peak, running)
+                    await asyncio.sleep(duration)
+                    running -= 1
+                    results.append(n)
+            except AdmissionTimeout:
+                results.append(f"timeout {n}")
+
+        await asyncio.gather(call(1, 0.2), call(2, 0.2), call(3, 0.01))
+        await asyncio.gather(call(4, 0.01), call(5, 0.01), call(6, 0.01))
+        return peak, results, admission.get_stats()
+
+    peak, results, stats = asyncio.run(scenario())
+    assert peak == 2
+    assert results[0] == "timeout 3" and sorted(results[1:3]) == [1, 2]
+    assert sorted(results[3:]) == [4, 5, 6]
+    assert stats["timeouts"] == 1 and stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+if __name__ == "__main__":
+    test_per_user_limit()
+    print("✅ Лимит вопросов на пользователя работает")
+    test_global_concurrency_cap()
+    print("✅ Общий лимит одновременных запросов работает")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Тест локального каталога ароматов
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aroma_index import AromaIndex
+
+
+def aroma(aroma_id, name):
+    return {"status": "success", "ID": aroma_id, "brand": "Bahur", "aroma": name,
+            "description": f"Описание {name}", "url": f"https://example.ru/{aroma_id}"}
+
+
+def test_search_exact_fuzzy_and_id():
+    """Поиск по ноте, по ноте с опечаткой и по ID"""
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "aroma_index.json")
+        with open(snapshot, "w", encoding="utf-8") as f:
+            json.dump({"aromas": [
+                dict(aroma(1, "Vanilla Sky"), notes=["Ваниль", "карамель"]),
+                dict(aroma(2, "Citrus"), notes=["бергамот", "лимон"]),
+            ]}, f, ensure_ascii=False)
+        index = AromaIndex(snapshot, rng=random.Random(0))
+
+    assert len(index) == 2
+    assert index.search("ваниль")["aroma"] == "Vanilla Sky"
+    assert index.search("Бергамот ")["ID"] == 2
+    assert index.search("бергомот")["ID"] == 2
+    assert index.search("бергомот", fuzzy=False) is None
+    assert index.search("табак") is None
+    assert index.get("1")["aroma"] == "Vanilla Sky" and index.get(1)["status"] == "success"
+    assert index.get(99) is None
+    stats = index.get_stats()
+    assert stats["exact_hits"] == 2 and stats["fuzzy_hits"] == 1 and stats["misses"] == 2
+    print("✅ Поиск по каталогу работает")
+
+
+def test_learn_and_snapshot_roundtrip():
+    """Ответы API пополняют каталог, который сохраняется и загружается обратно"""
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "aroma_index.json")
+        index = AromaIndex(snapshot)
+        index.learn("ваниль", aroma(7, "Vanilla"))
+        index.learn("ванилЬ", aroma(7, "Vanilla"))
+        index.learn("карамель", aroma(7, "Vanilla"))
+        index.learn(None, aroma(8, "Oud"))
+        index.learn("кожа", {"status": "error", "message": "Таймаут запроса"})
+        assert index.dirty
+        index.save()
+        assert not index.dirty and not index.reload_if_changed()
+
+        reloaded = AromaIndex(snapshot)
+        assert len(reloaded) == 2
+        assert reloaded.search("карамель")["ID"] == 7
+        assert reloaded.get(8)["aroma"] == "Oud"
+        assert reloaded.search("кожа") is None
+    print("✅ Каталог пополняется и сохраняется")
+
+
+def test_external_snapshot_survives_learn():
+    """save() не затирает снапшот, обновлённый извне после загрузки каталога"""
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "aroma_index.json")
+        index = AromaIndex(snapshot)
+        index.learn("ваниль", aroma(7, "Vanilla"))
+        index.save()
+
+        with open(snapshot, "w", encoding="utf-8") as f:
+            json.dump({"aromas": [dict(aroma(9, "Amber"), notes=["амбра"])]}, f)
+        mtime = os.path.getmtime(snapshot) + 5
+        os.utime(snapshot, (mtime, mtime))
+
+        index.learn("кожа", aroma(8, "Leather"))
+        index.save()
+        saved = AromaIndex(snapshot)
+        assert saved.search("амбра")["ID"] == 9
+        assert saved.search("кожа")["ID"] == 8
+        assert saved.get(7) is None
+        assert not index.dirty and not index.reload_if_changed()
+
+        # Выученное, но не сохранённое, переживает перезагрузку снапшота
+        index.learn("мускус", aroma(10, "Musk"))
+        mtime += 5
+        os.utime(snapshot, (mtime, mtime))
+        assert index.reload_if_changed()
+        assert index.dirty and index.search("мускус")["ID"] == 10
+    print("✅ Внешний снапшот не затирается выученными ароматами")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов каталога ароматов...")
+    test_search_exact_fuzzy_and_id()
+    test_learn_and_snapshot_roundtrip()
+    test_external_snapshot_survives_learn()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Тест рассылки и ограничителя частоты
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from broadcast import Broadcaster
+from broadcast_jobs import BroadcastJobs
+from db import Database
+from rate_limit import KeyedTokenBucket, TokenBucket
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data or {"ok": status_code == 200}
+        self.text = str(self._data)
+
+    def json(self):
+        return self._data
+
+
+def test_token_bucket():
+    """Токены тратятся и восстанавливаются со скоростью rate, ключи независимы"""
+    now = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.delay() == 0.5
+    now[0] = 0.5
+    assert bucket.try_acquire()
+    per_chat = KeyedTokenBucket(rate=1, capacity=1, maxsize=2, clock=lambda: now[0])
+    assert per_chat.try_acquire(1) and per_chat.try_acquire(2)
+    assert not per_chat.try_acquire(1)
+    per_chat.try_acquire(3)
+    assert len(per_chat) == 2
+    print("✅ Token bucket работает")
+
+
+def test_broadcast_handles_errors():
+    """429 — пауза и повтор, 403 — пользователь отключается, успешные сохраняются пачками"""
+    attempts = {}
+    sent_batches, blocked_batches = [], []
+
+    async def send(chat_id, text):
+        attempts[chat_id] = attempts.get(chat_id, 0) + 1
+        if chat_id == 13:
+            return FakeResponse(403, {"ok": False, "description": "Forbidden: bot was blocked by the user"})
+        if chat_id == 7 and attempts[chat_id] == 1:
+            return FakeResponse(429, {"ok": False, "parameters": {"retry_after": 0.05}})
+        if chat_id == 9:
+            return FakeResponse(400, {"ok": False, "description": "Bad Request"})
+        return FakeResponse(200)
+
+    broadcaster = Broadcaster(
+        send, TokenBucket(rate=1000), KeyedTokenBucket(rate=100), concurrency=4, batch_size=10,
+        on_sent=sent_batches.append, on_blocked=blocked_batches.append,
+    )
+    users = [(user_id, user_id) for user_id in range(1, 26)]
+    stats = asyncio.run(broadcaster.run(users, "Привет!"))
+
+    assert stats["sent"] == 23 and stats["blocked"] == 1 and stats["failed"] == 1
+    assert stats["throttled"] == 1 and stats["retries"] == 1
+    assert attempts[7] == 2
+    assert sorted(sum(sent_batches, [])) == [u for u in range(1, 26) if u not in (9, 13)]
+    assert max(len(batch) for batch in sent_batches) == 10
+    assert blocked_batches == [[13]]
+    print("✅ Рассылка обрабатывает 429 и 403")
+
+
+def test_concurrent_runs_keep_separate_state():
+    """Две рассылки через один Broadcaster: своя статистика, пачки и пауза после 429"""
+    sent_batches = []
+    throttled = set()
+
+    async def send(chat_id, text):
+        await asyncio.sleep(0.001)
+        if text == "A" and chat_id == 1 and chat_id not in throttled:
+            throttled.add(chat_id)
+            return FakeResponse(429, {"ok": False, "parameters": {"retry_after": 0.2}})
+        return FakeResponse(200)
+
+    async def scenario():
+        broadcaster = Broadcaster(send, TokenBucket(rate=10000), concurrency=2, batch_size=100,
+                                  on_sent=sent_batches.append)
+        started = time.perf_counter()
+
+        async def timed_run(users, text):
+            stats = await broadcaster.run(users, text)
+            return stats, time.perf_counter() - started
+
+        return await asyncio.gather(timed_run([(i, i) for i in range(1, 6)], "A"),
+                                    timed_run([(i, i) for i in range(11, 14)], "B"))
+
+    (stats_a, elapsed_a), (stats_b, elapsed_b) = asyncio.run(scenario())
+    assert stats_a["sent"] == 5 and stats_a["throttled"] == 1
+    assert stats_b["sent"] == 3 and stats_b["throttled"] == 0
+    # Пауза после 429 в рассылке A не задерживает рассылку B
+    assert elapsed_b < 0.1 <= elapsed_a
+    assert sorted(map(sorted, sent_batches)) == [[1, 2, 3, 4, 5], [11, 12, 13]]
+    print("✅ Одновременные рассылки не смешивают состояние")
+
+
+def test_broadcast_job_resumes_from_checkpoint():
+    """Задание проходит пользователей страницами и после перезапуска продолжает с курсора"""
+    sent = []
+
+    async def send(chat_id, text):
+        sent.append(chat_id)
+        return FakeResponse(200)
+
+    async def scenario(db):
+        broadcaster = Broadcaster(send, TokenBucket(rate=1000), concurrency=2)
+        jobs = BroadcastJobs(broadcaster, db, page_size=3)
+        jobs.init_table()
+        job_id = await jobs.create("Первая")
+        await jobs.wait(job_id)
+        first = await jobs.get(job_id)
+
+        # Задание, прерванное перезапуском после первой страницы
+        await db.execute("INSERT INTO broadcast_jobs (text, status, cursor_user_id, total, sent) "
+                         "VALUES ('Вторая', 'running', 3, 7, 3)")
+        sent.clear()
+        restarted = BroadcastJobs(broadcaster, db, page_size=3)
+        [resumed_id] = await restarted.resume_unfinished()
+        await restarted.wait(resumed_id)
+        return first, await restarted.get(resumed_id)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bot_users.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, chat_id INTEGER, is_active INTEGER DEFAULT 1)")
+        conn.executemany("INSERT INTO users (user_id, chat_id, is_active) VALUES (?, ?, ?)",
+                         [(i, i * 10, 0 if i == 5 else 1) for i in range(1, 9)])
+        conn.commit()
+        conn.close()
+        db = Database(db_path)
+        try:
+            first, resumed = asyncio.run(scenario(db))
+        finally:
+            db.close()
+
+    assert first["status"] == "done" and first["sent"] == 7 and first["cursor_user_id"] == 8
+    assert sorted(sent) == [40, 60, 70, 80]
+    assert resumed["status"] == "done" and resumed["sent"] == 7
+    print("✅ Задание рассылки продолжается после перезапуска")
+
+
+def test_unfinished_job_resumed_by_one_worker():
+    """Два воркера одновременно продолжают задания: каждое достаётся одному, сообщения не дублируются"""
+    sent = []
+
+    async def send(chat_id, text):
+        await asyncio.sleep(0.001)
+        sent.append((text, chat_id))
+        return FakeResponse(200)
+
+    async def scenario(db_a, db_b):
+        workers = [BroadcastJobs(Broadcaster(send, TokenBucket(rate=10000), concurrency=2), db, page_size=2,
+                                 owner=owner)
+                   for db, owner in ((db_a, "worker-a"), (db_b, "worker-b"))]
+        workers[0].init_table()
+        workers[1].init_table()
+        await db_a.executemany("INSERT INTO broadcast_jobs (text, status, total) VALUES (?, 'running', 6)",
+                               [("Первая",), ("Вторая",)])
+        # Задание с живым захватом чужого воркера не трогаем
+        await db_a.execute("INSERT INTO broadcast_jobs (text, status, total, owner, heartbeat) "
+                           "VALUES ('Чужая', 'running', 6, 'worker-c', ?)", (time.time(),))
+        resumed_a, resumed_b = await asyncio.gather(*(worker.resume_unfinished() for worker in workers))
+        for worker, resumed in zip(workers, (resumed_a, resumed_b)):
+            for job_id in resumed:
+                await worker.wait(job_id)
+        return resumed_a, resumed_b, await workers[0].list()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bot_users.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, chat_id INTEGER, is_active INTEGER DEFAULT 1)")
+        conn.executemany("INSERT INTO users (user_id, chat_id) VALUES (?, ?)", [(i, i * 10) for i in range(1, 7)])
+        conn.commit()
+        conn.close()
+        db_a, db_b = Database(db_path), Database(db_path)
+        try:
+            resumed_a, resumed_b, jobs = asyncio.run(scenario(db_a, db_b))
+        finally:
+            db_a.close()
+            db_b.close()
+
+    assert sorted(resumed_a + resumed_b) == [1, 2] and not set(resumed_a) & set(resumed_b)
+    assert sorted(sent) == sorted((text, i * 10) for text in ("Первая", "Вторая") for i in range(1, 7))
+    statuses = {job["text"]: (job["status"], job["sent"]) for job in jobs}
+    assert statuses == {"Первая": ("done", 6), "Вторая": ("done", 6), "Чужая": ("running", 0)}
+    print("✅ Прерванное задание продолжает только один воркер")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов рассылки...")
+    test_token_bucket()
+    test_broadcast_handles_errors()
+    test_concurrent_runs_keep_separate_state()
+    test_broadcast_job_resumes_from_checkpoint()
+    test_unfinished_job_resumed_by_one_worker()
+    print("\n🎊 Все тесты пройдены!")
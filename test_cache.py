@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Тест TTL-кэша и кэша асинхронных запросов
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cache import AsyncCache, TTLCache
+
+
+def test_ttl_cache():
+    """Записи истекают по TTL, при переполнении вытесняются самые старые"""
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache and cache.get("a") == 1 and cache.get("c") == 3
+    now[0] = 11
+    assert cache.get("a") is None
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1 and stats["expirations"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 1
+    print("✅ TTL-кэш работает")
+
+
+def test_single_flight_and_errors():
+    """Одновременные запросы одного ключа идут одним вызовом, ошибки не кэшируются"""
+    calls = []
+
+    async def loader(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"status": "error"} if key == "bad" else {"status": "success", "note": key}
+
+    async def scenario():
+        cache = AsyncCache(loader, ttl=60, cacheable=lambda r: r["status"] != "error")
+        results = await asyncio.gather(*(cache.get("ваниль") for _ in range(10)))
+        again = await cache.get("ваниль")
+        await cache.get("bad")
+        await cache.get("bad")
+        return results, again, cache.get_stats()
+
+    results, again, stats = asyncio.run(scenario())
+    assert calls == ["ваниль", "bad", "bad"]
+    assert all(r == {"status": "success", "note": "ваниль"} for r in results) and again == results[0]
+    assert stats["coalesced"] == 9 and stats["hits"] == 1 and stats["misses"] == 12
+    print("✅ Один запрос на ключ, ошибки не кэшируются")
+
+
+def test_stale_while_revalidate():
+    """Устаревший результат отдаётся сразу, а в фоне обновляется"""
+    now = [0.0]
+    version = [1]
+
+    async def loader(key):
+        return version[0]
+
+    async def scenario():
+        cache = AsyncCache(loader, ttl=10, stale_ttl=100, clock=lambda: now[0])
+        first = await cache.get("id")
+        version[0] = 2
+        now[0] = 20
+        stale = await cache.get("id")
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        fresh = await cache.get("id")
+        now[0] = 200
+        expired = await cache.get("id")
+        return first, stale, fresh, expired, cache.get_stats()
+
+    first, stale, fresh, expired, stats = asyncio.run(scenario())
+    assert (first, stale, fresh, expired) == (1, 1, 2, 2)
+    assert stats["stale_hits"] == 1 and stats["refreshes"] == 1 and stats["loads"] == 3
+    print("✅ Устаревшие результаты обновляются в фоне")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов кэша...")
+    test_ttl_cache()
+    test_single_flight_and_errors()
+    test_stale_while_revalidate()
+    print("\n🎊 Все тесты пройдены!")
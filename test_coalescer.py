@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Тест объединения сообщений, присланных подряд
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from coalescer import MessageCoalescer
+
+
+def test_settle_waits_for_quiet_chat():
+    """Каждое новое сообщение продлевает ожидание; другие чаты не мешают"""
+    async def scenario():
+        coalescer = MessageCoalescer(window=0.05, max_wait=1.0)
+        coalescer.touch(1)
+
+        async def burst():
+            for _ in range(3):
+                await asyncio.sleep(0.03)
+                coalescer.touch(1)
+                coalescer.touch(2)
+
+        _, waited = await asyncio.gather(burst(), coalescer.settle(1))
+        coalescer.record(3)
+        return waited, coalescer.get_stats()
+
+    waited, stats = asyncio.run(scenario())
+    assert 0.13 <= waited < 0.5
+    assert stats["settles"] == 1 and stats["turns"] == 1 and stats["merged_messages"] == 3
+    assert stats["waiting"] == 0
+
+
+def test_settle_is_capped_and_can_be_disabled():
+    """Непрерывный поток сообщений ждётся не дольше max_wait; window=0 — без ожидания"""
+    async def scenario():
+        coalescer = MessageCoalescer(window=0.05, max_wait=0.15)
+        stop = asyncio.Event()
+
+        async def flood():
+            while not stop.is_set():
+                coalescer.touch(1)
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(flood())
+        waited = await coalescer.settle(1)
+        stop.set()
+        await task
+        disabled = await MessageCoalescer(window=0).settle(1)
+        return waited, disabled
+
+    waited, disabled = asyncio.run(scenario())
+    assert 0.14 <= waited < 0.3
+    assert disabled == 0.0
+
+
+if __name__ == "__main__":
+    test_settle_waits_for_quiet_chat()
+    print("✅ Ожидание продлевается, пока приходят сообщения")
+    test_settle_is_capped_and_can_be_disabled()
+    print("✅ Ожидание ограничено max_wait и отключается")
@@ -6,6 +6,8 @@
 import asyncio
 import sys
 import os
+import tempfile
+import sqlite3
 
 # Добавляем текущую директорию в путь
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -74,14 +76,128 @@ async def test_main_integration():
         print(f"❌ Ошибка при тестировании интеграции: {e}")
         return False
 
+def test_journal_recovery():
+    """Контекст восстанавливается из снапшота и журнала после перезапуска"""
+    from context import ConversationContext
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context_file = os.path.join(tmp_dir, "context.json")
+        
+        ctx = ConversationContext(max_messages=3, context_file=context_file, flush_interval=0, flush_size=2)
+        for i in range(5):
+            ctx.add_message(1, "user", f"вопрос {i}")
+        ctx.add_message(2, "user", "привет")
+        ctx.clear_context(2)
+        ctx.flush()
+        # Снапшот не переписывался: все изменения лежат в журнале
+        assert not os.path.exists(context_file)
+        
+        restored = ConversationContext(max_messages=3, context_file=context_file, flush_interval=0)
+        assert [m["content"] for m in restored.get_context(1)] == ["вопрос 2", "вопрос 3", "вопрос 4"]
+        assert restored.get_context(2) == []
+        
+        # Компактизация: снапшот записан, журнал очищен
+        restored.save_context()
+        assert os.path.getsize(restored.journal.journal_file) == 0
+        again = ConversationContext(max_messages=3, context_file=context_file, flush_interval=0)
+        assert again.get_context_for_ai(1) == restored.get_context_for_ai(1)
+    
+    print("✅ Восстановление контекста из журнала работает")
+    return True
+
+def test_journal_skips_torn_record():
+    """Оборванная последняя запись журнала не ломает загрузку"""
+    from context import ConversationContext
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context_file = os.path.join(tmp_dir, "context.json")
+        ctx = ConversationContext(context_file=context_file, flush_interval=0)
+        ctx.add_message(7, "user", "первое")
+        ctx.flush()
+        with open(ctx.journal.journal_file, "a", encoding="utf-8") as f:
+            f.write('{"op": "add", "user_id": 7, "mess')
+        
+        restored = ConversationContext(context_file=context_file, flush_interval=0)
+        assert [m["content"] for m in restored.get_context(7)] == ["первое"]
+    
+    print("✅ Повреждённая запись журнала пропускается")
+    return True
+
+def test_sqlite_backend():
+    """SQLite-хранилище обрезает контекст, считает статистику и чистит старые контексты"""
+    from datetime import datetime, timedelta
+    from context import SQLiteConversationContext
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "context.db")
+        ctx = SQLiteConversationContext(max_messages=3, db_path=db_path)
+        for i in range(5):
+            ctx.add_message(1, "user" if i % 2 == 0 else "assistant", f"сообщение {i}")
+        old = datetime.now() - timedelta(days=40)
+        ctx.add_message(2, "user", "давно", timestamp=old)
+        
+        assert [m["content"] for m in ctx.get_context_for_ai(1)] == ["сообщение 2", "сообщение 3", "сообщение 4"]
+        stats = ctx.get_user_stats(1)
+        assert stats["message_count"] == 3 and stats["user_messages"] == 2 and stats["assistant_messages"] == 1
+        assert ctx.get_total_stats()["total_users"] == 2
+        
+        ctx.cleanup_old_contexts(days=30)
+        assert ctx.get_all_users() == [1]
+        ctx.close()
+        
+        # Данные переживают перезапуск без загрузки в память
+        reopened = SQLiteConversationContext(max_messages=3, db_path=db_path)
+        assert reopened.get_total_stats()["total_messages"] == 3
+        reopened.clear_context(1)
+        assert reopened.get_user_stats(1) == {"message_count": 0, "last_message": None}
+        reopened.close()
+    
+    print("✅ SQLite-хранилище контекста работает")
+    return True
+
+def test_sqlite_migrates_legacy_once():
+    """JSON-контекст переносится в SQLite один раз; ошибка очистки не оставляет открытую транзакцию"""
+    import json
+    from context import create_conversation_context
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context_file = os.path.join(tmp_dir, "conversation_context.json")
+        db_path = os.path.join(tmp_dir, "context.db")
+        with open(context_file, "w", encoding="utf-8") as f:
+            json.dump({"5": [{"role": "user", "content": "старое", "timestamp": "2024-01-01T00:00:00"}]}, f)
+        
+        ctx = create_conversation_context(3, backend="sqlite", context_file=context_file, db_path=db_path)
+        assert [m["content"] for m in ctx.get_context(5)] == ["старое"]
+        assert not os.path.exists(context_file) and os.path.exists(context_file + ".migrated")
+        ctx.clear_context(5)
+        ctx.close()
+        
+        # После очистки базы перезапуск не возвращает старые разговоры
+        restarted = create_conversation_context(3, backend="sqlite", context_file=context_file, db_path=db_path)
+        assert restarted.get_total_stats()["total_users"] == 0
+        
+        restarted.conn.execute("DROP TABLE context_users")
+        try:
+            restarted.clear_context(5)
+            assert False, "ожидалась ошибка"
+        except sqlite3.OperationalError:
+            pass
+        assert not restarted.conn.in_transaction
+        restarted.close()
+    
+    print("✅ JSON-контекст переносится в SQLite один раз")
+    return True
+
 if __name__ == "__main__":
     print("🚀 Запуск тестов системы контекста...")
     
     # Запускаем тесты
     context_test = asyncio.run(test_context_system())
     integration_test = asyncio.run(test_main_integration())
+    journal_test = test_journal_recovery() and test_journal_skips_torn_record()
+    sqlite_test = test_sqlite_backend() and test_sqlite_migrates_legacy_once()
     
-    if context_test and integration_test:
+    if context_test and integration_test and journal_test and sqlite_test:
         print("\n🎊 Все тесты пройдены! Система контекста работает корректно!")
     else:
         print("\n💥 Некоторые тесты не пройдены!")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Тест слоя доступа к SQLite
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db import Database
+
+
+def test_database_runs_off_loop():
+    """Запросы идут через одно соединение в отдельном потоке, пачки пишутся одной транзакцией"""
+    async def scenario(db):
+        loop_thread = threading.get_ident()
+        query_thread = await db.run(lambda conn: threading.get_ident())
+        await db.executemany("INSERT INTO users VALUES (?, ?)", [(i, i * 10) for i in range(1, 1001)])
+        changed = await db.executemany("UPDATE users SET chat_id = 0 WHERE user_id = ?", [(1,), (2,)])
+        count = await db.fetchone("SELECT COUNT(*) FROM users WHERE chat_id > 0")
+        rows = await db.fetchall("SELECT user_id FROM users WHERE user_id <= ? ORDER BY user_id", (3,))
+        return loop_thread != query_thread, changed, count[0], rows
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bot_users.db"))
+        db.run_sync(lambda conn: conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, chat_id INTEGER)"))
+        off_loop, changed, count, rows = asyncio.run(scenario(db))
+        journal_mode = db.run_sync(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0])
+        db.close()
+
+    assert off_loop
+    assert changed == 2 and count == 998 and rows == [(1,), (2,), (3,)]
+    assert journal_mode == "wal"
+    print("✅ Слой доступа к SQLite работает")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов базы данных...")
+    test_database_runs_off_loop()
+    print("\n🎊 Все тесты пройдены!")
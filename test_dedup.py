@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Тест защиты от повторной доставки обновлений
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db import Database
+from dedup import UpdateDeduplicator
+
+
+def test_dedup_persists_across_restarts():
+    """Повторные update_id отбрасываются, в том числе после перезапуска; запись идёт пачками"""
+    async def first_run(dedup):
+        assert dedup.is_duplicate({"update_id": 1, "message": {}}) is False
+        assert dedup.is_duplicate({"update_id": 1, "message": {}}) is True
+        assert dedup.is_duplicate({"update_id": 2, "callback_query": {}}) is False
+        assert dedup.is_duplicate({"update_id": 3, "message": {}}) is False
+        await dedup.flush()
+        dedup.forget({"update_id": 2})
+        dedup.forget({"update_id": 3})
+        assert dedup.is_duplicate({"update_id": 3, "message": {}}) is False
+        # До записи в базу update_id только в памяти
+        assert dedup.get_stats()["pending_writes"] == 1
+        await dedup.stop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "dedup.db"))
+        dedup = UpdateDeduplicator(ttl=3600, db=db)
+        asyncio.run(first_run(dedup))
+        assert dedup.get_stats()["hits_by_type"] == {"message": 1}
+        assert db.run_sync(lambda conn: conn.execute(
+            "SELECT update_id FROM processed_updates ORDER BY update_id").fetchall()) == [(1,), (3,)]
+
+        restarted = UpdateDeduplicator(ttl=3600, db=db)
+        assert restarted.is_duplicate({"update_id": 1, "message": {}}) is True
+        assert restarted.is_duplicate({"update_id": 2, "callback_query": {}}) is False
+        assert restarted.is_duplicate({"update_id": 3, "message": {}}) is True
+        assert restarted.is_duplicate({"message": {}}) is False
+        db.close()
+    print("✅ Повторные обновления отбрасываются после перезапуска")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов защиты от повторов...")
+    test_dedup_persists_across_restarts()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тест общих HTTP-клиентов с пулами соединений
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from http_clients import HttpClientPool
+
+POOLS = {
+    "telegram": {"max_connections": 10, "max_keepalive": 5, "keepalive_expiry": 60.0},
+    "search": {"max_connections": 2, "max_keepalive": 1, "keepalive_expiry": 30.0},
+}
+
+
+class MockPool(HttpClientPool):
+    """Пул, клиенты которого отвечают через MockTransport"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created = []
+
+    def _create_client(self, name):
+        def handler(request):
+            return httpx.Response(503 if request.url.path == "/down" else 200, json={"pool": name})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        self.created.append(name)
+        return client
+
+
+def test_clients_are_reused_per_pool():
+    """Один клиент на пул на всё время работы; таймауты по эндпоинтам; статистика запросов"""
+    async def scenario():
+        pool = MockPool(POOLS, {"sendMessage": 7.0})
+        await pool.start()
+        first = pool.client("telegram")
+        response = await pool.post("telegram", "https://api.telegram.org/send", endpoint="sendMessage")
+        await pool.get("telegram", "https://api.telegram.org/down")
+        async with pool.stream("search", "GET", "https://search/x") as streamed:
+            body = await streamed.aread()
+        same = pool.client("telegram") is first
+        stats = pool.get_stats()
+        await pool.close()
+        return pool, response, body, same, stats
+
+    pool, response, body, same, stats = asyncio.run(scenario())
+    assert response.json() == {"pool": "telegram"} and b"search" in body
+    assert same and pool.created == ["telegram", "search"]
+    assert pool.timeout("sendMessage").read == 7.0 and pool.timeout("unknown").read == 30.0
+    assert stats["telegram"]["requests"] == 2 and stats["telegram"]["errors"] == 1
+    assert stats["telegram"]["in_flight"] == 0 and stats["search"]["requests"] == 1
+    assert stats["telegram"]["max_connections"] == 10
+    print("✅ Клиенты переиспользуются, статистика считается")
+
+
+def test_close_and_recreate():
+    """close() закрывает все соединения; после него клиент создаётся заново"""
+    async def scenario():
+        pool = MockPool(POOLS)
+        await pool.start()
+        clients = [pool.client(name) for name in POOLS]
+        await pool.close()
+        closed = all(client.is_closed for client in clients)
+        recreated = pool.client("search")
+        await pool.close()
+        return pool, closed, recreated, clients
+
+    pool, closed, recreated, clients = asyncio.run(scenario())
+    assert closed
+    assert recreated is not clients[1] and pool.created == ["telegram", "search", "search"]
+    print("✅ Клиенты закрываются при остановке")
+
+
+def test_pool_connection_stats():
+    """Число соединений берётся из пула httpcore, а без него поля пустые, но статистика не ломается"""
+    async def scenario():
+        real = HttpClientPool(POOLS)
+        await real.start()
+        real_stats = real.get_stats()["telegram"]
+        await real.close()
+
+        mocked = MockPool(POOLS)
+        await mocked.start()
+        mocked_stats = mocked.get_stats()["telegram"]
+        await mocked.close()
+        return real_stats, mocked_stats
+
+    real_stats, mocked_stats = asyncio.run(scenario())
+    assert real_stats["open_connections"] == 0 and real_stats["idle_connections"] == 0
+    assert mocked_stats["open_connections"] is None and mocked_stats["requests"] == 0
+    print("✅ Статистика соединений пула")
+
+
+def test_env_overrides():
+    """Размер пула и таймауты переопределяются переменными окружения"""
+    os.environ["HTTP_SEARCH_MAX_CONNECTIONS"] = "7"
+    os.environ["HTTP_TIMEOUT_GETFILE"] = "abc"
+    try:
+        pool = HttpClientPool(POOLS, {"getFile": 10.0})
+    finally:
+        del os.environ["HTTP_SEARCH_MAX_CONNECTIONS"]
+        del os.environ["HTTP_TIMEOUT_GETFILE"]
+    assert pool.pools["search"]["max_connections"] == 7
+    assert pool.timeouts["getFile"] == 10.0
+    print("✅ Настройки из окружения")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов HTTP-клиентов...")
+    test_clients_are_reused_per_pool()
+    test_close_and_recreate()
+    test_pool_connection_stats()
+    test_env_overrides()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Тест настройки логирования
+"""
+
+import io
+import json
+import logging
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from log_config import log_sampled, setup_logging, stop_logging
+
+
+def restore_root(handlers, level):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_json_events_through_queue():
+    """JSON-события с полями из extra, записанные через очередь"""
+    root = logging.getLogger()
+    saved = (list(root.handlers), root.level)
+    stream = io.StringIO()
+    setup_logging(level="INFO", fmt="json", use_queue=True, stream=stream)
+    try:
+        log = logging.getLogger("test_log_config")
+        log.info("Webhook queued update_id=%s", 42, extra={"event": "webhook_queued", "update_id": 42})
+        log.debug("Не попадёт в лог: %s", "тело обновления")
+        try:
+            raise ValueError("сломалось")
+        except ValueError:
+            log.error("Ошибка: %s", "сломалось", exc_info=True)
+    finally:
+        stop_logging()
+        restore_root(*saved)
+
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(events) == 2
+    assert events[0]["msg"] == "Webhook queued update_id=42"
+    assert events[0]["level"] == "INFO" and events[0]["logger"] == "test_log_config"
+    assert events[0]["event"] == "webhook_queued" and events[0]["update_id"] == 42
+    assert "ValueError: сломалось" in events[1]["exc"]
+
+
+def test_sampled_bodies():
+    """Тело обновления попадает на INFO только в доле rate, остальное — на DEBUG"""
+    root = logging.getLogger()
+    saved = (list(root.handlers), root.level)
+    stream = io.StringIO()
+    setup_logging(level="INFO", fmt="text", use_queue=False, stream=stream)
+    log = logging.getLogger("test_log_config")
+    rng = random.Random(1)
+    for i in range(1000):
+        log_sampled(log, 0.1, "Body: %s", {"update_id": i}, rng=rng)
+    logged = stream.getvalue().splitlines()
+    assert 50 < len(logged) < 150
+    assert logged[0].startswith("INFO:test_log_config:Body: {'update_id': ")
+
+    stream.seek(0)
+    stream.truncate()
+    for i in range(100):
+        log_sampled(log, 0.0, "Body: %s", {"update_id": i}, rng=rng)
+    assert stream.getvalue() == ""
+    restore_root(*saved)
+
+
+def test_queue_handler_defers_formatting():
+    """Неизменяемые аргументы подставляет поток логирования, изменяемые — сразу при вызове"""
+    import queue
+    from log_config import _QueueHandler
+
+    handler = _QueueHandler(queue.SimpleQueue())
+    deferred = handler.prepare(logging.LogRecord("t", logging.INFO, __file__, 1, "id=%s n=%d", ("x", 5), None))
+    assert deferred.msg == "id=%s n=%d" and deferred.args == ("x", 5)
+    assert deferred.getMessage() == "id=x n=5"
+
+    state = {"step": 1}
+    eager = handler.prepare(logging.LogRecord("t", logging.INFO, __file__, 1, "state=%s", (state,), None))
+    state["step"] = 2
+    assert eager.args is None and eager.getMessage() == "state={'step': 1}"
+
+
+if __name__ == "__main__":
+    test_json_events_through_queue()
+    print("✅ JSON-события пишутся через очередь")
+    test_sampled_bodies()
+    print("✅ Тела обновлений сэмплируются")
+    test_queue_handler_defers_formatting()
+    print("✅ Форматирование откладывается до потока логирования")
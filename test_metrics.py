@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Тест метрик и экспорта в формате Prometheus
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import MetricsRegistry, stage_duration, stage_errors, timed
+
+
+def test_histogram_and_counter_render():
+    """Корзины гистограммы накопительные, счётчики с метками"""
+    registry = MetricsRegistry(namespace="test")
+    histogram = registry.histogram("latency_seconds", "Задержка", ("stage",), buckets=(0.1, 1.0))
+    counter = registry.counter("errors", "Ошибки", ("error",))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "openai")
+    counter.inc(1, "TimeoutError")
+    counter.inc(2, "TimeoutError")
+
+    text = registry.render()
+    assert '# TYPE test_latency_seconds histogram' in text
+    assert 'test_latency_seconds_bucket{stage="openai",le="0.1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="openai",le="1.0"} 3' in text
+    assert 'test_latency_seconds_bucket{stage="openai",le="+Inf"} 4' in text
+    assert 'test_latency_seconds_count{stage="openai"} 4' in text
+    assert 'test_latency_seconds_sum{stage="openai"} 3.65' in text
+    assert '# TYPE test_errors_total counter' in text and '# TYPE test_errors counter' not in text
+    assert 'test_errors_total{error="TimeoutError"} 3' in text
+    assert histogram.count("openai") == 4
+
+
+def test_collectors_export_component_stats():
+    """Статистика компонентов экспортируется как gauge, вложенные словари — с меткой"""
+    registry = MetricsRegistry(namespace="test")
+    registry.collect("updates", lambda: {"depth": 3, "maxsize": 1000, "mode": "fifo"})
+    registry.collect("http", lambda: {"telegram": {"requests": 5}, "openai": {"requests": 2}}, entity="pool")
+    registry.collect("dedup", lambda: {"hits": 4, "hits_by_type": {"message": 3, "callback_query": 1}}, label="type")
+
+    def broken():
+        raise RuntimeError("нет данных")
+    registry.collect("broken", broken)
+
+    text = registry.render()
+    assert "test_updates_depth 3.0" in text
+    assert "test_updates_mode" not in text
+    assert 'test_http_requests{pool="telegram"} 5.0' in text
+    assert 'test_http_requests{pool="openai"} 2.0' in text
+    assert text.count("# TYPE test_http_requests gauge") == 1
+    assert "test_dedup_hits 4.0" in text
+    assert 'test_dedup_hits_by_type{type="message"} 3.0' in text
+    assert 'test_dedup_hits_by_type{type="callback_query"} 1.0' in text
+    assert text.count("# TYPE test_dedup_hits_by_type gauge") == 1
+
+
+def test_timed_records_duration_and_errors():
+    """Декоратор timed считает длительность и класс исключения"""
+    @timed("test_stage")
+    async def ok():
+        await asyncio.sleep(0)
+        return 42
+
+    @timed("test_stage")
+    def fail():
+        raise ValueError("ошибка")
+
+    before = stage_duration.count("test_stage")
+    assert asyncio.run(ok()) == 42
+    try:
+        fail()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("исключение должно пробрасываться")
+    assert stage_duration.count("test_stage") == before + 2
+    assert stage_errors.values[("test_stage", "ValueError")] >= 1
+
+
+if __name__ == "__main__":
+    test_histogram_and_counter_render()
+    print("✅ Гистограммы и счётчики экспортируются")
+    test_collectors_export_component_stats()
+    print("✅ Статистика компонентов экспортируется")
+    test_timed_records_duration_and_errors()
+    print("✅ Этапы и ошибки замеряются")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Тест распознавания нот в сообщениях
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from note_matcher import NoteMatcher
+
+NOTES = ["Ваниль", "карамель", "ель", "дуб", "дубовый мох", "иланг-иланг", "мёд"]
+
+
+def test_exact_and_normalized_match():
+    """Точное совпадение без учёта регистра, пробелов и ё"""
+    matcher = NoteMatcher(NOTES)
+    assert matcher.match("ваниль") == "Ваниль"
+    assert matcher.match("  ВАНИЛЬ ") == "Ваниль"
+    assert matcher.match("мед") == "мёд"
+    assert matcher.match("мёд") == "мёд"
+    assert len(matcher) == len(NOTES)
+
+
+def test_note_inside_text():
+    """Нота внутри фразы; короткая нота не находится внутри другого слова"""
+    matcher = NoteMatcher(NOTES)
+    assert matcher.match("хочу что-то с ванилью") == "Ваниль"
+    assert matcher.match("аромат с карамелью") == "карамель"
+    assert matcher.match("карамельный") == "карамель"
+    assert matcher.match("дубовый мох и кожа") == "дубовый мох"
+    assert matcher.match("дуб и кожа") == "дуб"
+    assert matcher.match("привет, как дела?") is None
+    assert matcher.match("") is None
+
+
+def test_fragment_of_note():
+    """Короткий ввод, который является частью ноты"""
+    matcher = NoteMatcher(NOTES)
+    assert matcher.match("иланг") == "иланг-иланг"
+    assert matcher.match("ил") is None
+
+
+def test_is_likely_note():
+    """Нота, нота с опечаткой — да; короткая фраза, не похожая на ноту, — нет"""
+    matcher = NoteMatcher(NOTES + ["бергамот"])
+    assert matcher.is_likely_note("ванилью")
+    assert matcher.is_likely_note("бергамод")
+    assert matcher.fuzzy("бергамод") == "бергамот"
+    assert not matcher.is_likely_note("привет")
+    assert not matcher.is_likely_note("как дела")
+    assert not matcher.is_likely_note("доставка")
+    assert not matcher.is_likely_note("")
+
+
+def test_from_file_skips_comments():
+    """Загрузка словаря из файла вместе с дополнительными нотами"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "notes.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("# Цитрусовые\nбергамот\n\nлимон\n")
+        matcher = NoteMatcher.from_file(path, extra=["сандал"])
+        assert len(matcher) == 3
+        assert matcher.match("бергамот") == "бергамот"
+        assert matcher.match("сандал") == "сандал"
+        assert matcher.match("# цитрусовые") is None
+
+        missing = NoteMatcher.from_file(os.path.join(tmp, "missing.txt"))
+        assert len(missing) == 0
+        assert missing.match("бергамот") is None
+
+
+if __name__ == "__main__":
+    test_exact_and_normalized_match()
+    print("✅ Точные совпадения работают")
+    test_note_inside_text()
+    print("✅ Поиск нот в тексте работает")
+    test_fragment_of_note()
+    print("✅ Части нот распознаются")
+    test_is_likely_note()
+    print("✅ Короткие фразы не принимаются за ноты")
+    test_from_file_skips_comments()
+    print("✅ Словарь загружается из файла")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Тест кэша ответов AI-Пантеры через ask_chatgpt
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT)
+
+from log_config import stop_logging
+
+
+def load_main_module(workdir):
+    """Загружает 1.py в рабочем каталоге workdir: базы и снапшоты создаются там, а не в репозитории"""
+    shutil.copytree(os.path.join(ROOT, "bahur_data"), os.path.join(workdir, "bahur_data"))
+    shutil.copy(os.path.join(ROOT, "notes.txt"), workdir)
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("main_module", os.path.join(ROOT, "1.py"))
+    main_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main_module)
+    return main_module
+
+
+def test_repeated_question_answered_from_cache():
+    """Повторный вопрос по данным BAHUR не идёт в OpenAI даже при непустой предыстории"""
+    openai_calls = []
+
+    async def fake_post(name, url, **kwargs):
+        openai_calls.append(kwargs["json"])
+        return httpx.Response(200, json={"output_text": f"Ответ {len(openai_calls)}",
+                                         "usage": {"input_tokens": 10, "output_tokens": 5}})
+
+    import context
+    cwd = os.getcwd()
+    root = logging.getLogger()
+    saved_logging = (list(root.handlers), root.level)
+    shared_context = context.conversation_context
+    with tempfile.TemporaryDirectory() as tmp:
+        # Переписка теста пишется во временный каталог, а не в conversation_context.json репозитория
+        context.conversation_context = context.create_conversation_context(
+            context_file=os.path.join(tmp, "conversation_context.json"))
+        main = load_main_module(tmp)
+        try:
+            main.http_clients.post = fake_post
+
+            async def scenario():
+                first = await main.ask_chatgpt("Сколько стоит доставка?", user_id=77)
+                second = await main.ask_chatgpt("сколько стоит доставка", user_id=77)
+                # По болтовне в данных BAHUR ничего нет — такой ответ зависит от переписки и не кэшируется
+                chat = [await main.ask_chatgpt("ыыы ъъъ", user_id=77) for _ in range(2)]
+                await main.openai_usage.stop()
+                return first, second, chat
+
+            first, second, chat = asyncio.run(scenario())
+        finally:
+            main.user_states.close()
+            main.bot_db.close()
+            context.conversation_context.close()
+            context.conversation_context = shared_context
+            os.chdir(cwd)
+            # 1.py при импорте перенастраивает корневой логгер — возвращаем прежние обработчики
+            stop_logging()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            for handler in saved_logging[0]:
+                root.addHandler(handler)
+            root.setLevel(saved_logging[1])
+
+    assert first == second == "Ответ 1"
+    assert chat == ["Ответ 2", "Ответ 3"]
+    assert len(openai_calls) == 3
+    # Кэш сработал при непустой предыстории: следующий запрос к OpenAI уже несёт прошлые сообщения
+    assert len(openai_calls[1]["input"]) > 1
+    assert main.response_cache.get_stats()["hits"] >= 1
+    print("✅ Повторный вопрос отвечается из кэша")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск теста кэша ответов...")
+    test_repeated_question_answered_from_cache()
+    print("\n🎊 Все тесты пройдены!")
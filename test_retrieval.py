@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Тест поиска по bahur_data
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from retrieval import KnowledgeIndex, build_index, normalize_question, split_into_blocks, stem, tokenize
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bahur_data")
+
+
+def test_split_into_blocks():
+    """Файл разбивается на блоки «— вопрос / ответ» с заголовком раздела"""
+    text = (
+        "3. Доставка\n"
+        "— Откуда будет отправка?\n"
+        "Отправка будет со склада из города Грозный.\n"
+        "—\n"
+        "Какой срок доставки?\n"
+        "Средний срок доставки товара по России — 3-5 дней.\n"
+    )
+    blocks = split_into_blocks(text, "delivery.txt")
+    assert len(blocks) == 2
+    assert all(block["section"] == "3. Доставка" for block in blocks)
+    assert blocks[1]["text"].startswith("3. Доставка\n— Какой срок доставки?")
+    print("✅ Разбиение на блоки работает")
+
+
+def test_tokenize_stems_word_forms():
+    """Разные формы слова приводятся к одной основе"""
+    assert stem("доставка") == stem("доставки") == stem("доставку")
+    assert stem("флаконы") == stem("флаконов")
+    assert tokenize("Как оформить рассрочку?") == [stem("оформить"), stem("рассрочку")]
+    print("✅ Токенизация работает")
+
+
+def test_search_finds_relevant_section():
+    """Вопросы находят блоки из нужного файла, а не из первого попавшегося"""
+    index = build_index(DATA_DIR)
+    assert len(index) > 0
+    cases = {
+        "Сколько стоит доставка?": "bahur_data_delivery 3.txt",
+        "Какая минимальная сумма заказа?": "bahur_data_order..txt",
+        "Из чего состоит парфюмерная вода?": "bahur_data_perfumed_water.txt",
+        "Как оформить рассрочку?": "bahur_data_Installments.txt",
+    }
+    for question, source in cases.items():
+        results = index.search(question, top_k=1)
+        assert results and results[0][1]["source"] == source, question
+    assert index.search("Привет, как дела?") == []
+    print("✅ Поиск находит релевантные блоки")
+
+
+def test_build_context_respects_limit():
+    """Размер данных в промпте не превышает лимит"""
+    index = build_index(DATA_DIR)
+    context = index.build_context("масла фабрика доставка заказ", top_k=10, max_chars=1500)
+    assert 0 < len(context) <= 1500
+    assert KnowledgeIndex([]).build_context("доставка") == ""
+    print("✅ Лимит размера контекста соблюдается")
+
+
+def test_normalize_question_and_version():
+    """Формулировки одного вопроса совпадают после нормализации, версия индекса зависит от данных"""
+    assert normalize_question("Сколько стоит ДОСТАВКА?!") == normalize_question("сколько стоит доставка")
+    assert normalize_question("Доставку оформить можно?") == normalize_question("доставка, оформить")
+    assert normalize_question("Привет!") == ""
+    # Отрицания и предлоги меняют смысл вопроса, поэтому остаются в ключе
+    assert normalize_question("какие ароматы с ванилью") != normalize_question("какие ароматы без ванили")
+    assert normalize_question("есть доставка в Казань?") != normalize_question("нет доставки в Казань?")
+    assert normalize_question("Подскажите, есть ли доставка?") == normalize_question("есть доставка")
+    blocks = split_into_blocks("Доставка\n— Срок 3-5 дней\n", "a.txt")
+    changed = split_into_blocks("Доставка\n— Срок 2-4 дня\n", "a.txt")
+    assert KnowledgeIndex(blocks).version == KnowledgeIndex(list(blocks)).version
+    assert KnowledgeIndex(blocks).version != KnowledgeIndex(changed).version
+    print("✅ Нормализация вопроса и версия базы работают")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов поиска по bahur_data...")
+    test_split_into_blocks()
+    test_tokenize_stems_word_forms()
+    test_search_finds_relevant_section()
+    test_build_context_respects_limit()
+    test_normalize_question_and_version()
+    print("\n🎊 Все тесты пройдены!")
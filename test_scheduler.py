@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db import Database
+from scheduler import AsyncScheduler, CronSpec, RunLease
+
+
+def test_cron_next_after():
+    """Ближайший запуск считается как в cron"""
+    monday_7 = CronSpec("0 7 * * 1")
+    # 2025-01-06 — понедельник
+    assert monday_7.next_after(datetime(2025, 1, 6, 6, 59, 30)) == datetime(2025, 1, 6, 7, 0)
+    assert monday_7.next_after(datetime(2025, 1, 6, 7, 0)) == datetime(2025, 1, 13, 7, 0)
+    assert CronSpec("*/15 9-10 * * *").next_after(datetime(2025, 1, 6, 10, 50)) == datetime(2025, 1, 7, 9, 0)
+    assert CronSpec("30 12 * * 7").next_after(datetime(2025, 1, 6)) == datetime(2025, 1, 12, 12, 30)
+    assert CronSpec("0 0 1 * 1").next_after(datetime(2025, 1, 6)) == datetime(2025, 1, 13, 0, 0)
+    for bad in ("0 7 * *", "61 * * * *", "0 7 * * 8"):
+        try:
+            CronSpec(bad)
+            assert False, bad
+        except ValueError:
+            pass
+    print("✅ Cron-расписание считается правильно")
+
+
+def test_single_runner_lease():
+    """Из двух планировщиков с общей базой задание выполняет только один"""
+    async def scenario(databases):
+        runs = []
+        # Сдвигаем часы так, чтобы до начала следующей минуты оставалось 0.1 с
+        real_now = datetime.now()
+        next_minute = real_now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        offset = next_minute - real_now - timedelta(seconds=0.1)
+        clock = lambda: datetime.now() + offset
+
+        schedulers = []
+        for owner, db in zip(("worker-1", "worker-2"), databases):
+            lease = RunLease(db, owner=owner)
+            lease.init_table()
+            scheduler = AsyncScheduler(lease=lease, clock=clock)
+
+            async def job(owner=owner):
+                runs.append(owner)
+
+            scheduler.add("weekly", "* * * * *", job, jitter=0.05)
+            scheduler.start()
+            schedulers.append(scheduler)
+        await asyncio.sleep(0.5)
+        for scheduler in schedulers:
+            await scheduler.stop()
+        return runs, [scheduler.get_stats()["weekly"] for scheduler in schedulers]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # У каждого воркера своё соединение с общей базой
+        databases = [Database(os.path.join(tmp, "bot_users.db")) for _ in range(2)]
+        try:
+            runs, stats = asyncio.run(scenario(databases))
+        finally:
+            for db in databases:
+                db.close()
+    assert len(runs) == 1
+    assert sorted((s["runs"], s["skipped"]) for s in stats) == [(0, 1), (1, 0)]
+    print("✅ Задание выполняется одним процессом")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов планировщика...")
+    test_cron_next_after()
+    test_single_runner_lease()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Тест хранилища состояний пользователей
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db import Database
+from state_store import UserStateStore
+
+
+def test_migrates_legacy_json_with_int_keys():
+    """Старый user_states.json переносится в базу, строковые ключи становятся int"""
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "user_states.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump({"123": "awaiting_note_search", "456": "awaiting_ai_question"}, f)
+        db = Database(os.path.join(tmp, "bot_users.db"))
+        store = UserStateStore(db, flush_interval=0, legacy_file=legacy)
+        assert store.get(123) == "awaiting_note_search"
+        assert store.get("456") == "awaiting_ai_question"
+        assert not os.path.exists(legacy) and os.path.exists(legacy + ".migrated")
+        store.close()
+        db.close()
+    print("✅ user_states.json переносится в базу")
+
+
+def test_write_behind_and_ttl():
+    """Изменения записываются пачкой при flush, старые состояния истекают"""
+    now = [1000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bot_users.db")
+        db = Database(db_path)
+        store = UserStateStore(db, ttl=60, flush_interval=0, legacy_file=None, clock=lambda: now[0])
+        store.set(1, "awaiting_ai_question")
+        store.set(2, "awaiting_note_search")
+        store.set(1, "awaiting_note_search")
+        store.set(3, "awaiting_ai_question")
+        store.set(3, None)
+        assert store.get_stats()["dirty"] == 3
+        store.flush()
+        assert store.writes == 3 and store.get_stats()["dirty"] == 0
+        store.close()
+        db.close()
+
+        # Перезапуск: новое соединение с той же базой
+        db = Database(db_path)
+        reopened = UserStateStore(db, ttl=60, flush_interval=0, legacy_file=None, clock=lambda: now[0])
+        assert reopened.get(1) == "awaiting_note_search" and reopened.get(3) is None
+        now[0] += 30
+        reopened.set(2, "awaiting_ai_question")
+        now[0] += 45
+        assert reopened.get(1) is None
+        reopened.expire()
+        assert len(reopened) == 1 and reopened.get(2) == "awaiting_ai_question"
+        reopened.close()
+        db.close()
+
+        now[0] += 120
+        db = Database(db_path)
+        expired = UserStateStore(db, ttl=60, flush_interval=0, legacy_file=None, clock=lambda: now[0])
+        assert len(expired) == 0
+        expired.close()
+        db.close()
+    print("✅ Фоновая запись и TTL работают")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов хранилища состояний...")
+    test_migrates_legacy_json_with_int_keys()
+    test_write_behind_and_ttl()
+    print("\n🎊 Все тесты пройдены!")
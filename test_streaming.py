@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Тест потоковых ответов OpenAI и постепенного редактирования сообщения
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import streaming
+from streaming import (ProgressiveMessage, StreamError, has_html_markup, iter_sse_deltas, parse_sse_delta,
+                       preview_text)
+
+
+def test_parse_sse_delta():
+    """Текст достаётся из событий обоих API, служебные события пропускаются"""
+    responses_delta = "data: " + json.dumps({"type": "response.output_text.delta", "delta": "Привет"})
+    assert parse_sse_delta(responses_delta, True) == "Привет"
+    assert parse_sse_delta("event: response.output_text.delta", True) is None
+    assert parse_sse_delta("data: " + json.dumps({"type": "response.completed"}), True) is None
+    chat_delta = "data: " + json.dumps({"choices": [{"delta": {"content": "мир"}}]})
+    assert parse_sse_delta(chat_delta, False) == "мир"
+    assert parse_sse_delta("data: [DONE]", False) is None
+    try:
+        parse_sse_delta("data: " + json.dumps({"type": "error", "error": {"message": "boom"}}), True)
+        assert False, "ожидалась ошибка потока"
+    except StreamError:
+        pass
+    print("✅ События SSE разбираются")
+
+
+class FakeStream:
+    def __init__(self, events):
+        self.lines = ["data: " + json.dumps(event) for event in events] + ["data: [DONE]"]
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            yield line
+
+
+def test_stream_usage_is_collected():
+    """Блок usage из последнего события потока попадает в словарь usage"""
+    async def collect(events, use_responses_api):
+        usage = {}
+        parts = [delta async for delta in iter_sse_deltas(FakeStream(events), use_responses_api, usage)]
+        return "".join(parts), usage
+
+    text, usage = asyncio.run(collect([
+        {"type": "response.output_text.delta", "delta": "При"},
+        {"type": "response.output_text.delta", "delta": "вет"},
+        {"type": "response.completed", "response": {"usage": {"input_tokens": 900, "output_tokens": 12}}},
+    ], True))
+    assert text == "Привет" and usage == {"input_tokens": 900, "output_tokens": 12}
+
+    text, usage = asyncio.run(collect([
+        {"choices": [{"delta": {"content": "мир"}}], "usage": None},
+        {"choices": [], "usage": {"prompt_tokens": 50, "completion_tokens": 3}},
+    ], False))
+    assert text == "мир" and usage == {"prompt_tokens": 50, "completion_tokens": 3}
+    print("✅ Расход токенов берётся из потока")
+
+
+def test_progressive_message_throttles_edits():
+    """Первый кусок отправляется сразу, правки — не чаще интервала, недописанные теги скрыты"""
+    now = [0.0]
+    sent, edits = [], []
+
+    async def send(text):
+        sent.append(text)
+        return 42
+
+    async def edit(message_id, text):
+        edits.append((message_id, text))
+        return True
+
+    async def scenario():
+        message = ProgressiveMessage(send, edit, interval=1.0, clock=lambda: now[0])
+        await message.update("Доставка")
+        await message.update("Доставка по России")
+        now[0] = 1.5
+        await message.update("Доставка по России <a hr")
+        await message.update("Доставка по России <a href='https://x.ru'>сайт</a>")
+        now[0] = 3.0
+        await message.update("Доставка по России <a href='https://x.ru'>сайт</a>")
+        return message
+
+    message = asyncio.run(scenario())
+    assert sent == ["Доставка"]
+    assert edits == [(42, "Доставка по России"), (42, "Доставка по России сайт")]
+    assert message.message_id == 42 and message.edits == 2
+    assert preview_text("**Цена** <a href='u'>тут</a>") == "Цена тут"
+    print("✅ Сообщение обновляется с ограничением частоты")
+
+
+def test_progressive_message_joins_only_when_due():
+    """Куски склеиваются и чистятся только тогда, когда пора отправить правку"""
+    now = [0.0]
+    previews = []
+    original_preview = streaming.preview_text
+
+    def counting_preview(text):
+        previews.append(text)
+        return original_preview(text)
+
+    async def send(text):
+        return 42
+
+    async def edit(message_id, text):
+        return True
+
+    async def scenario():
+        message = ProgressiveMessage(send, edit, interval=1.0, clock=lambda: now[0])
+        parts = []
+        for delta in ["Цена", " 100", " ₽", " за", " мл"]:
+            parts.append(delta)
+            await message.update(parts)
+        now[0] = 1.5
+        await message.update(parts)
+        return message
+
+    streaming.preview_text = counting_preview
+    try:
+        message = asyncio.run(scenario())
+    finally:
+        streaming.preview_text = original_preview
+    assert previews == ["Цена", "Цена 100 ₽ за мл"]
+    assert message.shown_text == "Цена 100 ₽ за мл" and message.edits == 1
+    assert has_html_markup("<b>Цена</b>") and has_html_markup("Tom &amp; Jerry")
+    assert not has_html_markup("Цена < 100 & скидка")
+    print("✅ Промежуточный текст собирается только перед отправкой")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов потоковых ответов...")
+    test_parse_sse_delta()
+    test_stream_usage_is_collected()
+    test_progressive_message_throttles_edits()
+    test_progressive_message_joins_only_when_due()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тест трассировки обновлений
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tracing import NOOP_SPAN, Tracer, current_trace_id, set_attributes, span, traced
+
+
+@traced("openai")
+async def fake_openai():
+    set_attributes(model="gpt-test", prompt_chars=120)
+    with span("http.openai", pool="openai") as current:
+        await asyncio.sleep(0)
+        current.set("status", 200)
+    return "ответ"
+
+
+def test_spans_and_attributes():
+    """Участки вложены, атрибуты попадают в нужный участок; без трассы — заглушка"""
+    with span("вне трассы") as current:
+        assert current is NOOP_SPAN
+    assert current_trace_id() is None
+
+    tracer = Tracer(slow_threshold=0.0)
+    trace = tracer.start("update", update_id=1)
+
+    async def handle():
+        with tracer.activate(trace):
+            assert current_trace_id() == trace.trace_id
+            return await fake_openai()
+
+    assert asyncio.run(handle()) == "ответ"
+    assert current_trace_id() is None
+    result = tracer.get(trace.trace_id)
+    openai_span, http_span = result["spans"]
+    assert openai_span["name"] == "openai" and openai_span["parent_id"] is None
+    assert openai_span["attributes"] == {"model": "gpt-test", "prompt_chars": 120}
+    assert http_span["parent_id"] == openai_span["span_id"]
+    assert http_span["attributes"] == {"pool": "openai", "status": 200}
+
+
+def test_slow_buffer_and_errors():
+    """В буфер попадают только медленные трассы, буфер кольцевой; ошибки отмечаются"""
+    tracer = Tracer(slow_threshold=0.01, capacity=2)
+    fast = tracer.start("update")
+    with tracer.activate(fast):
+        pass
+
+    async def slow_update(n):
+        trace = tracer.start("update", n=n)
+        with tracer.activate(trace):
+            await asyncio.sleep(0.02)
+        return trace
+
+    for n in range(3):
+        asyncio.run(slow_update(n))
+    traces = tracer.get_traces()
+    assert [t["attributes"]["n"] for t in traces] == [2, 1]
+    assert tracer.get(fast.trace_id) is None
+    assert tracer.get_stats()["slow"] == 3
+
+    failing = tracer.start("update")
+    try:
+        with tracer.activate(failing), span("search_note"):
+            raise TimeoutError("поиск не ответил")
+    except TimeoutError:
+        pass
+    assert failing.attributes["error"] == "TimeoutError"
+    assert failing.spans[0].error == "TimeoutError"
+
+
+def test_park_and_claim_between_tasks():
+    """Трасса из webhook продолжается в воркере очереди"""
+    tracer = Tracer(slow_threshold=0.0)
+
+    async def main():
+        queue = asyncio.Queue()
+        trace = tracer.start("update", update_id=77)
+        with tracer.activate(trace, finish=False), span("webhook"):
+            tracer.park(77, trace)
+            await queue.put(77)
+
+        async def worker():
+            update_id = await queue.get()
+            claimed = tracer.claim(update_id)
+            with tracer.activate(claimed), span("telegram.sendMessage"):
+                return current_trace_id()
+
+        return trace, await asyncio.create_task(worker())
+
+    trace, worker_trace_id = asyncio.run(main())
+    assert worker_trace_id == trace.trace_id
+    assert [s.name for s in trace.spans] == ["webhook", "telegram.sendMessage"]
+    assert tracer.claim(77) is None and tracer.get(trace.trace_id) is not None
+
+
+if __name__ == "__main__":
+    test_spans_and_attributes()
+    print("✅ Участки и атрибуты записываются")
+    test_slow_buffer_and_errors()
+    print("✅ Медленные трассы попадают в кольцевой буфер")
+    test_park_and_claim_between_tasks()
+    print("✅ Трасса переходит из webhook в воркер")
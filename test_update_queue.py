@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Тест очереди обновлений Telegram
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from update_queue import UpdateQueue
+
+
+def test_stop_drains_queue():
+    """При остановке уже принятые обновления обрабатываются, новые — отклоняются"""
+    async def scenario():
+        processed = []
+
+        async def handler(update):
+            await asyncio.sleep(0.01)
+            processed.append(update["update_id"])
+
+        queue = UpdateQueue(handler, workers=2, maxsize=10)
+        queue.start()
+        accepted = [queue.enqueue({"update_id": i}) for i in range(5)]
+        await queue.stop(timeout=5)
+        return accepted, processed, queue.enqueue({"update_id": 99}), queue.get_stats()
+
+    accepted, processed, after_stop, stats = asyncio.run(scenario())
+    assert all(accepted)
+    assert sorted(processed) == [0, 1, 2, 3, 4]
+    assert after_stop is False
+    assert stats["processed"] == 5 and stats["depth"] == 0
+    print("✅ Очередь дорабатывается при остановке")
+
+
+def test_full_queue_rejects():
+    """Переполненная очередь отклоняет обновления, ошибки обработчика не останавливают воркеры"""
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(update):
+            await release.wait()
+            if update["update_id"] == 0:
+                raise RuntimeError("boom")
+
+        queue = UpdateQueue(handler, workers=1, maxsize=2)
+        queue.start()
+        results = [queue.enqueue({"update_id": i}) for i in range(3)]
+        await asyncio.sleep(0)
+        results.append(queue.enqueue({"update_id": 3}))
+        release.set()
+        await queue.stop(timeout=5)
+        return results, queue.get_stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [True, True, False, True]
+    assert stats["rejected"] == 1 and stats["failed"] == 1 and stats["processed"] == 2
+    print("✅ Переполнение очереди обрабатывается")
+
+
+def test_per_chat_order_and_parallelism():
+    """Обновления одного чата идут по порядку и не пересекаются, разные чаты — параллельно"""
+    async def scenario():
+        log = []
+        active = {}
+        overlaps = []
+        max_parallel = 0
+
+        async def handler(update):
+            nonlocal max_parallel
+            chat_id = update["message"]["chat"]["id"]
+            if active.get(chat_id):
+                overlaps.append(chat_id)
+            active[chat_id] = True
+            max_parallel = max(max_parallel, sum(active.values()))
+            await asyncio.sleep(0.01)
+            log.append((chat_id, update["update_id"]))
+            active[chat_id] = False
+
+        queue = UpdateQueue(handler, workers=4, maxsize=100)
+        queue.start()
+        for i in range(12):
+            queue.enqueue({"update_id": i, "message": {"chat": {"id": i % 3}}})
+        await queue.stop(timeout=5)
+        return log, overlaps, max_parallel, queue.get_stats()
+
+    log, overlaps, max_parallel, stats = asyncio.run(scenario())
+    for chat_id in range(3):
+        assert [u for c, u in log if c == chat_id] == list(range(chat_id, 12, 3))
+    assert overlaps == []
+    assert max_parallel == 3
+    assert stats["active_chats"] == 0
+    print("✅ Порядок внутри чата сохраняется, чаты обрабатываются параллельно")
+
+
+def test_take_queued_updates():
+    """Обработчик забирает идущие подряд подходящие обновления своего чата"""
+    async def scenario():
+        handled, merged = [], []
+
+        async def handler(update):
+            handled.append(update["update_id"])
+            if update["update_id"] == 0:
+                await asyncio.sleep(0.01)
+                taken = queue.take_queued(1, lambda u: "text" in u["message"])
+                merged.extend(u["update_id"] for u in taken)
+
+        queue = UpdateQueue(handler, workers=2, maxsize=10)
+        queue.start()
+        for update_id, message in enumerate([{"text": "a"}, {"text": "b"}, {"text": "c"}, {"voice": {}}, {"text": "d"}]):
+            queue.enqueue({"update_id": update_id, "message": {"chat": {"id": 1}, **message}})
+        await queue.stop(timeout=5)
+        return handled, merged, queue.get_stats()
+
+    handled, merged, stats = asyncio.run(scenario())
+    assert merged == [1, 2]
+    assert handled == [0, 3, 4]
+    assert stats["taken"] == 2 and stats["depth"] == 0
+    print("✅ Очередные обновления чата забираются обработчиком")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов очереди обновлений...")
+    test_stop_drains_queue()
+    test_full_queue_rejects()
+    test_per_chat_order_and_parallelism()
+    test_take_queued_updates()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Тест учёта расхода токенов OpenAI
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db import Database
+from usage import UsageTracker, extract_usage, usage_cost
+
+
+def test_extract_usage_both_apis():
+    """Токены из блока usage Responses и Chat Completions API"""
+    responses = {"input_tokens": 1200, "output_tokens": 300, "input_tokens_details": {"cached_tokens": 1024},
+                 "output_tokens_details": {"reasoning_tokens": 256}}
+    assert extract_usage(responses) == {"input_tokens": 1200, "output_tokens": 300,
+                                        "reasoning_tokens": 256, "cached_tokens": 1024}
+    chat = {"prompt_tokens": 800, "completion_tokens": 90, "completion_tokens_details": {"reasoning_tokens": 0}}
+    assert extract_usage(chat) == {"input_tokens": 800, "output_tokens": 90, "reasoning_tokens": 0, "cached_tokens": 0}
+    assert extract_usage(None) == {"input_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0, "cached_tokens": 0}
+
+
+def test_cost_by_model_price():
+    """Стоимость считается по цене модели; кэшированный вход дешевле, версия модели в имени не мешает"""
+    tokens = extract_usage({"input_tokens": 1_000_000, "output_tokens": 100_000,
+                            "input_tokens_details": {"cached_tokens": 400_000}})
+    prices = {"gpt-5": (1.0, 0.1, 10.0), "gpt-5-mini": (0.2, 0.02, 2.0)}
+    assert abs(usage_cost("gpt-5", tokens, prices) - (0.6 + 0.04 + 1.0)) < 1e-9
+    assert abs(usage_cost("gpt-5-mini-2025-08-07", tokens, prices) - (0.12 + 0.008 + 0.2)) < 1e-9
+    assert usage_cost("gpt-50", tokens, prices) is None
+    assert usage_cost("unknown", tokens, prices) is None
+
+
+def test_windows_by_model_and_user():
+    """Суммы по моделям и пользователям за окна, удаление старых записей"""
+    now = [1_000_000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bot_users.db"))
+        tracker = UsageTracker(db, retention_days=1, windows={"1h": 3600, "24h": 86400}, clock=lambda: now[0],
+                               prices={"gpt-5": (1.0, 0.1, 10.0)})
+        tracker.init_table()
+
+        async def scenario():
+            now[0] -= 2 * 3600
+            tracker.record("gpt-5", {"input_tokens": 1000, "output_tokens": 100}, 4.0, user_id=1)
+            now[0] += 2 * 3600
+            tracker.record("gpt-5", {"input_tokens": 2000, "output_tokens": 200,
+                                           "output_tokens_details": {"reasoning_tokens": 50}}, 6.0, user_id=1)
+            tracker.record("gpt-4o-mini", {"prompt_tokens": 500, "completion_tokens": 50}, 1.0, user_id=2)
+            tracker.record("gpt-5", None, 30.0, user_id=2, status="timeout")
+            report = await tracker.report()
+            user = await tracker.user_report(1)
+            plan = await db.fetchall("EXPLAIN QUERY PLAN SELECT model FROM openai_usage WHERE user_id = ? AND ts >= ?",
+                                     (1, 0))
+            assert "idx_openai_usage_user" in str(plan)
+            now[0] += 2 * 86400
+            removed = await tracker.prune()
+            return report, user, removed
+
+        report, user, removed = asyncio.run(scenario())
+        db.close()
+
+    hour = {row["model"]: row for row in report["1h"]["by_model"]}
+    assert hour["gpt-5"]["calls"] == 2 and hour["gpt-5"]["errors"] == 1
+    assert hour["gpt-5"]["input_tokens"] == 2000 and hour["gpt-5"]["reasoning_tokens"] == 50
+    assert hour["gpt-5"]["max_latency_ms"] == 30000.0
+    assert abs(hour["gpt-5"]["cost_usd"] - 0.004) < 1e-9
+    assert hour["gpt-4o-mini"]["input_tokens"] == 500 and hour["gpt-4o-mini"]["cost_usd"] == 0
+    day = {row["model"]: row for row in report["24h"]["by_model"]}
+    assert day["gpt-5"]["input_tokens"] == 3000 and day["gpt-5"]["calls"] == 3
+    assert [row["user_id"] for row in report["24h"]["top_users"]] == [1, 2]
+    assert user["1h"] == [{"model": "gpt-5", "calls": 1, "input_tokens": 2000, "output_tokens": 200,
+                           "reasoning_tokens": 50, "avg_latency_ms": 6000.0, "cost_usd": 0.004}]
+    assert removed == 4 and tracker.get_stats()["recorded"] == 4
+
+
+if __name__ == "__main__":
+    test_extract_usage_both_apis()
+    print("✅ Токены извлекаются из ответов обоих API")
+    test_cost_by_model_price()
+    print("✅ Стоимость считается по цене модели")
+    test_windows_by_model_and_user()
+    print("✅ Расход считается по моделям, пользователям и окнам")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Тест очереди распознавания голосовых сообщений
+"""
+
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import voice_pipeline
+from voice_pipeline import AudioDecodeError, VoiceJobCancelled, VoicePipeline, VoiceQueueFull, decode_pcm_chunks
+
+# Вместо ffmpeg: копирует stdin в stdout; "bad" — ошибка декодирования, "loop" — бесконечный поток
+FAKE_FFMPEG = """#!{python}
+import sys
+data = sys.stdin.buffer.read()
+if data.startswith(b"bad"):
+    sys.stderr.write("Invalid data found when processing input")
+    sys.exit(1)
+if data.startswith(b"loop"):
+    while True:
+        sys.stdout.buffer.write(bytes(64000))
+sys.stdout.buffer.write(data)
+"""
+
+
+def slow_recognize(file_content, cancel=None):
+    time.sleep(0.2)
+    return file_content.decode()
+
+
+def test_event_loop_stays_responsive():
+    """Блокирующее распознавание не останавливает остальные корутины"""
+    async def scenario():
+        pipeline = VoicePipeline(workers=1, queue_size=5, recognize=slow_recognize)
+        pipeline.start()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        result = await pipeline.recognize("привет".encode())
+        ticker_task.cancel()
+        await pipeline.stop()
+        return result, ticks
+
+    result, ticks = asyncio.run(scenario())
+    assert result == "привет"
+    assert ticks >= 10
+    print("✅ Event loop не блокируется во время распознавания")
+
+
+def test_backpressure_and_timeout():
+    """Переполненная очередь отклоняет задания, долгие задания завершаются по таймауту"""
+    async def scenario():
+        pipeline = VoicePipeline(workers=1, queue_size=1, job_timeout=0.05, recognize=slow_recognize)
+        pipeline.start()
+        first = asyncio.create_task(pipeline.recognize(b"1"))
+        await asyncio.sleep(0.01)  # первое задание уже у воркера
+        second = asyncio.create_task(pipeline.recognize(b"2"))
+        await asyncio.sleep(0)
+        rejected = False
+        try:
+            await pipeline.recognize(b"3")
+        except VoiceQueueFull:
+            rejected = True
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        stats = pipeline.get_stats()
+        await pipeline.stop()
+        return rejected, results, stats
+
+    rejected, results, stats = asyncio.run(scenario())
+    assert rejected
+    assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    assert stats["rejected"] == 1 and stats["timeouts"] == 2 and stats["queue_depth"] == 0
+    print("✅ Backpressure и таймауты работают")
+
+
+def test_timeout_cancels_running_job():
+    """После таймаута задание получает флаг отмены, а воркер ждёт остановки потока; таймаут растёт с длительностью"""
+    stopped = threading.Event()
+
+    def chunked_recognize(file_content, cancel=None):
+        for _ in range(100):
+            if cancel is not None and cancel.is_set():
+                stopped.set()
+                return "cancelled"
+            time.sleep(0.01)
+        return "done"
+
+    async def scenario():
+        pipeline = VoicePipeline(workers=1, queue_size=2, job_timeout=0.05, timeout_per_second=0.01,
+                                 recognize=chunked_recognize)
+        pipeline.start()
+        try:
+            await pipeline.recognize(b"long")
+            timed_out = False
+        except asyncio.TimeoutError:
+            timed_out = True
+        # Воркер свободен только после остановки потока
+        await asyncio.sleep(0.05)
+        in_progress = pipeline.get_stats()["in_progress"]
+        await pipeline.stop()
+        return timed_out, in_progress, pipeline.timeout_for(600)
+
+    timed_out, in_progress, long_timeout = asyncio.run(scenario())
+    assert timed_out and stopped.is_set() and in_progress == 0
+    assert long_timeout == 6.0
+    print("✅ Задание останавливается после таймаута")
+
+
+def test_decode_pcm_chunks():
+    """PCM отдаётся кусками по chunk_seconds; ошибка ffmpeg и отмена завершают процесс"""
+    with tempfile.TemporaryDirectory() as tmp:
+        fake = os.path.join(tmp, "ffmpeg")
+        with open(fake, "w") as f:
+            f.write(FAKE_FFMPEG.format(python=sys.executable))
+        os.chmod(fake, os.stat(fake).st_mode | stat.S_IEXEC)
+        original, voice_pipeline.FFMPEG_BINARY = voice_pipeline.FFMPEG_BINARY, fake
+        try:
+            second = voice_pipeline.SAMPLE_RATE * voice_pipeline.SAMPLE_WIDTH
+            audio = bytes(int(second * 2.5))
+            assert [len(chunk) for chunk in decode_pcm_chunks(audio, chunk_seconds=1)] == [second, second, second // 2]
+
+            try:
+                list(decode_pcm_chunks(b"bad input", chunk_seconds=1))
+                assert False, "ожидалась AudioDecodeError"
+            except AudioDecodeError as e:
+                assert "Invalid data" in str(e)
+
+            cancel = threading.Event()
+            chunks = 0
+            try:
+                for _ in decode_pcm_chunks(b"loop", chunk_seconds=1, cancel=cancel):
+                    chunks += 1
+                    cancel.set()
+                assert False, "ожидалась VoiceJobCancelled"
+            except VoiceJobCancelled:
+                pass
+            assert chunks == 1
+        finally:
+            voice_pipeline.FFMPEG_BINARY = original
+    print("✅ Декодирование кусками через ffmpeg работает")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов очереди распознавания...")
+    test_event_loop_stays_responsive()
+    test_backpressure_and_timeout()
+    test_timeout_cancels_running_job()
+    test_decode_pcm_chunks()
+    print("\n🎊 Все тесты пройдены!")
@@ -0,0 +1,233 @@
+import functools
+import inspect
+import logging
+import secrets
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """Участок обработки: имя, время начала/конца и атрибуты (модель, размер промпта, HTTP статус)"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.span_id = secrets.token_hex(4)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self, trace_start: float) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - trace_start) * 1000, 1),
+            "duration_ms": round(((self.end or time.time()) - self.start) * 1000, 1),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Заглушка, когда трассировка не активна: span() ничего не записывает"""
+
+    __slots__ = ()
+
+    def set(self, key: str, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Трасса одного обновления Telegram: корневые атрибуты и список участков"""
+
+    def __init__(self, name: str, attributes: dict, max_spans: int = 200):
+        self.trace_id = secrets.token_hex(8)
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        self.max_spans = max_spans
+        self.dropped_spans = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self, with_spans: bool = True) -> dict:
+        result = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 1),
+            "attributes": self.attributes,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped_spans,
+        }
+        if with_spans:
+            result["spans"] = [span.to_dict(self.start) for span in self.spans]
+        return result
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Участок текущей трассы; без активной трассы — почти бесплатная заглушка"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield NOOP_SPAN
+        return
+    if len(trace.spans) >= trace.max_spans:
+        trace.dropped_spans += 1
+        yield NOOP_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else None, attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+
+
+def set_attributes(**attributes):
+    """Добавляет атрибуты текущему участку (или корню трассы, если участка нет)"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+        return
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции (обычной или async) — участок name текущей трассы"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Tracer:
+    """Трассы обновлений; медленные (дольше slow_threshold секунд) сохраняются в кольцевой буфер.
+
+    Трасса начинается в webhook, а обработка идёт в воркере очереди, поэтому между ними трасса
+    передаётся через park()/claim() по update_id: contextvars не переходят через asyncio.Queue.
+    """
+
+    def __init__(self, slow_threshold: float = 2.0, capacity: int = 200, max_spans: int = 200,
+                 max_parked: int = 10000):
+        self.slow_threshold = slow_threshold
+        self.max_spans = max_spans
+        self.max_parked = max_parked
+        self.slow: Deque[Trace] = deque(maxlen=capacity)
+        self._parked: "OrderedDict[object, Trace]" = OrderedDict()
+        self.stats = {"started": 0, "finished": 0, "slow": 0}
+
+    def start(self, name: str, **attributes) -> Trace:
+        self.stats["started"] += 1
+        return Trace(name, attributes, self.max_spans)
+
+    @contextmanager
+    def activate(self, trace: Trace, finish: bool = True):
+        """Делает trace текущей трассой; при finish=True по выходу трасса завершается"""
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            if finish:
+                self.finish(trace)
+
+    def finish(self, trace: Trace):
+        if trace.end is not None:
+            return
+        trace.end = time.time()
+        self.stats["finished"] += 1
+        if trace.duration >= self.slow_threshold:
+            self.stats["slow"] += 1
+            self.slow.append(trace)
+            logger.info("Медленная трасса %s (%s): %.0f мс, участков: %d", trace.trace_id, trace.name,
+                        trace.duration * 1000, len(trace.spans))
+
+    def park(self, key, trace: Trace):
+        """Оставляет трассу до продолжения обработки в другой задаче"""
+        if key is None:
+            return
+        self._parked[key] = trace
+        while len(self._parked) > self.max_parked:
+            self._parked.popitem(last=False)
+
+    def claim(self, key) -> Optional[Trace]:
+        if key is None:
+            return None
+        return self._parked.pop(key, None)
+
+    def get_traces(self, limit: int = 50, min_duration_ms: float = 0.0) -> List[dict]:
+        """Медленные трассы, новые первыми (без участков)"""
+        result = []
+        for trace in reversed(self.slow):
+            if trace.duration * 1000 >= min_duration_ms:
+                result.append(trace.to_dict(with_spans=False))
+                if len(result) >= limit:
+                    break
+        return result
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        for trace in self.slow:
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+        return None
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "buffered": len(self.slow),
+            "capacity": self.slow.maxlen,
+            "parked": len(self._parked),
+            "slow_threshold_s": self.slow_threshold,
+        }
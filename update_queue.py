@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: dict) -> Optional[int]:
+    """chat_id обновления Telegram (message или callback_query), если он есть"""
+    message = update.get("message") or update.get("edited_message")
+    if message is None and "callback_query" in update:
+        message = update["callback_query"].get("message")
+    if message and "chat" in message:
+        return message["chat"].get("id")
+    return None
+
+
+class UpdateQueue:
+    """Очередь обновлений Telegram: webhook сразу отвечает 200, пул воркеров обрабатывает обновления.
+
+    Обновления одного чата обрабатываются строго по порядку и по одному, разные чаты — параллельно.
+    Для каждого чата держится своя очередь, которая удаляется, как только чат простаивает.
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable], workers: int = 8, maxsize: int = 1000,
+                 key_func: Callable[[dict], Any] = update_chat_id):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.key_func = key_func
+        # Чаты, готовые к обработке; каждый чат находится здесь не более одного раза
+        self.ready: Optional[asyncio.Queue] = None
+        # Ожидающие обновления по чатам; ключ есть, пока чат в ready или обрабатывается
+        self._pending: Dict[Hashable, Deque[tuple]] = {}
+        self._size = 0
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        self._stopped = False
+        self._in_progress = 0
+        self._stats = {"enqueued": 0, "rejected": 0, "processed": 0, "failed": 0, "taken": 0}
+        self._max_depth = 0
+
+    def start(self):
+        """Запускает воркеры на текущем event loop"""
+        if self._tasks:
+            return
+        self.ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._accepting = True
+        logger.info(f"Update queue started: workers={self.workers}, maxsize={self.maxsize}")
+
+    def enqueue(self, update: dict) -> bool:
+        """Кладёт обновление в очередь его чата; False, если очередь заполнена или остановлена"""
+        if not self._accepting:
+            if self._stopped:
+                self._stats["rejected"] += 1
+                return False
+            self.start()
+        if self._size >= self.maxsize:
+            self._stats["rejected"] += 1
+            return False
+
+        key = self.key_func(update)
+        if key is None:
+            # Без чата порядок не важен — отдельная очередь на каждое обновление
+            key = object()
+        item = (update, time.perf_counter())
+        items = self._pending.get(key)
+        if items is None:
+            self._pending[key] = deque([item])
+            self.ready.put_nowait(key)
+        else:
+            # Чат уже ждёт воркера или обрабатывается — обновление подхватят после предыдущих
+            items.append(item)
+        self._size += 1
+        self._stats["enqueued"] += 1
+        self._max_depth = max(self._max_depth, self._size)
+        return True
+
+    async def _worker(self, number: int):
+        while True:
+            key = await self.ready.get()
+            items = self._pending[key]
+            update, _ = items.popleft()
+            self._size -= 1
+            self._in_progress += 1
+            try:
+                await self.handler(update)
+                self._stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"Update worker {number} failed on update {update.get('update_id')}: {e}", exc_info=True)
+            finally:
+                self._in_progress -= 1
+                # Следующее обновление чата — в конец очереди, чтобы один чат не занимал воркер
+                if items:
+                    self.ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                self.ready.task_done()
+
+    async def stop(self, timeout: float = 25.0):
+        """Перестаёт принимать обновления, дожидается обработки очереди и останавливает воркеры"""
+        if not self._tasks:
+            return
+        self._accepting = False
+        self._stopped = True
+        logger.info(f"Draining update queue: {self.depth()} queued, {self._in_progress} in progress")
+        try:
+            await asyncio.wait_for(self.ready.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Update queue drain timed out after {timeout}s, {self.depth()} updates dropped")
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("Update queue stopped")
+
+    def take_queued(self, key: Hashable, predicate: Callable[[dict], bool]) -> List[dict]:
+        """Забирает из очереди чата идущие подряд ожидающие обновления, для которых predicate истинен.
+
+        Вызывается из обработчика текущего обновления чата, чтобы ответить на несколько сообщений сразу;
+        забранные обновления воркеры уже не обрабатывают. Порядок сохраняется: выборка
+        останавливается на первом неподходящем обновлении.
+        """
+        items = self._pending.get(key)
+        taken = []
+        while items and predicate(items[0][0]):
+            taken.append(items.popleft()[0])
+        self._size -= len(taken)
+        self._stats["taken"] += len(taken)
+        return taken
+
+    def depth(self) -> int:
+        """Количество обновлений, ожидающих обработки"""
+        return self._size
+
+    def get_stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "max_depth": self._max_depth,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "in_progress": self._in_progress,
+            "active_chats": len(self._pending),
+            **self._stats,
+        }
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+# Скользящие окна отчёта: название → длительность в секундах
+DEFAULT_WINDOWS = {"1h": 3600, "24h": 24 * 3600, "7d": 7 * 24 * 3600}
+
+_TOKEN_FIELDS = ("input_tokens", "output_tokens", "reasoning_tokens", "cached_tokens")
+
+# Цены OpenAI в долларах за миллион токенов: (вход, вход из кэша, выход); reasoning входит в выход.
+# Модель с датой в имени (gpt-5-2025-08-07) берёт цену по самому длинному совпадающему префиксу.
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-5": (1.25, 0.125, 10.0),
+    "gpt-5-mini": (0.25, 0.025, 2.0),
+    "gpt-5-nano": (0.05, 0.005, 0.4),
+    "gpt-4.1": (2.0, 0.5, 8.0),
+    "gpt-4.1-mini": (0.4, 0.1, 1.6),
+    "gpt-4.1-nano": (0.1, 0.025, 0.4),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+}
+
+
+def extract_usage(usage: Optional[dict]) -> Dict[str, int]:
+    """Токены из блока usage ответа OpenAI (Responses или Chat Completions API)"""
+    usage = usage or {}
+    input_details = usage.get("input_tokens_details") or usage.get("prompt_tokens_details") or {}
+    output_details = usage.get("output_tokens_details") or usage.get("completion_tokens_details") or {}
+    return {
+        "input_tokens": int(usage.get("input_tokens", usage.get("prompt_tokens")) or 0),
+        "output_tokens": int(usage.get("output_tokens", usage.get("completion_tokens")) or 0),
+        "reasoning_tokens": int(output_details.get("reasoning_tokens") or 0),
+        "cached_tokens": int(input_details.get("cached_tokens") or 0),
+    }
+
+
+def usage_cost(model: str, tokens: Dict[str, int],
+               prices: Optional[Dict[str, Tuple[float, float, float]]] = None) -> Optional[float]:
+    """Стоимость запроса в долларах; None, если цена модели неизвестна"""
+    prices = MODEL_PRICES if prices is None else prices
+    price = prices.get(model)
+    if price is None:
+        prefix = max((name for name in prices if model.startswith(name + "-")), key=len, default=None)
+        price = prices.get(prefix) if prefix else None
+    if price is None:
+        return None
+    input_price, cached_price, output_price = price
+    cached = min(tokens["cached_tokens"], tokens["input_tokens"])
+    return ((tokens["input_tokens"] - cached) * input_price + cached * cached_price
+            + tokens["output_tokens"] * output_price) / 1_000_000
+
+
+class UsageTracker:
+    """Учёт токенов, стоимости и задержки каждого запроса к OpenAI в таблице openai_usage.
+
+    Одна строка на запрос; суммы по моделям и пользователям за скользящие окна считаются запросом
+    к SQLite по индексам на ts и user_id. Строки старше retention_days удаляются prune().
+    record() не ждёт диска: записи копятся и раз в flush_interval секунд сохраняются одной транзакцией.
+    """
+
+    def __init__(self, db: Database, retention_days: float = 30, windows: Optional[Dict[str, int]] = None,
+                 clock=time.time, prices: Optional[Dict[str, Tuple[float, float, float]]] = None,
+                 flush_interval: float = 1.0):
+        self.db = db
+        self.retention_days = retention_days
+        self.windows = dict(windows or DEFAULT_WINDOWS)
+        self.clock = clock
+        self.prices = dict(MODEL_PRICES if prices is None else prices)
+        self.flush_interval = flush_interval
+        self._pending: List[tuple] = []
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "errors": 0, "pruned": 0}
+
+    def init_table(self):
+        """Создаёт таблицу (вызывается при запуске, вне event loop)"""
+        def create(conn):
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS openai_usage (
+                    ts REAL NOT NULL,
+                    user_id INTEGER,
+                    model TEXT NOT NULL,
+                    api TEXT,
+                    status TEXT NOT NULL,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    latency_ms REAL NOT NULL,
+                    cost_usd REAL
+                )
+            ''')
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(openai_usage)")}
+            if "cost_usd" not in columns:
+                conn.execute("ALTER TABLE openai_usage ADD COLUMN cost_usd REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_openai_usage_ts ON openai_usage (ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_openai_usage_user ON openai_usage (user_id, ts)")
+        self.db.run_sync(create)
+
+    def record(self, model: str, usage: Optional[dict], latency: float, user_id: Optional[int] = None,
+               api: Optional[str] = None, status: str = "ok"):
+        """Запоминает один запрос к OpenAI; в базу он попадёт при ближайшем flush()"""
+        tokens = extract_usage(usage)
+        self._pending.append(
+            (self.clock(), user_id, model, api, status, *(tokens[field] for field in _TOKEN_FIELDS),
+             round(latency * 1000, 1), usage_cost(model, tokens, self.prices))
+        )
+
+    async def flush(self):
+        """Записывает накопленные запросы одной транзакцией; ошибки записи не мешают ответам пользователям"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            await self.db.executemany(
+                "INSERT INTO openai_usage (ts, user_id, model, api, status, input_tokens, output_tokens, "
+                "reasoning_tokens, cached_tokens, latency_ms, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                pending
+            )
+            self.stats["recorded"] += len(pending)
+        except Exception as e:
+            self.stats["errors"] += len(pending)
+            logger.error("Не удалось записать расход токенов OpenAI (%s запросов): %s", len(pending), e)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Запускает фоновую запись на текущем event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сохраняет то, что осталось"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def prune(self) -> int:
+        """Удаляет записи старше retention_days"""
+        removed = await self.db.execute("DELETE FROM openai_usage WHERE ts < ?",
+                                        (self.clock() - self.retention_days * 86400,))
+        self.stats["pruned"] += removed
+        if removed:
+            logger.info("Удалено %s старых записей расхода токенов OpenAI", removed)
+        return removed
+
+    async def _aggregate(self, group_by: str, since: float, limit: Optional[int] = None) -> List[dict]:
+        sql = (
+            f"SELECT {group_by}, COUNT(*), SUM(status != 'ok'), SUM(input_tokens), SUM(output_tokens), "
+            f"SUM(reasoning_tokens), SUM(cached_tokens), AVG(latency_ms), MAX(latency_ms), SUM(cost_usd) "
+            f"FROM openai_usage WHERE ts >= ? GROUP BY {group_by} ORDER BY SUM(input_tokens + output_tokens) DESC"
+        )
+        params = [since]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = await self.db.fetchall(sql, params)
+        return [
+            {
+                group_by: row[0],
+                "calls": row[1],
+                "errors": row[2],
+                "input_tokens": row[3],
+                "output_tokens": row[4],
+                "reasoning_tokens": row[5],
+                "cached_tokens": row[6],
+                "avg_input_tokens": round(row[3] / row[1]) if row[1] else 0,
+                "avg_latency_ms": round(row[7] or 0, 1),
+                "max_latency_ms": row[8],
+                "cost_usd": round(row[9] or 0, 6),
+            }
+            for row in rows
+        ]
+
+    async def report(self, top_users: int = 20) -> dict:
+        """Суммы по моделям и самые затратные пользователи за каждое окно"""
+        await self.flush()
+        now = self.clock()
+        result = {}
+        for name, seconds in self.windows.items():
+            since = now - seconds
+            result[name] = {
+                "by_model": await self._aggregate("model", since),
+                "top_users": await self._aggregate("user_id", since, top_users),
+            }
+        return result
+
+    async def user_report(self, user_id: int) -> dict:
+        """Расход одного пользователя за каждое окно (по моделям)"""
+        await self.flush()
+        now = self.clock()
+        result = {}
+        for name, seconds in self.windows.items():
+            rows = await self.db.fetchall(
+                "SELECT model, COUNT(*), SUM(input_tokens), SUM(output_tokens), SUM(reasoning_tokens), "
+                "AVG(latency_ms), SUM(cost_usd) FROM openai_usage WHERE user_id = ? AND ts >= ? GROUP BY model",
+                (user_id, now - seconds)
+            )
+            result[name] = [
+                {"model": row[0], "calls": row[1], "input_tokens": row[2], "output_tokens": row[3],
+                 "reasoning_tokens": row[4], "avg_latency_ms": round(row[5] or 0, 1), "cost_usd": round(row[6] or 0, 6)}
+                for row in rows
+            ]
+        return result
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, pending_writes=len(self._pending))
@@ -0,0 +1,285 @@
+import asyncio
+import functools
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# PCM для распознавателя: моно, 16 кГц, 16 бит
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+# Длинные сообщения распознаём кусками, чтобы память оставалась ограниченной
+CHUNK_SECONDS = int(os.getenv('VOICE_CHUNK_SECONDS', '50'))
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
+
+class AudioDecodeError(Exception):
+    """ffmpeg не смог декодировать аудио"""
+
+
+class VoiceJobCancelled(Exception):
+    """Распознавание остановлено: ответ уже не ждут (таймаут или остановка очереди)"""
+
+
+def _read_exactly(stream, size: int) -> bytes:
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+def decode_pcm_chunks(file_content: bytes, chunk_seconds: int = CHUNK_SECONDS,
+                      cancel: Optional[threading.Event] = None) -> Iterator[bytes]:
+    """Декодирует ogg/opus в PCM через каналы ffmpeg (без временных файлов), отдавая куски по chunk_seconds.
+
+    Если выставлен cancel, перед следующим куском ffmpeg убивается и поднимается VoiceJobCancelled.
+    """
+    process = subprocess.Popen(
+        [FFMPEG_BINARY, "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    def feed():
+        # Пишем вход в отдельном потоке, чтобы ffmpeg не заблокировался на заполненном stdout
+        try:
+            process.stdin.write(file_content)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    chunk_bytes = SAMPLE_RATE * SAMPLE_WIDTH * chunk_seconds
+    cancelled = False
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            chunk = _read_exactly(process.stdout, chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if cancelled:
+            process.kill()
+        # Закрываем stdout первым: при досрочном выходе ffmpeg получит EPIPE и завершится
+        process.stdout.close()
+        writer.join()
+        errors = process.stderr.read().decode(errors="replace").strip()
+        process.stderr.close()
+        return_code = process.wait()
+    if cancelled:
+        raise VoiceJobCancelled("voice job cancelled")
+    if return_code != 0:
+        raise AudioDecodeError(errors or f"ffmpeg exited with code {return_code}")
+
+
+def recognize_voice_sync(file_content: bytes, cancel: Optional[threading.Event] = None) -> str:
+    """Распознаёт речь из байтового содержимого ogg-файла (блокирующий вызов для пула). Возвращает текст или строку-ошибку.
+
+    cancel проверяется между кусками: после таймаута поток не распознаёт оставшуюся часть сообщения.
+    """
+    try:
+        import speech_recognition as sr
+        recognizer = sr.Recognizer()
+        texts = []
+        try:
+            for chunk in decode_pcm_chunks(file_content, cancel=cancel):
+                audio_data = sr.AudioData(chunk, SAMPLE_RATE, SAMPLE_WIDTH)
+                try:
+                    texts.append(recognizer.recognize_google(audio_data, language='ru-RU'))
+                except sr.UnknownValueError:
+                    # Тишина или неразборчивый кусок — продолжаем со следующим
+                    continue
+        except VoiceJobCancelled:
+            logger.info("Voice recognition cancelled after %d chunks", len(texts))
+            return "Ошибка: распознавание заняло слишком много времени. Попробуйте еще раз или напишите текст."
+        except (AudioDecodeError, OSError) as audio_error:
+            logger.error("Audio conversion error: %s", audio_error)
+            return "Ошибка при обработке аудио файла. Попробуйте еще раз или напишите текст."
+        except sr.RequestError as e:
+            logger.error("Speech recognition service error: %s", e)
+            return "Ошибка сервиса распознавания речи. Попробуйте еще раз или напишите текст."
+        text_content = " ".join(text for text in texts if text)
+        if not text_content:
+            logger.error("Speech recognition could not understand audio")
+            return "Не удалось разобрать речь. Попробуйте говорить четче или напишите текст."
+        # Текст расшифровки — только в DEBUG: это содержимое сообщения пользователя
+        logger.info("Voice recognized: %d chars from %d chunks", len(text_content), len(texts))
+        logger.debug("Voice recognized text: %r", text_content)
+        return text_content
+    except Exception as e:
+        logger.error("Speech recognition error: %s", e)
+        return "Ошибка при обработке голосового сообщения."
+
+
+class VoiceQueueFull(Exception):
+    """Очередь распознавания переполнена — голосовое сообщение не принято"""
+
+
+class VoicePipeline:
+    """Очередь распознавания голосовых сообщений с пулом потоков/процессов вне event loop.
+
+    Таймаут задания — job_timeout, но не меньше timeout_per_second на секунду аудио. После таймаута
+    заданию выставляется флаг отмены, и воркер ждёт, пока поток остановится: одновременно распознаётся
+    не больше workers сообщений. В режиме процессов флаг не передаётся, и задание дорабатывает до конца.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 20, job_timeout: float = 120.0,
+                 use_processes: bool = False, timeout_per_second: float = 0.5,
+                 recognize: Callable[[bytes, Optional[threading.Event]], str] = recognize_voice_sync):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.timeout_per_second = timeout_per_second
+        self.use_processes = use_processes
+        self.recognize_func = recognize
+        self.queue: Optional[asyncio.Queue] = None
+        self.executor: Optional[Executor] = None
+        self._tasks = []
+        self._in_progress = 0
+        self._stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0, "timeouts": 0}
+        self._wait_times = deque(maxlen=500)
+        self._processing_times = deque(maxlen=500)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Запускает воркеры на текущем event loop"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        if self.use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="voice")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("Voice pipeline started: workers=%s, queue=%s, timeout=%ss, %s", self.workers, self.queue_size,
+                    self.job_timeout, "processes" if self.use_processes else "threads")
+
+    async def stop(self):
+        """Останавливает воркеры; невыполненные задания получают ошибку"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.queue is not None:
+            while not self.queue.empty():
+                _, future, _, _ = self.queue.get_nowait()
+                if not future.done():
+                    future.set_exception(asyncio.CancelledError())
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        logger.info("Voice pipeline stopped")
+
+    def timeout_for(self, duration: float = 0) -> float:
+        """Таймаут задания для сообщения длительностью duration секунд"""
+        return max(self.job_timeout, duration * self.timeout_per_second)
+
+    async def recognize(self, file_content: bytes, duration: float = 0) -> str:
+        """Ставит голосовое сообщение в очередь и ждёт результат; VoiceQueueFull при переполнении"""
+        if not self.running:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((file_content, future, time.perf_counter(), self.timeout_for(duration)))
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            raise VoiceQueueFull(f"voice queue is full ({self.queue_size})")
+        self._stats["accepted"] += 1
+        return await future
+
+    async def _worker(self, number: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            file_content, future, enqueued_at, timeout = await self.queue.get()
+            started = time.perf_counter()
+            self._wait_times.append(started - enqueued_at)
+            self._in_progress += 1
+            cancel = None if self.use_processes else threading.Event()
+            job = None
+            try:
+                if future.done():
+                    continue
+                job = loop.run_in_executor(self.executor, functools.partial(self.recognize_func, file_content, cancel))
+                result = await asyncio.wait_for(asyncio.shield(job), timeout=timeout)
+                self._stats["processed"] += 1
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.TimeoutError as e:
+                self._stats["timeouts"] += 1
+                logger.error("Voice job timed out after %ss (worker %s)", timeout, number)
+                if not future.done():
+                    future.set_exception(e)
+                # Останавливаем поток и ждём его: иначе задания копились бы во внутренней очереди пула
+                if cancel is not None:
+                    cancel.set()
+                await asyncio.gather(job, return_exceptions=True)
+            except asyncio.CancelledError:
+                if cancel is not None:
+                    cancel.set()
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error("Voice job failed (worker %s): %s", number, e)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._in_progress -= 1
+                self._processing_times.append(time.perf_counter() - started)
+                self.queue.task_done()
+
+    @staticmethod
+    def _summary(values) -> dict:
+        if not values:
+            return {"avg_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(values)
+        return {
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1),
+        }
+
+    def get_stats(self) -> dict:
+        """Глубина очереди, счётчики и время ожидания/обработки"""
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "in_progress": self._in_progress,
+            **self._stats,
+            "wait": self._summary(self._wait_times),
+            "processing": self._summary(self._processing_times),
+        }
+
+
+voice_pipeline = VoicePipeline(
+    workers=int(os.getenv('VOICE_WORKERS', '2')),
+    queue_size=int(os.getenv('VOICE_QUEUE_SIZE', '20')),
+    job_timeout=float(os.getenv('VOICE_JOB_TIMEOUT', '120')),
+    timeout_per_second=float(os.getenv('VOICE_TIMEOUT_PER_SECOND', '0.5')),
+    use_processes=os.getenv('VOICE_USE_PROCESSES', '0') == '1',
+)